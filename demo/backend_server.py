@@ -1,6 +1,6 @@
-import pickle
 import random
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from typing import *
 
 import hydra
@@ -14,6 +14,13 @@ from source.text2sql.text_to_sql import Text2SQL
 from source.text2intent.intent_inferer import IntentInferer
 from source.conversation.text2confidence.text_to_confidence import Text2Confidence
 from source.conversation.table2text.table_to_text import Table2Text
+from source.serving import (
+    SessionStore,
+    InferenceQueue,
+    ResponseCache,
+    question_key,
+    content_key,
+)
 
 
 random.seed(0)
@@ -29,21 +36,20 @@ cors = CORS(app)
 logger = logging.getLogger("FlaskServer")
 
 # These will be initialized in main()
-rd_text2sql = None
-rd_analysis = None
-rd_user_intent = None
-rd_table2text = None
+text2sql_cache: ResponseCache = None
+analysis_cache: ResponseCache = None
+user_intent_cache: ResponseCache = None
+table2text_cache: ResponseCache = None
 text_to_sql_model = None
 text_to_intent_model = None
 text_to_confidence_model = None
 table_to_text_model = None
 result_analysis_model = None
 analyser = None
-text_history = ""
-
-
-def generate_redis_key(text: str, db_id: str) -> str:
-    return text + db_id
+sessions: SessionStore = None
+inference_queue: InferenceQueue = None
+cpu_pool: ThreadPoolExecutor = None
+io_pool: ThreadPoolExecutor = None
 
 
 @app.route("/")
@@ -52,11 +58,24 @@ def Testing():
     return "<p>Hello, World!</p>"
 
 
+def get_session_id(params: Dict) -> str:
+    # Clients without a session id share the history of their address
+    return params.get("session_id") or request.remote_addr
+
+
+@app.route("/cache_stats")
+def cache_stats() -> Dict:
+    return {
+        cache.name: cache.stats()
+        for cache in (text2sql_cache, analysis_cache, user_intent_cache, table2text_cache)
+    }
+
+
 @app.route("/reset_history")
 def reset_history() -> Dict:
-    global text_history
-    text_history = ""
-    logger.info("History Reset!")
+    session_id = get_session_id(request.args)
+    sessions.reset(session_id)
+    logger.info(f"History Reset! (session: {session_id})")
     return {"response": True}
 
 
@@ -65,24 +84,23 @@ def table_to_text() -> Dict:
     logger.info(f"Received table2text request from {request.remote_addr}")
     table: List[Dict] = request.json["rows"]
     print("table", table)
-    redis_key = str(table)
-    if rd_table2text.exists(redis_key):
+    cache_key = content_key(table)
+    summary = table2text_cache.get(cache_key)
+    if summary is not None:
         logger.info(f"Returning cached result")
-        summary = pickle.loads(rd_table2text.get(redis_key))
     else:
         if len(table) == 0 or not isinstance(table, list):
             summary = "There is no data in the table."
         else:
             summary: str = table_to_text_model.generate(table)
-        # Save into redis cache
-        rd_table2text.set(redis_key, pickle.dumps(summary))
+        # Save into the cache
+        table2text_cache.set(cache_key, summary)
     logger.info(f"Response: {summary[:20]}...")
     return {"summary": summary}
 
 
 @app.route("/text_to_sql", methods=["POST"])
 def text_to_sql() -> Dict:
-    global text_history
     logger.info(f"Received text2sql request from {request.remote_addr}")
     response = {}
     params: Dict = request.json
@@ -91,94 +109,101 @@ def text_to_sql() -> Dict:
     db_id: str = params["db_id"]
     analyse: bool = params["analyse"]
     reset_history: bool = params["reset_history"]
-    logger.info(
-        f"DB_id: {db_id}, analyse: {analyse}, text: {text} reset_history: {reset_history} text_history: {text_history}"
-    )
-    if reset_history:
-        text_history = ""
-
-    tune_intent = text_to_intent_model.infer(text, db_id, is_tune_check=True)[0]
-
-    if tune_intent:
-        print("tune_intent: ", tune_intent)
-        response = {
-            "pred_sql": "conduct tuning",
-            "confidence": 100,
-            "user_intent": "database_tuning",
-        }
-        return response
-
-    input_text = "<s> " + text + text_history
-
-    # check and return cached result
-    redis_key = generate_redis_key(text=input_text, db_id=db_id)
-    cache_used = False
-    if rd_text2sql.exists(redis_key):
-        logger.info(f"Returning cached result")
-        response = pickle.loads(rd_text2sql.get(redis_key))
-        cache_used = True
-        if not text_history.endswith(text):
-            text_history += " <s> " + text
-    else:
-        orig_item, preproc_item = text_to_sql_model.preprocess(
-            text,
-            text_history,
-            db_id,
+    session = sessions.get(get_session_id(params))
+    with session.lock:
+        if reset_history:
+            session.text_history = ""
+        text_history = session.text_history
+        logger.info(
+            f"DB_id: {db_id}, analyse: {analyse}, text: {text} reset_history: {reset_history} text_history: {text_history} session: {session.session_id}"
         )
 
-        if not text_history.endswith(text):
-            text_history += " <s> " + text
-
-        # translate text to sql
+        # The LLM tune check runs while the turn is being preprocessed
+        tune_future = io_pool.submit(
+            text_to_intent_model.infer, text, db_id, is_tune_check=True
+        )
+        # Tokenization and schema/value linking are shared by all models of this turn
+        turn = text_to_sql_model.new_turn(text, text_history, db_id)
+        preprocess_future = cpu_pool.submit(turn.preprocess)
+
+        tune_intent = tune_future.result()[0]
+        if tune_intent:
+            print("tune_intent: ", tune_intent)
+            preprocess_future.cancel()
+            response = {
+                "pred_sql": "conduct tuning",
+                "confidence": 100,
+                "user_intent": "database_tuning",
+            }
+            return response
+
+        # check and return cached result
+        cache_key = question_key(
+            text, db_id, text_history, history_turns=config.redis.history_turns
+        )
+        cached = text2sql_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"Returning cached result")
+            response = cached
+        else:
+            # translate text to sql
+            preprocess_future.result()
+            beams, inferred_code = inference_queue("text2sql", turn)
+            confidence = text_to_confidence_model.calculate(beams, inferred_code)
+
+            response["confidence"] = f"{confidence:.2f}"
+            response["pred_sql"] = inferred_code
+
+            # Save the result to the cache
+            text2sql_cache.set(cache_key, response)
+        session.text_history = turn.history
+
+        # analyse the result
+        if analyse and float(response["confidence"]) < 80:
+            analyze_result = analysis_cache.get(cache_key)
+            if analyze_result is None:
+                analyze_result = inference_queue("analysis", turn)
+
+                # Save the result to the cache
+                analysis_cache.set(cache_key, analyze_result)
+
+            response["analyse_result"] = analyze_result
+
+        # guess the user's intent
+        user_intent = user_intent_cache.get(cache_key)
+        if user_intent is None:
+            user_intent = [inference_queue("intent", turn)]
+            user_intent_cache.set(cache_key, user_intent)
+        response["user_intent"] = user_intent[0]
+    logger.info(f"Response complete: {response['pred_sql']}")
+    return response
 
-        beams, inferred_code = text_to_sql_model.translate(text, text_history, db_id)
-        confidence = text_to_confidence_model.calculate(beams, inferred_code)
 
-        response["confidence"] = f"{confidence:.2f}"
-        response["pred_sql"] = inferred_code
+def analyze_batch(turns: List[Any]) -> List[Dict]:
+    results = []
+    for turn in turns:
+        orig_item, preproc_item = turn.preprocess()
+        results.append(
+            text_to_confidence_model.analyze(turn.input_text, orig_item, preproc_item)
+        )
+    return results
 
-        # Save the result to redis
-        rd_text2sql.set(redis_key, pickle.dumps(response))
 
-    # analyse the result
-    if analyse and float(response["confidence"]) < 80:
-        if rd_analysis.exists(redis_key):
-            analyze_result = pickle.loads(rd_analysis.get(redis_key))
-        else:
-            if cache_used:
-                orig_item, preproc_item = text_to_sql_model.preprocess(
-                    text,
-                    text_history,
-                    db_id,
-                )
-            analyze_result = text_to_confidence_model.analyze(
-                input_text, orig_item, preproc_item
-            )
-
-            # Save the result to redis
-            rd_analysis.set(redis_key, pickle.dumps(analyze_result))
-
-        response["analyse_result"] = analyze_result
-
-    # guess the user's intent
-    input_changed = input_text[len("<s> ") :]
-    input_changed = input_changed.replace("<s>", "[CLS]")
-    if rd_user_intent.exists(redis_key):
-        user_intent = pickle.loads(rd_user_intent.get(redis_key))
-    else:
-        user_intent = text_to_intent_model.infer(input_text, db_id)
-        rd_user_intent.set(redis_key, pickle.dumps(user_intent))
-    response["user_intent"] = user_intent[0]
-    logger.info(f"Response complete: {response['pred_sql']}")
-    return response
+def infer_intent_batch(turns: List[Any]) -> List[str]:
+    return text_to_intent_model.infer_batch(
+        [turn.input_text for turn in turns],
+        [turn.db_id for turn in turns],
+        turns=turns,
+    )
 
 
 @hydra.main(version_base=None, config_path=ABS_CONFIG_DIR, config_name="config")
 def main(cfg: DictConfig) -> None:
     """Main entry point using Hydra for configuration management"""
-    global config, rd_text2sql, rd_analysis, rd_user_intent, rd_table2text
+    global config, text2sql_cache, analysis_cache, user_intent_cache, table2text_cache
     global text_to_sql_model, text_to_intent_model, text_to_confidence_model, table_to_text_model
     global result_analysis_model, analyser
+    global sessions, inference_queue, cpu_pool, io_pool
 
     config = cfg
 
@@ -192,44 +217,45 @@ def main(cfg: DictConfig) -> None:
     logger.info("Initializing backend server with Hydra configuration...")
     logger.info(f"Configuration:\n{OmegaConf.to_yaml(cfg)}")
 
-    # Initialize redis
-    rd_text2sql = redis.StrictRedis(
-        host=config.redis.host,
-        port=config.redis.port,
-        db=config.redis.api_text2sql_cache_db,
-    )
-
-    rd_analysis = redis.StrictRedis(
-        host=config.redis.host,
-        port=config.redis.port,
-        db=config.redis.api_analyze_cache_db,
-    )
-
-    rd_user_intent = redis.StrictRedis(
-        host=config.redis.host,
-        port=config.redis.port,
-        db=config.redis.api_user_intent_cache_db,
-    )
+    # Initialize the response caches, in Redis if it is reachable
+    def make_cache(name: str, db: int) -> ResponseCache:
+        client = redis.StrictRedis(
+            host=config.redis.host,
+            port=config.redis.port,
+            db=db,
+            socket_timeout=config.redis.socket_timeout_sec,
+            socket_connect_timeout=config.redis.socket_timeout_sec,
+        )
+        try:
+            client.ping()
+        except redis.RedisError as e:
+            logger.warning(f"Redis is unavailable, caching {name} in memory: {e}")
+            client = None
+        return ResponseCache(
+            name,
+            client,
+            ttl_sec=config.redis.ttl_sec,
+            max_entries=config.redis.max_entries,
+        )
 
-    rd_table2text = redis.StrictRedis(
-        host=config.redis.host,
-        port=config.redis.port,
-        db=config.redis.api_table2text_cache_db,
-    )
+    text2sql_cache = make_cache("text2sql", config.redis.api_text2sql_cache_db)
+    analysis_cache = make_cache("analysis", config.redis.api_analyze_cache_db)
+    user_intent_cache = make_cache("user_intent", config.redis.api_user_intent_cache_db)
+    table2text_cache = make_cache("table2text", config.redis.api_table2text_cache_db)
 
     if config.redis.is_flush:
-        logger.info("Flushing Redis databases...")
-        rd_text2sql.flushdb()
-        rd_analysis.flushdb()
-        rd_user_intent.flushdb()
-        rd_table2text.flushdb()
+        logger.info("Flushing response caches...")
+        for cache in (text2sql_cache, analysis_cache, user_intent_cache, table2text_cache):
+            cache.clear()
 
     # Initialize models
     logger.info("Loading text-to-sql model...")
     text_to_sql_model = Text2SQL(config, config.text2sql)
 
     logger.info("Loading text-to-intent model...")
-    text_to_intent_model = IntentInferer(config, config.text2intent)
+    text_to_intent_model = IntentInferer(
+        config, config.text2intent, preprocessor=text_to_sql_model.preprocessor
+    )
 
     logger.info("Loading result analysis model...")
     text_to_confidence_model = Text2Confidence(config.conversation.text2confidence)
@@ -237,8 +263,27 @@ def main(cfg: DictConfig) -> None:
     logger.info("Loading table-to-text model...")
     table_to_text_model = Table2Text(config.conversation.table2text)
 
+    # Serving: per-session state, worker pools and the GPU micro-batching queue
+    sessions = SessionStore(
+        max_sessions=config.serving.max_sessions,
+        ttl_sec=config.serving.session_ttl_sec,
+    )
+    cpu_pool = ThreadPoolExecutor(
+        config.serving.cpu_workers, thread_name_prefix="preprocess"
+    )
+    io_pool = ThreadPoolExecutor(config.serving.io_workers, thread_name_prefix="llm")
+    inference_queue = InferenceQueue(
+        {
+            "text2sql": text_to_sql_model.translate_batch,
+            "intent": infer_intent_batch,
+            "analysis": analyze_batch,
+        },
+        max_batch_size=config.serving.max_batch_size,
+        max_wait_ms=config.serving.max_batch_wait_ms,
+    )
+
     logger.info(f"Starting server on {config.host}:{config.port}")
-    serve(app, host=config.host, port=config.port)
+    serve(app, host=config.host, port=config.port, threads=config.serving.threads)
 
 
 if __name__ == "__main__":
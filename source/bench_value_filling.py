@@ -0,0 +1,115 @@
+"""Latency per filled value, before and after the ValueFiller, on a synthetic SQLite table.
+
+    python -m source.bench_value_filling --rows 2000000 --lookups 200
+
+"before" opens a connection and scans the whole column for every value, as
+add_value_one_sql used to; "after" looks the value up in the index of a
+ValueFiller, which reads the distinct values once (reported as "index build").
+"""
+import os
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+
+import numpy as np
+
+from source.value_filling import ValueFiller, sqlite_connector
+
+CITIES = [f"city {i}" for i in range(300)]
+CUSTOMERS = [f"customer{i}" for i in range(5000)]
+
+
+def create_db(path: str, rows: int, seed: int) -> None:
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE orders (id INTEGER PRIMARY KEY, city TEXT, customer TEXT)")
+    batch = 100000
+    for start in range(0, rows, batch):
+        conn.executemany(
+            "INSERT INTO orders VALUES (?, ?, ?)",
+            (
+                (i, rng.choice(CITIES), rng.choice(CUSTOMERS))
+                for i in range(start, min(rows, start + batch))
+            ),
+        )
+    conn.commit()
+    conn.close()
+
+
+def legacy_find_value(path: str, table: str, column: str, text: str):
+    # The former all_values_from_db + scan of add_value_one_sql
+    conn = sqlite3.connect(path)
+    try:
+        values = [str(row[0]) for row in conn.execute(f"SELECT {column} FROM {table}")]
+    finally:
+        conn.close()
+    for value in values:
+        if value.lower() in text:
+            return value
+    return None
+
+
+def summarize(name: str, latencies) -> None:
+    latencies = np.asarray(latencies) * 1e3
+    print(
+        f"{name:12} mean {latencies.mean():10.3f} ms  p50 {np.percentile(latencies, 50):10.3f} ms  "
+        f"p95 {np.percentile(latencies, 95):10.3f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2000000)
+    parser.add_argument("--lookups", type=int, default=200)
+    parser.add_argument("--legacy-lookups", type=int, default=5, help="the old path takes seconds each")
+    parser.add_argument("--db-dir", default=None, help="where the synthetic database is created")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    db_dir = args.db_dir or tempfile.mkdtemp()
+    path = os.path.join(db_dir, "bench.sqlite")
+    if not os.path.exists(path):
+        start = time.monotonic()
+        create_db(path, args.rows, args.seed)
+        print(f"created {args.rows} rows in {time.monotonic() - start:.1f}s at {path}")
+
+    rng = random.Random(args.seed)
+    questions = [
+        (column, f"how many orders were placed in {value} last year")
+        for column, value in (
+            rng.choice([("city", rng.choice(CITIES)), ("customer", rng.choice(CUSTOMERS))])
+            for _ in range(args.lookups)
+        )
+    ]
+
+    before = []
+    for column, question in questions[: args.legacy_lookups]:
+        start = time.monotonic()
+        value = legacy_find_value(path, "orders", column, question)
+        before.append(time.monotonic() - start)
+        assert value is not None and value.lower() in question
+
+    filler = ValueFiller(sqlite_connector(path.replace("{", "{{").replace("}", "}}")))
+    build = []
+    for column in ("city", "customer"):
+        start = time.monotonic()
+        filler.column_values("bench", "orders", column)
+        build.append(time.monotonic() - start)
+    after = []
+    for column, question in questions:
+        start = time.monotonic()
+        value = filler.find_value("bench", "orders", column, question)
+        after.append(time.monotonic() - start)
+        assert value is not None and value.lower() in question
+    filler.close()
+
+    summarize("before", before)
+    summarize("index build", build)
+    summarize("after", after)
+    print(f"speedup (mean, excluding index build): {np.mean(before) / np.mean(after):.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+import json
+import time
+import queue
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, defaultdict
+from concurrent.futures import Future
+from typing import *
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+# Sorted set of the keys of a Redis cache database, scored by last access time
+LRU_KEY = "__lru__"
+# Time to wait before trying Redis again after an error
+REDIS_RETRY_SEC = 30.0
+
+
+class Session:
+    """Conversation state of one client of the backend server."""
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.text_history = ""
+        self.last_used = time.monotonic()
+        # Turns of one session are handled in order, other sessions run concurrently
+        self.lock = threading.Lock()
+
+
+class SessionStore:
+    """Bounded store of per-session state, evicting idle sessions first."""
+
+    def __init__(self, max_sessions: int = 1000, ttl_sec: float = 3600.0):
+        """Initialize the session store.
+
+        Args:
+            max_sessions: Maximum number of sessions kept in memory
+            ttl_sec: Idle time after which a session is forgotten
+        """
+        self.max_sessions = max_sessions
+        self.ttl_sec = ttl_sec
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> Session:
+        """Return the session for the id, creating it if needed."""
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or now - session.last_used > self.ttl_sec:
+                session = Session(session_id)
+                self._sessions[session_id] = session
+            session.last_used = now
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return session
+
+    def reset(self, session_id: str) -> None:
+        """Forget the conversation history of the session."""
+        self.get(session_id).text_history = ""
+
+
+class InferenceQueue:
+    """Runs all GPU work on one thread, micro-batching concurrent requests.
+
+    Requests are grouped by kind. Each handler receives the payloads of one
+    micro-batch and returns one result per payload, in order.
+    """
+
+    def __init__(
+        self,
+        handlers: Dict[str, Callable[[List[Any]], List[Any]]],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 5.0,
+    ):
+        """Initialize the queue and start its worker thread.
+
+        Args:
+            handlers: Batch function for each request kind
+            max_batch_size: Maximum number of requests handled in one micro-batch
+            max_wait_ms: Time to wait for more requests after the first one arrives
+        """
+        self.handlers = handlers
+        self.max_batch_size = max_batch_size
+        self.max_wait_sec = max_wait_ms / 1000
+        self._queue: "queue.Queue[Tuple[str, Any, Future]]" = queue.Queue()
+        self._worker = threading.Thread(
+            target=self._run, name="InferenceQueue", daemon=True
+        )
+        self._worker.start()
+
+    def submit(self, kind: str, payload: Any) -> Future:
+        """Queue a request and return a future for its result."""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown request kind: {kind}")
+        future = Future()
+        self._queue.put((kind, payload, future))
+        return future
+
+    def __call__(self, kind: str, payload: Any) -> Any:
+        """Queue a request and wait for its result."""
+        return self.submit(kind, payload).result()
+
+    def _next_batch(self) -> List[Tuple[str, Any, Future]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_sec
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            by_kind = defaultdict(list)
+            for kind, payload, future in self._next_batch():
+                if future.set_running_or_notify_cancel():
+                    by_kind[kind].append((payload, future))
+            for kind, requests in by_kind.items():
+                payloads = [payload for payload, _ in requests]
+                try:
+                    results = list(self.handlers[kind](payloads))
+                    if len(results) != len(payloads):
+                        raise RuntimeError(
+                            f"The {kind} handler returned {len(results)} results for {len(payloads)} requests"
+                        )
+                except Exception as e:
+                    logger.exception(f"Failed to handle {len(payloads)} {kind} requests")
+                    for _, future in requests:
+                        future.set_exception(e)
+                    continue
+                for (_, future), result in zip(requests, results):
+                    future.set_result(result)
+
+
+def normalize_question(text: str) -> str:
+    """Lower-cased text with runs of whitespace collapsed, so that spacing and casing variants share a key."""
+    return " ".join(text.lower().split())
+
+
+def question_key(text: str, db_id: str, text_history: str = "", history_turns: int = 0) -> str:
+    """Cache key of a turn: db_id and a hash of the normalized text and history.
+
+    Args:
+        text: Current user text
+        db_id: Database the question is asked on
+        text_history: Conversation history before this turn ("<s>"-separated)
+        history_turns: Number of most recent previous turns in the key (0: all of them)
+    """
+    turns = [normalize_question(turn) for turn in text_history.split("<s>")]
+    turns = [turn for turn in turns if turn]
+    if history_turns > 0:
+        turns = turns[-history_turns:]
+    digest = hashlib.sha1(
+        "\x1f".join([normalize_question(text)] + turns).encode("utf-8")
+    ).hexdigest()
+    return f"{db_id}:{digest}"
+
+
+def content_key(value: Any) -> str:
+    """Cache key of a JSON-like value (e.g. table rows), independent of dict ordering."""
+    data = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def _to_builtin(obj: Any) -> Any:
+    # numpy / torch scalars and arrays
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    return str(obj)
+
+
+def dumps(value: Any) -> bytes:
+    """Compact serialization of a response: msgpack if installed, JSON otherwise."""
+    if msgpack is not None:
+        return b"m" + msgpack.packb(value, use_bin_type=True, default=_to_builtin)
+    return b"j" + json.dumps(value, separators=(",", ":"), default=_to_builtin).encode("utf-8")
+
+
+def loads(data: bytes) -> Any:
+    if data[:1] == b"m":
+        # Responses may have non-string keys (e.g. column indices)
+        return msgpack.unpackb(data[1:], raw=False, strict_map_key=False)
+    if data[:1] == b"j":
+        return json.loads(data[1:])
+    raise ValueError("Unknown cache entry format")
+
+
+class LRUCache:
+    """In-process cache of at most max_entries serialized values, expiring after ttl_sec."""
+
+    def __init__(self, max_entries: int = 10000, ttl_sec: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Tuple[Optional[float], bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, data = entry
+            if expires_at is not None and time.monotonic() > expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return data
+
+    def set(self, key: str, data: bytes) -> None:
+        expires_at = time.monotonic() + self.ttl_sec if self.ttl_sec else None
+        with self._lock:
+            self._entries[key] = (expires_at, data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class ResponseCache:
+    """Cache of server responses in a Redis database, bounded by TTL and LRU size.
+
+    Every entry expires ttl_sec after being written. The keys are also kept
+    in a sorted set by last access, and the least recently used ones are
+    deleted when there are more than max_entries. Without a Redis client, or
+    while Redis fails, entries are kept in an in-process LRUCache instead.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        client: Any = None,
+        ttl_sec: Optional[float] = 86400.0,
+        max_entries: int = 10000,
+    ):
+        """Initialize the cache.
+
+        Args:
+            name: Name used in logs and statistics
+            client: Redis client of the database holding this cache (None: in-process only)
+            ttl_sec: Lifetime of an entry (None or 0: no expiry)
+            max_entries: Maximum number of entries kept
+        """
+        self.name = name
+        self.client = client
+        self.ttl_sec = ttl_sec or None
+        self.max_entries = max_entries
+        self.local = LRUCache(max_entries, self.ttl_sec)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+        self._redis_down_until = 0.0
+        self._lock = threading.Lock()
+
+    def _redis(self) -> Any:
+        if self.client is None or time.monotonic() < self._redis_down_until:
+            return None
+        return self.client
+
+    def _redis_failed(self, error: Exception) -> None:
+        logger.warning(
+            f"Redis failed for the {self.name} cache, using the in-process cache "
+            f"for {REDIS_RETRY_SEC:.0f}s: {error}"
+        )
+        with self._lock:
+            self.errors += 1
+        self._redis_down_until = time.monotonic() + REDIS_RETRY_SEC
+
+    def _count(self, counter: str, n: int = 1) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + n)
+
+    def get(self, key: str) -> Optional[Any]:
+        """The cached value of the key, or None."""
+        data = None
+        client = self._redis()
+        if client is not None:
+            try:
+                pipe = client.pipeline(transaction=False)
+                pipe.get(key)
+                pipe.zadd(LRU_KEY, {key: time.time()}, xx=True)
+                data = pipe.execute()[0]
+                if data is None:
+                    # Expired entries leave their key in the LRU set
+                    client.zrem(LRU_KEY, key)
+            except Exception as e:
+                self._redis_failed(e)
+                client = None
+        if client is None:
+            data = self.local.get(key)
+        value = None
+        if data is not None:
+            try:
+                value = loads(data)
+            except Exception as e:
+                # e.g. written by another version of the server
+                logger.warning(f"Ignoring undecodable entry of the {self.name} cache: {e}")
+                data = None
+        self._count("misses" if data is None else "hits")
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        """Cache the value, evicting the least recently used entries above max_entries."""
+        data = dumps(value)
+        client = self._redis()
+        if client is None:
+            self.local.set(key, data)
+            return
+        try:
+            now = time.time()
+            pipe = client.pipeline(transaction=False)
+            pipe.set(key, data, ex=max(1, int(self.ttl_sec)) if self.ttl_sec else None)
+            pipe.zadd(LRU_KEY, {key: now})
+            if self.ttl_sec:
+                pipe.zremrangebyscore(LRU_KEY, "-inf", now - self.ttl_sec)
+            pipe.zcard(LRU_KEY)
+            size = pipe.execute()[-1]
+            if size > self.max_entries:
+                victims = [member for member, _ in client.zpopmin(LRU_KEY, size - self.max_entries)]
+                if victims:
+                    self._count("evictions", client.delete(*victims))
+        except Exception as e:
+            self._redis_failed(e)
+            self.local.set(key, data)
+
+    def clear(self) -> None:
+        """Drop all entries (flushes the Redis database of this cache)."""
+        self.local.clear()
+        client = self._redis()
+        if client is not None:
+            try:
+                client.flushdb()
+            except Exception as e:
+                self._redis_failed(e)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit, miss and eviction counters of the cache."""
+        with self._lock:
+            return {
+                "backend": "redis" if self._redis() is not None else "local",
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions + self.local.evictions,
+                "errors": self.errors,
+                "local_entries": len(self.local),
+            }
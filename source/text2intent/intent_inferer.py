@@ -4,10 +4,10 @@ import json
 import hydra
 import requests
 import _jsonnet
-from typing import List, Any, Dict
+from typing import List, Any, Dict, Optional
 from config.path import ABS_CONFIG_DIR
 from omegaconf import DictConfig
-from source.utils import One_time_Preprocesser
+from source.utils import One_time_Preprocesser, TurnContext
 from source.text2sql.ratsql.commands.infer import Inferer
 
 
@@ -18,12 +18,15 @@ class IntentInferer:
     execute a query or perform database tuning/administration tasks.
     """
 
-    def __init__(self, global_cfg, cfg):
+    def __init__(
+        self, global_cfg, cfg, preprocessor: Optional[One_time_Preprocesser] = None
+    ):
         """Initialize IntentInferer with model and preprocessor.
 
         Args:
             global_cfg: Global configuration with database, table, and text2sql paths
             cfg: Intent-specific configuration with model paths
+            preprocessor: Preprocessor to share with Text2SQL (default: build a new one)
 
         Raises:
             RuntimeError: If text2sql experiment config file does not exist
@@ -78,9 +81,11 @@ class IntentInferer:
                 f"config file does not exist: {text2sql_experiment_config_path}"
             )
 
-        self.preprocessor = One_time_Preprocesser(
-            db_path, table_path, text2sql_model_config["model"]["encoder_preproc"]
-        )
+        if preprocessor is None:
+            preprocessor = One_time_Preprocesser(
+                db_path, table_path, text2sql_model_config["model"]["encoder_preproc"]
+            )
+        self.preprocessor = preprocessor
 
         inferer = Inferer(intent_model_config)
         self.model, _ = inferer.load_model(intent_model_ckpt_dir_path)
@@ -136,12 +141,19 @@ class IntentInferer:
             ),
         )
 
-    def infer(self, input_text: str, db_id: str, is_tune_check=False) -> List[str]:
+    def infer(
+        self,
+        input_text: str,
+        db_id: str,
+        is_tune_check=False,
+        turn: Optional[TurnContext] = None,
+    ) -> List[str]:
         """Infer user intent from input text.
 
         Args:
             input_text: User query text with <s> tokens for conversation history
             db_id: Database identifier for schema context
+            turn: Turn context to share preprocessing results with other modules
 
         Returns:
             List of predicted intent labels (e.g., ['query'] or ['database_tuning'])
@@ -167,29 +179,62 @@ class IntentInferer:
             return [is_tune]
 
         else:
-            model_input = self.preprocess(input_text, db_id)
-            enc_features = self.model.encoder(model_input)
-            logits = self.model.decoder.decoder_layers(enc_features)
-            pred_ids = logits.argmax(dim=1)
-            pred_labels = [self.model.decoder.output_classes[id] for id in pred_ids]
-            return pred_labels
-
-    def preprocess(self, input_text: str, db_id: str) -> List[Any]:
+            return self.infer_batch([input_text], [db_id], turns=[turn])
+
+    def infer_batch(
+        self,
+        input_texts: List[str],
+        db_ids: List[str],
+        turns: Optional[List[Optional[TurnContext]]] = None,
+    ) -> List[str]:
+        """Infer the intents of several inputs with one encoder pass.
+
+        Args:
+            input_texts: User query texts with <s> tokens for conversation history
+            db_ids: Database identifier of each input
+            turns: Turn context of each input (default: no shared preprocessing)
+
+        Returns:
+            Predicted intent label of each input
+        """
+        if turns is None:
+            turns = [None] * len(input_texts)
+        model_input = [
+            item
+            for input_text, db_id, turn in zip(input_texts, db_ids, turns)
+            for item in self.preprocess(input_text, db_id, turn=turn)
+        ]
+        enc_features = self.model.encoder(model_input)
+        logits = self.model.decoder.decoder_layers(enc_features)
+        pred_ids = logits.argmax(dim=1)
+        pred_labels = [self.model.decoder.output_classes[id] for id in pred_ids]
+        return pred_labels
+
+    def preprocess(
+        self, input_text: str, db_id: str, turn: Optional[TurnContext] = None
+    ) -> List[Any]:
         """Preprocess input text for intent classification.
 
         Args:
             input_text: User query text with <s> separator tokens
             db_id: Database identifier for schema context
+            turn: Turn context to memoize the result in
 
         Returns:
             List containing preprocessed item ready for model input
 
         Note:
             Removes leading "<s> " and replaces remaining "<s>" with "[CLS]" tokens.
+            The changed text is tokenized and linked on its own: "[CLS]" is a
+            single BERT token while "<s>" is three, and the links of the
+            surrounding n-grams differ, so the text2sql item can't be reused.
         """
         input_changed = input_text[len("<s> ") :]
         input_changed = input_changed.replace("<s>", "[CLS]")
-        _, preproc_item = self.preprocessor.run(input_changed, db_id)
+        if turn is None:
+            _, preproc_item = self.preprocessor.run(input_changed, db_id)
+        else:
+            _, preproc_item = turn.preprocess(input_changed)
         return [preproc_item]
 
     def tune_check_preprocess(self, input_text: str) -> List[Any]:
@@ -0,0 +1,144 @@
+"""Times RelationalTransformerUpdate.compute_relations on the largest schemas.
+
+    python -m source.text2sql.ratsql.commands.bench_relations --tables data/spider/tables.json
+
+For every schema, compute_relations and the cell by cell reference
+implementation (_compute_relations_loop) are timed on random token boundaries
+and schema links. "cold" times the first call for a schema, "warm" the
+following ones, which reuse the cached schema relations. Their equivalence is
+checked by tests/test_relations.py.
+"""
+import argparse
+import collections
+import json
+import timeit
+
+import numpy as np
+
+from source.text2sql.ratsql.models.spider.spider_enc_modules import (
+    RelationalTransformerUpdate,
+)
+
+CONFIGS = {
+    "default": dict(sc_link=True, cv_link=True),
+    "merge_types": dict(
+        sc_link=True,
+        cv_link=True,
+        merge_types=True,
+        cc_foreign_key=False,
+        cc_table_match=False,
+        ct_foreign_key=False,
+        ct_table_match=False,
+        tc_foreign_key=False,
+        tc_table_match=False,
+        tt_foreign_key=False,
+    ),
+}
+
+
+def schema_desc(schema_dict):
+    """The schema part of a preprocessed item, as built by SpiderEncoderV2Preproc."""
+    column_to_table = {
+        str(col): (None if table < 0 else table)
+        for col, (table, _) in enumerate(schema_dict["column_names"])
+    }
+    foreign_keys = {str(src): dst for src, dst in schema_dict["foreign_keys"]}
+    foreign_keys_tables = collections.defaultdict(set)
+    for src, dst in schema_dict["foreign_keys"]:
+        foreign_keys_tables[str(column_to_table[str(src)])].add(column_to_table[str(dst)])
+    return {
+        "db_id": schema_dict["db_id"],
+        "column_to_table": column_to_table,
+        "foreign_keys": foreign_keys,
+        "foreign_keys_tables": {k: sorted(v) for k, v in foreign_keys_tables.items()},
+        "primary_keys": list(schema_dict["primary_keys"]),
+    }
+
+
+def random_boundaries(rng, num_items, max_tokens):
+    return [0] + list(np.cumsum(rng.randint(1, max_tokens + 1, size=num_items)).tolist())
+
+
+def random_links(rng, q_length, num_items, tags, density):
+    links = {}
+    for _ in range(int(q_length * num_items * density)):
+        links[f"{rng.randint(q_length)},{rng.randint(num_items)}"] = tags[rng.randint(len(tags))]
+    return links
+
+
+def make_inputs(rng, schema_dict, q_length, max_tokens, density):
+    desc = schema_desc(schema_dict)
+    c_boundaries = random_boundaries(rng, len(desc["column_to_table"]), max_tokens)
+    t_boundaries = random_boundaries(rng, len(schema_dict["table_names"]), max_tokens)
+    c_length, t_length = c_boundaries[-1], t_boundaries[-1]
+    desc["sc_link"] = {
+        "q_col_match": random_links(rng, q_length, c_length, ["CEM", "CPM"], density),
+        "q_tab_match": random_links(rng, q_length, t_length, ["TEM", "TPM"], density),
+    }
+    desc["cv_link"] = {
+        "num_date_match": random_links(rng, q_length, c_length, ["NUMBER", "TIME"], density),
+        "cell_match": random_links(rng, q_length, c_length, ["CELLMATCH"], density),
+    }
+    kwargs = dict(
+        enc_length=q_length + c_length + t_length,
+        q_enc_length=q_length,
+        c_enc_length=c_length,
+        c_boundaries=c_boundaries,
+        t_boundaries=t_boundaries,
+    )
+    return desc, kwargs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tables", required=True, help="Spider tables.json")
+    parser.add_argument("--top", type=int, default=5, help="number of largest schemas")
+    parser.add_argument("--question-length", type=int, default=40)
+    parser.add_argument("--max-tokens", type=int, default=3, help="max tokens per column/table")
+    parser.add_argument("--link-density", type=float, default=0.01)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with open(args.tables) as f:
+        schema_dicts = json.load(f)
+    schema_dicts.sort(key=lambda s: len(s["column_names"]) + len(s["table_names"]), reverse=True)
+    rng = np.random.RandomState(args.seed)
+
+    for config_name, config in CONFIGS.items():
+        update = RelationalTransformerUpdate(
+            "cpu", num_layers=1, num_heads=1, hidden_size=8, **config
+        )
+        print(f"== {config_name}")
+        print(f"{'db_id':32} {'length':>6} {'loop ms':>9} {'cold ms':>9} {'warm ms':>9} {'speedup':>8}")
+        for schema_dict in schema_dicts[: args.top]:
+            desc, kwargs = make_inputs(
+                rng, schema_dict, args.question_length, args.max_tokens, args.link_density
+            )
+            update._schema_relations_cache.clear()
+            start = timeit.default_timer()
+            update.compute_relations(desc, **kwargs)
+            cold = timeit.default_timer() - start
+
+            loop = min(
+                timeit.repeat(
+                    lambda: update._compute_relations_loop(desc, **kwargs),
+                    number=1,
+                    repeat=args.repeat,
+                )
+            )
+            warm = min(
+                timeit.repeat(
+                    lambda: update.compute_relations(desc, **kwargs),
+                    number=1,
+                    repeat=args.repeat,
+                )
+            )
+            print(
+                f"{desc['db_id'][:32]:32} {kwargs['enc_length']:6d} {loop * 1e3:9.2f} "
+                f"{cold * 1e3:9.2f} {warm * 1e3:9.2f} {loop / warm:7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
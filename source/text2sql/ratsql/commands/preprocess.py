@@ -1,5 +1,6 @@
 import argparse
 import json
+import multiprocessing
 
 import _jsonnet
 import tqdm
@@ -15,6 +16,8 @@ from source.text2sql.ratsql import grammars
 # noinspection PyUnresolvedReferences
 from source.text2sql.ratsql import models
 
+from source.text2sql.ratsql.utils import indexed_file
+
 # noinspection PyUnresolvedReferences
 from source.text2sql.ratsql.utils import registry
 
@@ -22,34 +25,98 @@ from source.text2sql.ratsql.utils import registry
 from source.text2sql.ratsql.utils import vocab
 
 
+class PreprocCache:
+    """Preprocessed items keyed by question, in an indexed file that survives interruptions.
+
+    Each record is the JSON key and the JSON (enc, dec) item on two lines; only
+    the keys are read when opening, the items are read through mmap on lookup.
+    An interrupted run resumes after the last committed record.
+    """
+
+    def __init__(self, path, legacy_path=None):
+        self.writer = indexed_file.IndexedFileWriter(path, resume=True)
+        self.reader = indexed_file.IndexedFileReader(path)
+        self.keys = {
+            json.loads(self.reader.head(idx)): idx for idx in range(len(self.reader))
+        }
+        if not self.keys and legacy_path and os.path.isfile(legacy_path):
+            self._import_jsonl(legacy_path)
+
+    def _import_jsonl(self, path):
+        # Cache of earlier versions, one {key: item} object per line
+        with open(path) as f:
+            for line in tqdm.tqdm(f, desc=f"importing {path}", dynamic_ncols=True):
+                for key, value in json.loads(line).items():
+                    self.add(key, value)
+        self.reader = indexed_file.IndexedFileReader(self.writer.path)
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def __getitem__(self, key):
+        idx = self.keys[key]
+        if idx >= len(self.reader):
+            # Written in this run, after the file was mapped
+            self.reader.close()
+            self.reader = indexed_file.IndexedFileReader(self.writer.path)
+        value = self.reader[idx]
+        return json.loads(value[value.index(b"\n") + 1 :])
+
+    def add(self, key, value):
+        if key in self.keys:
+            return
+        self.keys[key] = len(self.writer)
+        record = json.dumps(key) + "\n" + json.dumps(value, ensure_ascii=False) + "\n"
+        self.writer.append(record.encode("utf-8"))
+
+    def close(self):
+        self.writer.close()
+        self.reader.close()
+
+
+def item_key(item):
+    return f"<db_id>:[{item.schema.db_id}]<text>:{item.text}<query>:[{item.orig['query']}]"
+
+
+def preprocess_item(model_preproc, item, section):
+    """validate_item and add_item; returns whether the item was added and its (enc, dec) item."""
+    to_add, validation_info = model_preproc.validate_item(item, section)
+    if not to_add:
+        return False, None
+    return model_preproc.add_item(item, section, validation_info)
+
+
+# Preprocessor and dataset section of a worker process
+_worker = {}
+
+
+def _init_worker(config, section):
+    _worker["model_preproc"] = registry.instantiate(
+        registry.lookup("model", config["model"]).Preproc, config["model"]
+    )
+    _worker["data"] = registry.construct("dataset", config["data"][section])
+    _worker["section"] = section
+
+
+def _preprocess_in_worker(idx):
+    model_preproc = _worker["model_preproc"]
+    is_added, enc_dec_preproc_item = preprocess_item(
+        model_preproc, _worker["data"][idx], _worker["section"]
+    )
+    # The main process collects the items, don't keep them here
+    model_preproc.clear_items()
+    return is_added, enc_dec_preproc_item
+
+
 class Preprocessor:
-    def __init__(self, config):
+    def __init__(self, config, num_workers=1):
         self.config = config
+        self.num_workers = num_workers
         self.model_preproc = registry.instantiate(
             registry.lookup("model", config["model"]).Preproc, config["model"]
         )
 
     def preprocess(self):
-        def load_cache(path, is_toy=False):
-            cache = {}
-            if os.path.isfile(path):
-                with open(path, "r") as f:
-                    cnt = 0
-                    for line in tqdm.tqdm(f.readlines()):
-                        if is_toy and cnt > 100:
-                            break
-                        tmp = json.loads(line)
-                        if any(key in cache for key in tmp.keys()):
-                            print("already exist")
-                        else:
-                            cache.update(tmp)
-                        cnt += 1
-            return cache
-
-        def write_cache(path, data):
-            with open(path, "a") as f:
-                f.write(json.dumps(data, ensure_ascii=False) + "\n")
-
         self.model_preproc.clear_items()
         sections = [item for item in self.config["data"].keys()]
         if "test" in sections:
@@ -57,8 +124,35 @@ class Preprocessor:
             sections.append("test")
         for section in sections:
             data = registry.construct("dataset", self.config["data"][section])
-            # Load Cache (TODO: call it outside the loop)
-            cache = load_cache(data.cache_path)
+            cache = PreprocCache(
+                os.path.splitext(data.cache_path)[0] + ".rec", legacy_path=data.cache_path
+            )
+            try:
+                self._preprocess_section(section, data, cache)
+            finally:
+                cache.close()
+        self.model_preproc.save()
+
+    def _preprocess_section(self, section, data, cache):
+        keys = [item_key(item) for item in data]
+        missing = [idx for idx, key in enumerate(keys) if key not in cache]
+        missing_set = set(missing)
+        pool = None
+        if (
+            self.num_workers > 1
+            and len(missing) > 1
+            and hasattr(self.model_preproc, "add_preprocessed_item")
+            # The encoder preprocessor must count the vocab of items it did not preprocess
+            and hasattr(getattr(self.model_preproc, "enc_preproc", None), "add_preprocessed_item")
+        ):
+            # Workers preprocess the missing items ahead of the loop below, in order
+            pool = multiprocessing.Pool(
+                min(self.num_workers, len(missing)),
+                initializer=_init_worker,
+                initargs=(self.config, section),
+            )
+            fresh = pool.imap(_preprocess_in_worker, missing, chunksize=8)
+        try:
             for idx, item in enumerate(
                 tqdm.tqdm(data, desc=f"{section} section", dynamic_ncols=True)
             ):
@@ -68,8 +162,8 @@ class Preprocessor:
                 so I execute validate_item at the end of add_item.
                 """
                 # Use cached data if possible
-                key = f"<db_id>:[{item.schema.db_id}]<text>:{item.text}<query>:[{item.orig['query']}]"
-                if key in cache:
+                key = keys[idx]
+                if idx not in missing_set:
                     redo_decoder_preproc = True
                     if redo_decoder_preproc:
                         dec_result, dec_info = (
@@ -82,26 +176,35 @@ class Preprocessor:
                         )
                     else:
                         self.model_preproc.add_item_from_cache(cache[key], section)
+                    continue
+
+                if pool is not None:
+                    is_added, enc_dec_preproc_item = next(fresh)
+                    if is_added:
+                        self.model_preproc.add_preprocessed_item(
+                            item, section, enc_dec_preproc_item
+                        )
                 else:
-                    to_add, validation_info = self.model_preproc.validate_item(
-                        item, section
+                    is_added, enc_dec_preproc_item = preprocess_item(
+                        self.model_preproc, item, section
                     )
-                    if to_add:
-                        is_added, enc_dec_preproc_item = self.model_preproc.add_item(
-                            item, section, validation_info
-                        )
-                        if is_added:
-                            # Save cache
-                            write_cache(data.cache_path, {key: enc_dec_preproc_item})
-                    if not to_add or not is_added:
-                        print(f"Skipping... section:{section} idx:{idx}")
-        self.model_preproc.save()
+                if is_added:
+                    # Save cache
+                    cache.add(key, enc_dec_preproc_item)
+                else:
+                    print(f"Skipping... section:{section} idx:{idx}")
+        finally:
+            if pool is not None:
+                pool.terminate()
 
 
 def add_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument("--config", required=True)
     parser.add_argument("--config-args")
+    parser.add_argument(
+        "--num-workers", type=int, default=1, help="processes preprocessing the items"
+    )
     args = parser.parse_args()
     return args
 
@@ -114,7 +217,7 @@ def main(args):
     else:
         config = json.loads(_jsonnet.evaluate_file(args.config))
 
-    preprocessor = Preprocessor(config)
+    preprocessor = Preprocessor(config, num_workers=getattr(args, "num_workers", 1))
     preprocessor.preprocess()
 
 
@@ -55,6 +55,7 @@ class Schema:
     foreign_key_graph = attr.ib()
     orig = attr.ib()
     connection = attr.ib(default=None)
+    value_index = attr.ib(default=None, repr=False, eq=False)
 
 
 def postprocess_original_name(s: str):
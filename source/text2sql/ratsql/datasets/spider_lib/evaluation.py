@@ -4,8 +4,10 @@ import json
 from source.text2sql.ratsql.datasets.spider_lib import (
     evaluation_postgres,
     evaluation_spider,
+    exec_eval,
 )
 from source.text2sql.ratsql.datasets.spider_lib.evaluation_spider import *
+from source.text2sql.ratsql.datasets.utils import db_utils
 from source.text2sql.ratsql.grammars.postgres import POSTGRES_GRAMMAR_IDENTIFIERS
 from source.text2sql.ratsql.grammars.spider import SPIDER_GRAMMAR_IDENTIFIERS
 
@@ -20,19 +22,46 @@ def Evaluator(*args, **kwargs):
         raise KeyError(f"no such grammar: {grammar}")
 
 
-def evaluate(gold, predict, db_dir, etype, kmaps, db_type="sqlite", grammar="spider"):
+def evaluate(
+    gold,
+    predict,
+    db_dir,
+    etype,
+    kmaps,
+    db_type="sqlite",
+    grammar="spider",
+    tables=(),
+    num_workers=None,
+    timeout=exec_eval.DEFAULT_TIMEOUT,
+    gold_cache_dir=None,
+):
     with open(gold) as f:
         glist = [l.strip().split("\t") for l in f.readlines() if len(l.strip()) > 0]
 
     with open(predict) as f:
         plist = [l.strip().split("\t") for l in f.readlines() if len(l.strip()) > 0]
-    evaluator = Evaluator(db_dir, kmaps, etype, db_type=db_type, grammar=grammar)
+    kwargs = {}
+    if (
+        etype in ["all", "exec"]
+        and db_type in db_utils.SQLITE_DBTYPE_IDENTIFIERS
+        and grammar in SPIDER_GRAMMAR_IDENTIFIERS
+    ):
+        kwargs["exec_engine"] = exec_eval.ExecutionEngine(
+            num_workers, timeout=timeout, cache_dir=gold_cache_dir
+        )
+    evaluator = Evaluator(
+        db_dir, kmaps, tables, etype, db_type=db_type, grammar=grammar, **kwargs
+    )
     results = []
-    for p, g in zip(plist, glist):
-        (predicted,) = p
-        gold, db_name = g
-        results.append(evaluator.evaluate_one(db_name, gold, predicted))
-    evaluator.finalize()
+    try:
+        for p, g in zip(plist, glist):
+            (predicted,) = p
+            gold, db_name = g
+            results.append(evaluator.evaluate_one(db_name, gold, predicted))
+        evaluator.finalize()
+    finally:
+        if "exec_engine" in kwargs:
+            kwargs["exec_engine"].shutdown()
 
     print_scores(evaluator.scores, etype)
     return {
@@ -51,6 +80,9 @@ if __name__ == "__main__":
     parser.add_argument("--output")
     parser.add_argument("--db_type", default="sqlite", type=str)
     parser.add_argument("--grammar", default="spider", type=str)
+    parser.add_argument("--num_workers", default=None, type=int)
+    parser.add_argument("--timeout", default=exec_eval.DEFAULT_TIMEOUT, type=float)
+    parser.add_argument("--gold_cache", default=None, type=str)
     args = parser.parse_args()
 
     gold = args.gold
@@ -64,9 +96,21 @@ if __name__ == "__main__":
     assert etype in ["all", "exec", "match"], "Unknown evaluation method"
 
     kmaps = build_foreign_key_map_from_json(table)
+    with open(table) as f:
+        tables = json.load(f)
 
     results = evaluate(
-        gold, pred, db_dir, etype, kmaps, db_type=db_type, grammar=grammar
+        gold,
+        pred,
+        db_dir,
+        etype,
+        kmaps,
+        db_type=db_type,
+        grammar=grammar,
+        tables=tables,
+        num_workers=args.num_workers,
+        timeout=args.timeout,
+        gold_cache_dir=args.gold_cache,
     )
     if args.output:
         with open(args.output, "w") as f:
@@ -31,6 +31,7 @@ from source.text2sql.ratsql.datasets.spider_lib.process_sql import (
     Schema,
     get_sql,
 )
+from source.text2sql.ratsql.datasets.spider_lib import exec_eval
 from source.text2sql.ratsql.datasets.utils import db_utils
 
 # Flag to disable value evaluation
@@ -470,7 +471,14 @@ class Evaluator:
     """A simple evaluator"""
 
     def __init__(
-        self, db_dir, kmaps, tables, etype, db_type="sqlite", grammar="spider"
+        self,
+        db_dir,
+        kmaps,
+        tables,
+        etype,
+        db_type="sqlite",
+        grammar="spider",
+        exec_engine=None,
     ):
         self.db_dir = db_dir
         self.kmaps = kmaps
@@ -478,6 +486,11 @@ class Evaluator:
         self.etype = etype
         self.db_type = db_type
         self.grammar = grammar
+        # Executes queries in parallel (SQLite only); results are collected in finalize
+        self.exec_engine = (
+            exec_engine if db_type in db_utils.SQLITE_DBTYPE_IDENTIFIERS else None
+        )
+        self.pending_exec = []
 
         self.db_paths = {}
         self.schemas = {}
@@ -750,15 +763,34 @@ class Evaluator:
             p_sql = modify_from_clause(p_sql, self.primary_keys[db_name], foreign_maps)
             g_sql = modify_from_clause(g_sql, self.primary_keys[db_name], foreign_maps)
 
+        result = {
+            "db_id": db_name,
+            "predicted": predicted,
+            "gold": gold,
+            "predicted_parse_error": parse_error,
+            "hardness": hardness,
+            "exact": None,
+            "partial": None,
+        }
+
         if self.etype in ["all", "exec"]:
-            self.scores[hardness]["exec"] += eval_exec_match(
-                self.db_paths[db_name],
-                predicted,
-                gold,
-                p_sql,
-                g_sql,
-                db_type=self.db_type,
-            )
+            if self.exec_engine is not None:
+                futures = self.exec_engine.submit(
+                    db_name, self.db_paths[db_name], predicted, gold
+                )
+                self.pending_exec.append((hardness, p_sql, g_sql, futures, result))
+            else:
+                exec_score = eval_exec_match(
+                    self.db_paths[db_name],
+                    predicted,
+                    gold,
+                    p_sql,
+                    g_sql,
+                    db_type=self.db_type,
+                )
+                result["exec"] = exec_score
+                self.scores[hardness]["exec"] += exec_score
+                self.scores["all"]["exec"] += exec_score
 
         if self.etype in ["all", "match"]:
             partial_scores = self.eval_partial_match(p_sql, g_sql)
@@ -792,19 +824,34 @@ class Evaluator:
                 self.scores["all"]["partial"][type_]["f1"] += partial_scores[type_][
                     "f1"
                 ]
-
-        return {
-            "db_id": db_name,
-            "predicted": predicted,
-            "gold": gold,
-            "predicted_parse_error": parse_error,
-            "hardness": hardness,
-            "exact": exact_score,
-            "partial": partial_scores,
-            "db_id": db_name,
-        }
+            result["exact"] = exact_score
+            result["partial"] = partial_scores
+
+        return result
+
+    def collect_exec(self):
+        """Waits for the queries submitted to the exec_engine and scores them."""
+        for hardness, p_sql, g_sql, (p_future, g_future), result in self.pending_exec:
+            p_outcome, g_outcome = p_future.result(), g_future.result()
+            self.exec_engine.record(p_outcome)
+            exec_score = (
+                p_outcome.status == exec_eval.OK
+                and g_outcome.status == exec_eval.OK
+                and exec_eval.results_match(p_outcome.rows, g_outcome.rows, p_sql, g_sql)
+            )
+            result["exec"] = exec_score
+            result["exec_status"] = p_outcome.status
+            result["exec_latency"] = p_outcome.latency
+            if g_outcome.status != exec_eval.OK:
+                result["gold_exec_status"] = g_outcome.status
+            self.scores[hardness]["exec"] += exec_score
+            self.scores["all"]["exec"] += exec_score
+        self.pending_exec = []
+        self.scores["exec_latency"] = self.exec_engine.latency_percentiles()
 
     def finalize(self):
+        if self.exec_engine is not None:
+            self.collect_exec()
         scores = self.scores
         for level in LEVELS:
             if scores[level]["count"] == 0:
@@ -885,6 +932,24 @@ def print_scores(scores, etype):
                 "execution", *this_scores
             )
         )
+        latency = scores.get("exec_latency")
+        if latency:
+            print("\n--------------------- EXECUTION LATENCY (ms) -----------------------")
+            print(
+                "{:20} {:<20} {:<20} {:<20} {:<20} {:<20}".format(
+                    "", "p50", "p90", "p99", "max", "timeouts"
+                )
+            )
+            print(
+                "{:20} {:<20.1f} {:<20.1f} {:<20.1f} {:<20.1f} {:<20d}".format(
+                    "prediction",
+                    latency["p50"] * 1e3,
+                    latency["p90"] * 1e3,
+                    latency["p99"] * 1e3,
+                    latency["max"] * 1e3,
+                    latency["timeouts"],
+                )
+            )
 
     if etype in ["all", "match"]:
         print("\n====================== EXACT MATCHING ACCURACY =====================")
@@ -945,11 +1010,22 @@ def evaluate(gold, predict, db_dir, etype, kmaps, db_type="sqlite", grammar="spi
     }
 
 
-def eval_exec_match(db, p_str, g_str, pred, gold, db_type="sqlite"):
+def eval_exec_match(
+    db, p_str, g_str, pred, gold, db_type="sqlite", timeout=exec_eval.DEFAULT_TIMEOUT
+):
     """
     return 1 if the values between prediction and gold are matching
     in the corresponding index. Currently not support multiple col_unit(pairs).
     """
+    if db_type in db_utils.SQLITE_DBTYPE_IDENTIFIERS:
+        p_outcome = exec_eval.execute_query(db, p_str, timeout)
+        if p_outcome.status != exec_eval.OK:
+            return False
+        g_outcome = exec_eval.execute_query(db, g_str, timeout)
+        if g_outcome.status != exec_eval.OK:
+            return False
+        return exec_eval.results_match(p_outcome.rows, g_outcome.rows, pred, gold)
+
     conn = db_utils.connect(db, db_type)
     cursor = conn.cursor()
     try:
@@ -0,0 +1,165 @@
+import collections
+import concurrent.futures
+import hashlib
+import os
+import pickle
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+
+DEFAULT_TIMEOUT = 30.0
+# Number of SQLite virtual machine instructions between deadline checks
+PROGRESS_INTERVAL = 10000
+
+OK, ERROR, TIMEOUT = "ok", "error", "timeout"
+
+QueryOutcome = collections.namedtuple("QueryOutcome", ["status", "rows", "latency"])
+
+# Read-only connections of this process, one per database file
+_connections = {}
+
+
+def _connection(db_path):
+    conn = _connections.get(db_path)
+    if conn is None:
+        uri = "file:{}?mode=ro".format(os.path.abspath(db_path))
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        # Spider has non UTF-8 text in a few databases
+        conn.text_factory = lambda b: b.decode(errors="ignore")
+        _connections[db_path] = conn
+    return conn
+
+
+def execute_query(db_path, sql, timeout=DEFAULT_TIMEOUT):
+    """Runs sql on the database, interrupting it after timeout seconds.
+
+    Returns a QueryOutcome; rows is None unless the status is OK.
+    """
+    conn = _connection(db_path)
+    start = time.monotonic()
+    deadline = None if timeout is None else start + timeout
+    # A non-zero return value makes SQLite abort the statement ("interrupted")
+    conn.set_progress_handler(
+        lambda: deadline is not None and time.monotonic() > deadline, PROGRESS_INTERVAL
+    )
+    try:
+        rows = conn.execute(sql).fetchall()
+        status = OK
+    except Exception:
+        rows = None
+        status = TIMEOUT if deadline is not None and time.monotonic() > deadline else ERROR
+    finally:
+        conn.set_progress_handler(None, 0)
+    return QueryOutcome(status, rows, time.monotonic() - start)
+
+
+def results_match(p_res, q_res, pred, gold):
+    """Compares result sets column by column, keyed by the parsed select units (order-insensitive)."""
+
+    def res_map(res, val_units):
+        rmap = {}
+        for idx, val_unit in enumerate(val_units):
+            key = (
+                tuple(val_unit[1])
+                if not val_unit[2]
+                else (val_unit[0], tuple(val_unit[1]), tuple(val_unit[2]))
+            )
+            rmap[key] = [r[idx] for r in res]
+        return rmap
+
+    p_val_units = [unit[1] for unit in pred["select"][1]]
+    q_val_units = [unit[1] for unit in gold["select"][1]]
+    return res_map(p_res, p_val_units) == res_map(q_res, q_val_units)
+
+
+class GoldResultCache:
+    """Result sets of gold queries on disk, keyed by (db_id, hash of the gold SQL).
+
+    Gold queries do not change between checkpoints, so evaluating another
+    checkpoint only executes its predictions. Delete the directory if the
+    databases change.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, db_id, sql):
+        digest = hashlib.sha1(sql.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, db_id, f"{digest}.pkl")
+
+    def get(self, db_id, sql):
+        path = self._path(db_id, sql)
+        if not os.path.isfile(path):
+            return None
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def put(self, db_id, sql, rows):
+        path = self._path(db_id, sql)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(rows, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            # Without a writable cache the gold queries are just executed again
+            pass
+
+
+class ExecutionEngine:
+    """Executes predicted and gold queries in a process pool.
+
+    Each worker keeps one read-only connection per database, and every query
+    is interrupted after timeout seconds, so a runaway prediction (e.g. a
+    cartesian product) costs at most timeout instead of hanging the run. Gold
+    result sets are cached on disk if cache_dir is given.
+    """
+
+    def __init__(self, num_workers=None, timeout=DEFAULT_TIMEOUT, cache_dir=None):
+        self.timeout = timeout
+        self.pool = concurrent.futures.ProcessPoolExecutor(num_workers)
+        self.gold_cache = GoldResultCache(cache_dir) if cache_dir else None
+        # Execution latencies of the predictions, in seconds
+        self.latencies = []
+        self.timeouts = 0
+
+    def submit(self, db_id, db_path, predicted, gold):
+        """Returns futures of the QueryOutcome of the prediction and of the gold query."""
+        p_future = self.pool.submit(execute_query, db_path, predicted, self.timeout)
+        rows = self.gold_cache.get(db_id, gold) if self.gold_cache else None
+        if rows is not None:
+            g_future = concurrent.futures.Future()
+            g_future.set_result(QueryOutcome(OK, rows, 0.0))
+        else:
+            g_future = self.pool.submit(execute_query, db_path, gold, self.timeout)
+            if self.gold_cache:
+
+                def cache_gold(future):
+                    outcome = future.result()
+                    if outcome.status == OK:
+                        self.gold_cache.put(db_id, gold, outcome.rows)
+
+                g_future.add_done_callback(cache_gold)
+        return p_future, g_future
+
+    def record(self, outcome):
+        self.latencies.append(outcome.latency)
+        self.timeouts += outcome.status == TIMEOUT
+
+    def latency_percentiles(self):
+        if not self.latencies:
+            return {}
+        latencies = np.asarray(self.latencies)
+        percentiles = {
+            f"p{q}": float(np.percentile(latencies, q)) for q in (50, 90, 95, 99)
+        }
+        percentiles["max"] = float(latencies.max())
+        percentiles["count"] = len(latencies)
+        percentiles["timeouts"] = self.timeouts
+        return percentiles
+
+    def shutdown(self):
+        self.pool.shutdown()
@@ -12,11 +12,16 @@ import transformers
 
 from source.text2sql.ratsql.models import abstract_preproc
 from source.text2sql.ratsql.models.cosql import cosql_enc_modules
+from source.text2sql.ratsql.models.spider.schema_artifacts import (
+    SchemaArtifactStore,
+    schema_digest,
+)
 from source.text2sql.ratsql.models.cosql.cosql_match_utils import (
     compute_schema_linking,
     compute_cell_value_linking,
 )
-from source.text2sql.ratsql.resources import corenlp
+from source.text2sql.ratsql.resources import lemmatizer
+from source.text2sql.ratsql.utils import indexed_file
 from source.text2sql.ratsql.utils import registry
 from source.text2sql.ratsql.utils import serialization
 from source.text2sql.ratsql.utils import vocab
@@ -174,6 +179,11 @@ class CosqlEncoderPreproc(abstract_preproc.AbstractPreproc):
         preprocessed = self.preprocess_item(
             item, validation_info, manual_linking_info=manual_linking_info
         )
+        self.add_preprocessed_item(item, section, preprocessed)
+        return True, preprocessed
+
+    def add_preprocessed_item(self, item, section, preprocessed):
+        """Adds the result of preprocess_item, counting its tokens for the vocab like add_item."""
         self.texts[section].append(preprocessed)
 
         if section == "train":
@@ -273,19 +283,18 @@ class CosqlEncoderPreproc(abstract_preproc.AbstractPreproc):
             self.vocab_builder.save(self.vocab_word_freq_path)
 
         for section, texts in self.texts.items():
-            with open(os.path.join(self.data_dir, section + ".jsonl"), "w") as f:
-                for text in texts:
-                    f.write(json.dumps(text, ensure_ascii=False) + "\n")
+            indexed_file.write_jsonl(
+                os.path.join(self.data_dir, section + ".jsonl"),
+                texts,
+                encode=lambda text: json.dumps(text, ensure_ascii=False),
+            )
 
     def load(self):
         self.vocab = vocab.Vocab.load(self.vocab_path)
         self.vocab_builder.load(self.vocab_word_freq_path)
 
     def dataset(self, section):
-        return [
-            json.loads(line)
-            for line in open(os.path.join(self.data_dir, section + ".jsonl"))
-        ]
+        return indexed_file.load_jsonl(os.path.join(self.data_dir, section + ".jsonl"))
 
 
 class Bertokens:
@@ -428,16 +437,32 @@ class Bertokens:
             self.idx_map = idx_map
 
         # lemmatize "abc"
-        normalized_toks = []
-        for i, tok in enumerate(new_toks):
-            ann = corenlp.annotate(tok, annotators=["tokenize", "ssplit", "lemma"])
-            lemmas = [tok.lemma.lower() for sent in ann.sentence for tok in sent.token]
-            lemma_word = " ".join(lemmas)
-            normalized_toks.append(lemma_word)
+        normalized_toks = lemmatizer.lemmatize(new_toks)
 
         self.normalized_pieces = normalized_toks
         self.recovered_pieces = new_toks
 
+    def to_dict(self):
+        return {
+            "pieces": self.pieces,
+            "bert_version": self.bert_version,
+            "normalized_pieces": self.normalized_pieces,
+            "recovered_pieces": self.recovered_pieces,
+            # JSON keys are strings, so keep the index map as pairs
+            "idx_map": sorted(self.idx_map.items()),
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        """Restores normalized tokens without tokenizing or lemmatizing again."""
+        bertokens = cls.__new__(cls)
+        bertokens.pieces = d["pieces"]
+        bertokens.bert_version = d["bert_version"]
+        bertokens.normalized_pieces = d["normalized_pieces"]
+        bertokens.recovered_pieces = d["recovered_pieces"]
+        bertokens.idx_map = dict(d["idx_map"])
+        return bertokens
+
     def bert_schema_linking(self, columns, tables, manual_linking_info=None):
         question_tokens = self.normalized_pieces
         column_tokens = [c.normalized_pieces for c in columns]
@@ -478,6 +503,20 @@ class Bertokens:
         return new_cv_link
 
 
+def preprocessed_schema_to_dict(preproc_schema):
+    d = attr.asdict(preproc_schema, recurse=False)
+    for key in ("normalized_column_names", "normalized_table_names"):
+        d[key] = [bertokens.to_dict() for bertokens in d[key]]
+    return d
+
+
+def preprocessed_schema_from_dict(d):
+    d = dict(d)
+    for key in ("normalized_column_names", "normalized_table_names"):
+        d[key] = [Bertokens.from_dict(bertokens) for bertokens in d[key]]
+    return PreprocessedSchema(**d)
+
+
 class CosqlEncoderBertPreproc(CosqlEncoderPreproc):
     def __init__(
         self,
@@ -500,6 +539,10 @@ class CosqlEncoderBertPreproc(CosqlEncoderPreproc):
         self.compute_cv_link = compute_cv_link
         self.counted_db_ids = set()
         self.preprocessed_schemas = {}
+        # Preprocessed schemas persisted per db_id and shared by all processes
+        self.schema_artifacts = SchemaArtifactStore(
+            os.path.join(self.data_dir, "schemas")
+        )
 
         """ jjkim - Sep 30, 2021
         use transformers.AutoModel instead of specific models such as BertModel or ElectraModel
@@ -561,6 +604,9 @@ class CosqlEncoderBertPreproc(CosqlEncoderPreproc):
     def add_item_from_cache(self, cached_item, section):
         self.texts[section].append(cached_item)
 
+    def add_preprocessed_item(self, item, section, preprocessed):
+        self.texts[section].append(preprocessed)
+
     def preprocess_item(
         self,
         item,
@@ -634,14 +680,31 @@ class CosqlEncoderBertPreproc(CosqlEncoderPreproc):
     def _preprocess_schema(self, schema, bert_version="bert-base-uncased"):
         if schema.db_id in self.preprocessed_schemas:
             return self.preprocessed_schemas[schema.db_id]
-        result = preprocess_schema_uncached(
+        digest = schema_digest(
             schema,
-            self._tokenize,
-            self.include_table_name_in_column,
-            self.fix_issue_16_primary_keys,
-            bert=True,
             bert_version=bert_version,
+            include_table_name_in_column=self.include_table_name_in_column,
+            fix_issue_16_primary_keys=self.fix_issue_16_primary_keys,
+        )
+        result = self.schema_artifacts.load_json(
+            schema.db_id, digest, "cosql_schema", decode=preprocessed_schema_from_dict
         )
+        if result is None:
+            result = preprocess_schema_uncached(
+                schema,
+                self._tokenize,
+                self.include_table_name_in_column,
+                self.fix_issue_16_primary_keys,
+                bert=True,
+                bert_version=bert_version,
+            )
+            self.schema_artifacts.save_json(
+                schema.db_id,
+                digest,
+                "cosql_schema",
+                result,
+                encode=preprocessed_schema_to_dict,
+            )
         self.preprocessed_schemas[schema.db_id] = result
         return result
 
@@ -651,9 +714,11 @@ class CosqlEncoderBertPreproc(CosqlEncoderPreproc):
             self.tokenizer.save_pretrained(self.data_dir)
 
         for section, texts in self.texts.items():
-            with open(os.path.join(self.data_dir, section + ".jsonl"), "w") as f:
-                for text in texts:
-                    f.write(json.dumps(text, ensure_ascii=False) + "\n")
+            indexed_file.write_jsonl(
+                os.path.join(self.data_dir, section + ".jsonl"),
+                texts,
+                encode=lambda text: json.dumps(text, ensure_ascii=False),
+            )
 
     def load(self):
         """jjkim - Sep 30, 2021
@@ -70,6 +70,13 @@ class EncDecModel(torch.nn.Module):
             self.enc_preproc.add_item_from_cache(enc_preproc_item, section)
             self.dec_preproc.add_item_from_cache(dec_preproc_item, section)
 
+        def add_preprocessed_item(self, item, section, preprocessed):
+            """Adds the result of add_item computed by another preprocessor (e.g. in a worker process)."""
+            enc_preproc_item, (dec_info, _) = preprocessed
+            if enc_preproc_item is not None:
+                self.enc_preproc.add_preprocessed_item(item, section, enc_preproc_item)
+            self.dec_preproc.add_item(item, section, dec_info)
+
         def clear_items(self):
             self.enc_preproc.clear_items()
             self.dec_preproc.clear_items()
@@ -174,6 +181,22 @@ class EncDecModel(torch.nn.Module):
             enc_state = self.encoder(enc_input)
         return self.decoder.begin_inference(enc_state, orig_item)
 
+    def begin_inference_batch(self, orig_items, preproc_items):
+        """Encodes several items in one encoder pass and starts decoding each.
+
+        Returns one (inference_state, next_choices) pair per item, as
+        begin_inference does.
+        """
+        enc_inputs = [enc_input for enc_input, _ in preproc_items]
+        if getattr(self.encoder, "batched"):
+            enc_states = self.encoder(enc_inputs)
+        else:
+            enc_states = [self.encoder(enc_input) for enc_input in enc_inputs]
+        return [
+            self.decoder.begin_inference(enc_state, orig_item)
+            for enc_state, orig_item in zip(enc_states, orig_items)
+        ]
+
     def begin_inference_captum(
         self, orig_item, preproc_item, input, att_masks, tok_type_lists
     ):
@@ -28,7 +28,7 @@ from source.text2sql.ratsql.models.nl2code.train_tree_traversal import (
     TrainTreeTraversal,
 )
 from source.text2sql.ratsql.models.nl2code.tree_traversal import TreeTraversal
-from source.text2sql.ratsql.utils import registry, serialization, vocab
+from source.text2sql.ratsql.utils import indexed_file, registry, serialization, vocab
 
 
 def lstm_init(device, num_layers, hidden_size, *batch_sizes):
@@ -204,9 +204,11 @@ class NL2CodeDecoderPreproc(abstract_preproc.AbstractPreproc):
             assert len(self.items) > 0
 
         for section, items in self.items.items():
-            with open(os.path.join(self.data_dir, section + ".jsonl"), "w") as f:
-                for item in items:
-                    f.write(json.dumps(attr.asdict(item)) + "\n")
+            indexed_file.write_jsonl(
+                os.path.join(self.data_dir, section + ".jsonl"),
+                items,
+                encode=lambda item: json.dumps(attr.asdict(item)),
+            )
 
         # observed_productions
         if not is_inference:
@@ -295,10 +297,10 @@ class NL2CodeDecoderPreproc(abstract_preproc.AbstractPreproc):
         self.rules_mask = grammar["rules_mask"]
 
     def dataset(self, section):
-        return [
-            NL2CodeDecoderPreprocItem(**json.loads(line))
-            for line in open(os.path.join(self.data_dir, section + ".jsonl"))
-        ]
+        return indexed_file.load_jsonl(
+            os.path.join(self.data_dir, section + ".jsonl"),
+            transform=lambda value: NL2CodeDecoderPreprocItem(**value),
+        )
 
     def _record_productions(self, tree):
         queue = [(tree, False)]
@@ -469,7 +471,9 @@ class NL2CodeDecoder(torch.nn.Module):
                 self, *args
             )
             self.compute_pointer_with_align = (
-                lambda *args: spider_dec_func.compute_pointer_with_align(self, *args)
+                lambda *args, **kwargs: spider_dec_func.compute_pointer_with_align(
+                    self, *args, **kwargs
+                )
             )
 
         if self.preproc.use_seq_elem_rules:
@@ -858,17 +862,21 @@ class NL2CodeDecoder(torch.nn.Module):
 
     def _desc_attention(self, prev_state, desc_enc):
         # prev_state shape:
-        # - h_n: batch (=1) x emb_size
-        # - c_n: batch (=1) x emb_size
+        # - h_n: batch x emb_size
+        # - c_n: batch x emb_size
+        # desc_enc memories are shared by the whole batch
         query = prev_state[0]
+        batch_size = query.shape[0]
         if self.attn_type != "sep":
-            return self.desc_attn(query, desc_enc.memory, attn_mask=None)
+            return self.desc_attn(
+                query, desc_enc.memory.expand(batch_size, -1, -1), attn_mask=None
+            )
         else:
             question_context, question_attention_logits = self.question_attn(
-                query, desc_enc.question_memory
+                query, desc_enc.question_memory.expand(batch_size, -1, -1)
             )
             schema_context, schema_attention_logits = self.schema_attn(
-                query, desc_enc.schema_memory
+                query, desc_enc.schema_memory.expand(batch_size, -1, -1)
             )
             return question_context + schema_context, schema_attention_logits
 
@@ -886,13 +894,22 @@ class NL2CodeDecoder(torch.nn.Module):
         parent_h,
         parent_action_emb,
         desc_enc,
+        precomputed=None,
     ):
-        # desc_context shape: batch (=1) x emb_size
+        # precomputed: (new_state, attention_probs) from update_state_batched
+        if precomputed is not None:
+            return precomputed
+        # node_type may be a list with one node type per batch item
+        if isinstance(node_type, str):
+            node_type_idx = self._index(self.node_type_vocab, node_type)
+        else:
+            node_type_idx = self._tensor(
+                [self.node_type_vocab.index(t) for t in node_type]
+            )
+        # desc_context shape: batch x emb_size
         desc_context, attention_probs = self._desc_attention(prev_state, desc_enc)
-        # node_type_emb shape: batch (=1) x emb_size
-        node_type_emb = self.node_type_embedding(
-            self._index(self.node_type_vocab, node_type)
-        )
+        # node_type_emb shape: batch x emb_size
+        node_type_emb = self.node_type_embedding(node_type_idx)
 
         state_input = torch.cat(
             (
@@ -911,6 +928,33 @@ class NL2CodeDecoder(torch.nn.Module):
         )
         return new_state, attention_probs
 
+    def update_state_batched(self, update_inputs, desc_enc):
+        """Runs one _update_state for several traversals sharing desc_enc.
+
+        update_inputs: list of (node_type, prev_state, prev_action_emb, parent_h,
+        parent_action_emb) with batch size 1, as returned by
+        TreeTraversal.state_update_inputs.
+        Returns one (new_state, attention_probs) with batch size 1 per input.
+        """
+        node_types, prev_states, prev_action_embs, parent_hs, parent_action_embs = zip(
+            *update_inputs
+        )
+        (new_h, new_c), attention_probs = self._update_state(
+            list(node_types),
+            (
+                torch.cat([h for h, _ in prev_states], dim=0),
+                torch.cat([c for _, c in prev_states], dim=0),
+            ),
+            torch.cat(prev_action_embs, dim=0),
+            torch.cat(parent_hs, dim=0),
+            torch.cat(parent_action_embs, dim=0),
+            desc_enc,
+        )
+        return [
+            ((new_h[i : i + 1], new_c[i : i + 1]), attention_probs[i : i + 1])
+            for i in range(len(update_inputs))
+        ]
+
     def apply_rule(
         self,
         node_type,
@@ -919,6 +963,7 @@ class NL2CodeDecoder(torch.nn.Module):
         parent_h,
         parent_action_emb,
         desc_enc,
+        precomputed=None,
     ):
         new_state, attention_probs = self._update_state(
             node_type,
@@ -927,6 +972,7 @@ class NL2CodeDecoder(torch.nn.Module):
             parent_h,
             parent_action_emb,
             desc_enc,
+            precomputed,
         )
         # output shape: batch (=1) x emb_size
         output = new_state[0]
@@ -952,6 +998,7 @@ class NL2CodeDecoder(torch.nn.Module):
         parent_h,
         parent_action_emb,
         desc_enc,
+        precomputed=None,
     ):
         new_state, attention_logits = self._update_state(
             node_type,
@@ -960,6 +1007,7 @@ class NL2CodeDecoder(torch.nn.Module):
             parent_h,
             parent_action_emb,
             desc_enc,
+            precomputed,
         )
         # output shape: batch (=1) x emb_size
         output = new_state[0]
@@ -1110,6 +1158,7 @@ class NL2CodeDecoder(torch.nn.Module):
         parent_h,
         parent_action_emb,
         desc_enc,
+        precomputed=None,
     ):
         new_state, attention_logits = self._update_state(
             node_type,
@@ -1118,6 +1167,7 @@ class NL2CodeDecoder(torch.nn.Module):
             parent_h,
             parent_action_emb,
             desc_enc,
+            precomputed,
         )
         # output shape: batch (=1) x emb_size
         output = new_state[0]
@@ -83,6 +83,8 @@ class TreeTraversal:
         self.next_item_id = 1
 
         self.update_prev_action_emb = TreeTraversal._update_prev_action_emb_apply_rule
+        self.pending_choice = None
+        self.precomputed_update = None
 
     def clone(self):
         other = self.__class__(None, None)
@@ -95,6 +97,8 @@ class TreeTraversal:
         other.next_item_id = self.next_item_id
         other.actions = self.actions
         other.update_prev_action_emb = self.update_prev_action_emb
+        other.pending_choice = None
+        other.precomputed_update = None
         return other
 
     def step(self, last_choice, extra_choice_info=None, attention_offset=None):
@@ -113,6 +117,98 @@ class TreeTraversal:
             else:
                 return choices
 
+    def needs_state_update(self, last_choice):
+        """Whether the handler of the current state runs the decoder state update."""
+        state = self.cur_item.state
+        if state in (
+            TreeTraversal.State.SUM_TYPE_INQUIRE,
+            TreeTraversal.State.LIST_LENGTH_INQUIRE,
+            TreeTraversal.State.POINTER_INQUIRE,
+        ):
+            return True
+        if state == TreeTraversal.State.CHILDREN_INQUIRE:
+            type_info = self.model.ast_wrapper.singular_types[self.cur_item.node_type]
+            return bool(type_info.fields)
+        if state == TreeTraversal.State.GEN_TOKEN:
+            return last_choice != vocab.EOS
+        return False
+
+    def step_until_state_update(self, last_choice, extra_choice_info=None):
+        """Same as step, but stops right before the decoder state update.
+
+        Returns (choices, pending). If pending is True, the caller should compute
+        the update for state_update_inputs() (e.g. batched with other traversals
+        through update_state_batched) and pass it to finish_step.
+        """
+        while True:
+            assert not extra_choice_info
+            self.update_using_last_choice(last_choice, extra_choice_info, None)
+
+            if self.needs_state_update(last_choice):
+                self.pending_choice = last_choice
+                return None, True
+
+            handler_name = TreeTraversal.Handler.handlers[self.cur_item.state]
+            handler = getattr(self, handler_name)
+            choices, continued = handler(last_choice)
+            if continued:
+                last_choice = choices
+                continue
+            else:
+                return choices, False
+
+    def state_update_inputs(self):
+        node_type = self.cur_item.node_type
+        if self.cur_item.state == TreeTraversal.State.LIST_LENGTH_INQUIRE:
+            node_type = node_type + "*"
+        return (
+            node_type,
+            self.recurrent_state,
+            self.prev_action_emb,
+            self.cur_item.parent_h,
+            self.cur_item.parent_action_emb,
+        )
+
+    def finish_step(self, precomputed_update):
+        """Finishes a step paused by step_until_state_update with the given update."""
+        self.precomputed_update = precomputed_update
+        handler_name = TreeTraversal.Handler.handlers[self.cur_item.state]
+        handler = getattr(self, handler_name)
+        choices, continued = handler(self.pending_choice)
+        assert not continued
+        self.pending_choice = None
+        return choices
+
+    def take_precomputed_update(self):
+        precomputed_update = self.precomputed_update
+        self.precomputed_update = None
+        return precomputed_update
+
+    @classmethod
+    def step_batched(cls, traversals, last_choices):
+        """Steps several traversals, running one decoder state update per desc_enc.
+
+        Equivalent to [t.step(c) for t, c in zip(traversals, last_choices)].
+        """
+        results = [None] * len(traversals)
+        pending = {}
+        for i, (traversal, last_choice) in enumerate(zip(traversals, last_choices)):
+            choices, is_pending = traversal.step_until_state_update(last_choice)
+            if is_pending:
+                pending.setdefault(id(traversal.desc_enc), []).append(i)
+            else:
+                results[i] = choices
+
+        for indices in pending.values():
+            model = traversals[indices[0]].model
+            updates = model.update_state_batched(
+                [traversals[i].state_update_inputs() for i in indices],
+                traversals[indices[0]].desc_enc,
+            )
+            for i, update in zip(indices, updates):
+                results[i] = traversals[i].finish_step(update)
+        return results
+
     def update_using_last_choice(
         self, last_choice, extra_choice_info, attention_offset
     ):
@@ -158,6 +254,7 @@ class TreeTraversal:
                 self.cur_item.parent_h,
                 self.cur_item.parent_action_emb,
                 self.desc_enc,
+                precomputed=self.take_precomputed_update(),
             )
         )
         self.cur_item = attr.evolve(
@@ -205,6 +302,7 @@ class TreeTraversal:
                 self.cur_item.parent_h,
                 self.cur_item.parent_action_emb,
                 self.desc_enc,
+                precomputed=self.take_precomputed_update(),
             )
         )
         self.cur_item = attr.evolve(
@@ -295,6 +393,7 @@ class TreeTraversal:
                 self.cur_item.parent_h,
                 self.cur_item.parent_action_emb,
                 self.desc_enc,
+                precomputed=self.take_precomputed_update(),
             )
         )
         self.cur_item = attr.evolve(
@@ -360,6 +459,7 @@ class TreeTraversal:
             self.cur_item.parent_h,
             self.cur_item.parent_action_emb,
             self.desc_enc,
+            precomputed=self.take_precomputed_update(),
         )
         self.update_prev_action_emb = TreeTraversal._update_prev_action_emb_gen_token
         choices = self.token_choice(output, gen_logodds)
@@ -376,6 +476,7 @@ class TreeTraversal:
                 self.cur_item.parent_h,
                 self.cur_item.parent_action_emb,
                 self.desc_enc,
+                precomputed=self.take_precomputed_update(),
             )
         )
         self.cur_item = attr.evolve(
@@ -12,7 +12,7 @@ import torch.nn.functional as F
 from source.text2sql.ratsql.datasets.spider_lib.process_sql import Schema, get_schema
 from source.text2sql.ratsql.datasets.utils import db_utils
 from source.text2sql.ratsql.models import abstract_preproc, attention
-from source.text2sql.ratsql.utils import registry
+from source.text2sql.ratsql.utils import indexed_file, registry
 
 
 @attr.s
@@ -71,9 +71,7 @@ class NL2IntentDecoderPreproc(abstract_preproc.AbstractPreproc):
             json.dump(list(possible_outputs), f)
         # Save all preprocessed items
         for section, items in self.items.items():
-            with open(os.path.join(self.data_dir, section + ".jsonl"), "w") as f:
-                for item in items:
-                    f.write(json.dumps(item) + "\n")
+            indexed_file.write_jsonl(os.path.join(self.data_dir, section + ".jsonl"), items)
 
     def load(self, checkpoint_path=None):
         with open(self.possible_ouput_path, "r") as f:
@@ -6,6 +6,7 @@ import torch
 
 from source.text2sql.ratsql.models import abstract_preproc
 from source.text2sql.ratsql.models import variational_lstm
+from source.text2sql.ratsql.utils import indexed_file
 from source.text2sql.ratsql.utils import registry
 from source.text2sql.ratsql.utils import vocab
 
@@ -63,9 +64,9 @@ class NL2IntentEncoder(torch.nn.Module):
                 assert len(self.texts) > 0
 
             for section, texts in self.texts.items():
-                with open(os.path.join(self.data_dir, section + ".jsonl"), "w") as f:
-                    for text in texts:
-                        f.write(json.dumps(text) + "\n")
+                indexed_file.write_jsonl(
+                    os.path.join(self.data_dir, section + ".jsonl"), texts
+                )
 
         def load(self):
             self.vocab = vocab.Vocab.load(self.vocab_path)
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+# Artifacts are written by one process and read by the others, so each file is
+# replaced atomically and loaded objects are shared by all preprocessors of a process
+_loaded = {}
+_lock = threading.Lock()
+
+
+def schema_digest(schema, **preproc_args):
+    """Hashes the raw schema together with the arguments that shape its encoding."""
+    payload = json.dumps(
+        {"schema": schema.orig, "preproc": preproc_args}, sort_keys=True, default=str
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def _atomic_write(path, write_func, mode):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as f:
+            write_func(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class SchemaArtifactStore:
+    """On-disk artifacts of preprocessed schemas, one directory per ``db_id``.
+
+    Each artifact is named after the schema digest, so editing the schema (or
+    the preprocessing arguments) invalidates it. Token data is stored as JSON and
+    arrays (e.g. schema-side embeddings) as ``.npy`` files that are memory-mapped
+    on load, so processes serving the same databases share the pages.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, db_id, digest, name):
+        return os.path.join(self.root, db_id, f"{digest}.{name}")
+
+    def _load(self, path, load_func):
+        with _lock:
+            if path in _loaded:
+                return _loaded[path]
+        if not os.path.isfile(path):
+            return None
+        value = load_func(path)
+        with _lock:
+            return _loaded.setdefault(path, value)
+
+    def _save(self, path, value, write_func, mode):
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _atomic_write(path, write_func, mode)
+        except OSError:
+            # Read-only deployments still work, they just recompute per process
+            pass
+        with _lock:
+            _loaded[path] = value
+
+    def load_json(self, db_id, digest, name, decode=None):
+        """Loads a JSON artifact, decoded once per process, or None if missing."""
+
+        def load(path):
+            with open(path) as f:
+                value = json.load(f)
+            return decode(value) if decode else value
+
+        return self._load(self._path(db_id, digest, f"{name}.json"), load)
+
+    def save_json(self, db_id, digest, name, value, encode=None):
+        self._save(
+            self._path(db_id, digest, f"{name}.json"),
+            value,
+            lambda f: json.dump(encode(value) if encode else value, f),
+            "w",
+        )
+
+    def load_array(self, db_id, digest, name):
+        """Memory-maps an array artifact read-only, or returns None if missing."""
+        return self._load(
+            self._path(db_id, digest, f"{name}.npy"),
+            lambda path: np.load(path, mmap_mode="r"),
+        )
+
+    def save_array(self, db_id, digest, name, value):
+        value = np.ascontiguousarray(value)
+        self._save(
+            self._path(db_id, digest, f"{name}.npy"),
+            value,
+            lambda f: np.save(f, value),
+            "wb",
+        )
@@ -2,6 +2,7 @@ import operator
 
 import attr
 import networkx as nx
+import torch
 
 from source.text2sql.ratsql.beam_search import Hypothesis
 from source.text2sql.ratsql.models.nl2code.decoder import (
@@ -19,13 +20,81 @@ class Hypothesis4Filtering(Hypothesis):
     column_index = attr.ib(factory=list)
 
 
+def top_candidates(hyps, k):
+    """
+    The k best (hyp, choice, choice_score, cum_score) expansions of the hypotheses,
+    selected with one tensor sort instead of one .item() per choice.
+    The sort is stable, so tied candidates keep the order of the unbatched
+    list sort (torch.topk does not guarantee any order between ties)
+    """
+    hyps = [hyp for hyp in hyps if hyp.next_choices]
+    num_candidates = sum(len(hyp.next_choices) for hyp in hyps)
+    # same number of candidates as candidates[:k] after sorting
+    k = len(range(num_candidates)[:k])
+    if k == 0:
+        return []
+
+    expansions = [(hyp, choice) for hyp in hyps for choice, _ in hyp.next_choices]
+    hyp_choice_scores = [
+        torch.stack([choice_score for _, choice_score in hyp.next_choices]).double()
+        for hyp in hyps
+    ]
+    choice_scores = torch.cat(hyp_choice_scores)
+    cum_scores = torch.cat(
+        [scores + hyp.score for hyp, scores in zip(hyps, hyp_choice_scores)]
+    )
+    top_cum_scores, top_indices = torch.sort(cum_scores, descending=True, stable=True)
+    top_cum_scores, top_indices = top_cum_scores[:k], top_indices[:k]
+    top_choice_scores = choice_scores.index_select(0, top_indices)
+    top_indices = top_indices.tolist()
+    top_choice_scores, top_cum_scores = torch.stack(
+        (top_choice_scores, top_cum_scores)
+    ).tolist()
+    return [
+        (*expansions[idx], choice_score, cum_score)
+        for idx, choice_score, cum_score in zip(
+            top_indices, top_choice_scores, top_cum_scores
+        )
+    ]
+
+
+def step_candidates(candidates, batched):
+    """
+    Clone the inference state of each candidate and advance it with its choice
+    """
+    inference_states = [hyp.inference_state.clone() for hyp, _, _, _ in candidates]
+    choices = [choice for _, choice, _, _ in candidates]
+    if batched:
+        next_choices = TreeTraversal.step_batched(inference_states, choices)
+    else:
+        next_choices = [
+            inference_state.step(choice)
+            for inference_state, choice in zip(inference_states, choices)
+        ]
+    return zip(candidates, inference_states, next_choices)
+
+
 def beam_search_with_heuristics(
-    model, orig_item, preproc_item, beam_size, max_steps, from_cond=True
+    model,
+    orig_item,
+    preproc_item,
+    beam_size,
+    max_steps,
+    from_cond=True,
+    batched=False,
+    begun=None,
 ):
     """
     Find the valid FROM clasue with beam search
+
+    With batched=True, all live hypotheses run one decoder state update per step
+    and candidates are ranked with tensor top-k.
+    begun is the (inference_state, next_choices) of an item already encoded with
+    model.begin_inference_batch, so it is not encoded again.
     """
-    inference_state, next_choices = model.begin_inference(orig_item, preproc_item)
+    if begun is None:
+        begun = model.begin_inference(orig_item, preproc_item)
+    inference_state, next_choices = begun
     beam = [Hypothesis4Filtering(inference_state, next_choices)]
 
     cached_finished_seqs = []  # cache filtered trajectories
@@ -37,7 +106,7 @@ def beam_search_with_heuristics(
             if len(prefixes2fill_from) >= beam_size:
                 break
 
-            candidates = []
+            to_expand = []
             for hyp in beam_prefix:
                 # print(hyp.inference_state.cur_item.state, hyp.inference_state.cur_item.node_type )
                 if (
@@ -47,23 +116,32 @@ def beam_search_with_heuristics(
                 ):
                     prefixes2fill_from.append(hyp)
                 else:
-                    candidates += [
-                        (
-                            hyp,
-                            choice,
-                            choice_score.item(),
-                            hyp.score + choice_score.item(),
-                        )
-                        for choice, choice_score in hyp.next_choices
-                    ]
-            candidates.sort(key=operator.itemgetter(3), reverse=True)
-            candidates = candidates[: beam_size - len(prefixes2fill_from)]
+                    to_expand.append(hyp)
+            if batched:
+                candidates = top_candidates(
+                    to_expand, beam_size - len(prefixes2fill_from)
+                )
+            else:
+                candidates = [
+                    (
+                        hyp,
+                        choice,
+                        choice_score.item(),
+                        hyp.score + choice_score.item(),
+                    )
+                    for hyp in to_expand
+                    for choice, choice_score in hyp.next_choices
+                ]
+                candidates.sort(key=operator.itemgetter(3), reverse=True)
+                candidates = candidates[: beam_size - len(prefixes2fill_from)]
 
             # Create the new hypotheses from the expansions
             beam_prefix = []
-            for hyp, choice, choice_score, cum_score in candidates:
-                inference_state = hyp.inference_state.clone()
-
+            for (
+                (hyp, choice, choice_score, cum_score),
+                inference_state,
+                next_choices,
+            ) in step_candidates(candidates, batched):
                 # cache column choice
                 column_history = hyp.column_history[:]
                 if (
@@ -74,7 +152,6 @@ def beam_search_with_heuristics(
                     column_history = column_history + [choice]
                     column_index = len(hyp.choice_history)
 
-                next_choices = inference_state.step(choice)
                 assert next_choices is not None
                 if column_history == []:
                     beam_prefix.append(
@@ -116,7 +193,7 @@ def beam_search_with_heuristics(
             if len(unfiltered_finished) + len(prefixes_unfinished) > max_size:
                 break
 
-            candidates = []
+            to_expand = []
             for hyp in beam_from:
                 if (
                     step > 0
@@ -126,22 +203,31 @@ def beam_search_with_heuristics(
                 ):
                     prefixes_unfinished.append(hyp)
                 else:
-                    candidates += [
-                        (
-                            hyp,
-                            choice,
-                            choice_score.item(),
-                            hyp.score + choice_score.item(),
-                        )
-                        for choice, choice_score in hyp.next_choices
-                    ]
-            candidates.sort(key=operator.itemgetter(3), reverse=True)
-            candidates = candidates[: max_size - len(prefixes_unfinished)]
+                    to_expand.append(hyp)
+            if batched:
+                candidates = top_candidates(
+                    to_expand, max_size - len(prefixes_unfinished)
+                )
+            else:
+                candidates = [
+                    (
+                        hyp,
+                        choice,
+                        choice_score.item(),
+                        hyp.score + choice_score.item(),
+                    )
+                    for hyp in to_expand
+                    for choice, choice_score in hyp.next_choices
+                ]
+                candidates.sort(key=operator.itemgetter(3), reverse=True)
+                candidates = candidates[: max_size - len(prefixes_unfinished)]
 
             beam_from = []
-            for hyp, choice, choice_score, cum_score in candidates:
-                inference_state = hyp.inference_state.clone()
-
+            for (
+                (hyp, choice, choice_score, cum_score),
+                inference_state,
+                next_choices,
+            ) in step_candidates(candidates, batched):
                 # cache table choice
                 table_history = hyp.table_history[:]
                 key_column_history = hyp.key_column_history[:]
@@ -154,7 +240,6 @@ def beam_search_with_heuristics(
                     elif hyp.inference_state.cur_item.node_type == "column":
                         key_column_history = key_column_history + [choice]
 
-                next_choices = inference_state.step(choice)
                 if next_choices is None:
                     unfiltered_finished.append(
                         Hypothesis4Filtering(
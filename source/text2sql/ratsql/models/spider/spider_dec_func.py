@@ -47,10 +47,11 @@ def compute_pointer_with_align(
         prev_action_emb,
         parent_h,
         parent_action_emb,
-        desc_enc):
+        desc_enc,
+        precomputed=None):
     new_state, attention_weights = model._update_state(
         node_type, prev_state, prev_action_emb, parent_h,
-        parent_action_emb, desc_enc)
+        parent_action_emb, desc_enc, precomputed)
     # output shape: batch (=1) x emb_size
     output = new_state[0]
     memory_pointer_logits = model.pointers[node_type](
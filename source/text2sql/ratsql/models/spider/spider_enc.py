@@ -2,6 +2,7 @@ import collections
 from copy import deepcopy
 import itertools
 import copy
+import hashlib
 import json
 import os
 
@@ -13,11 +14,16 @@ from konlpy.tag import Kkma
 
 from source.text2sql.ratsql.models import abstract_preproc
 from source.text2sql.ratsql.models.spider import spider_enc_modules
+from source.text2sql.ratsql.models.spider.schema_artifacts import (
+    SchemaArtifactStore,
+    schema_digest,
+)
 from source.text2sql.ratsql.models.spider.spider_match_utils import (
     compute_schema_linking,
     compute_cell_value_linking,
 )
-from source.text2sql.ratsql.resources import corenlp
+from source.text2sql.ratsql.resources import lemmatizer
+from source.text2sql.ratsql.utils import indexed_file
 from source.text2sql.ratsql.utils import registry
 from source.text2sql.ratsql.utils import serialization
 from source.text2sql.ratsql.utils import vocab
@@ -203,6 +209,11 @@ class SpiderEncoderV2Preproc(abstract_preproc.AbstractPreproc):
         preprocessed = self.preprocess_item(
             item, validation_info, manual_linking_info=manual_linking_info
         )
+        self.add_preprocessed_item(item, section, preprocessed)
+        return True, preprocessed
+
+    def add_preprocessed_item(self, item, section, preprocessed):
+        """Adds the result of preprocess_item, counting its tokens for the vocab like add_item."""
         self.texts[section].append(preprocessed)
 
         if section == "train":
@@ -302,19 +313,18 @@ class SpiderEncoderV2Preproc(abstract_preproc.AbstractPreproc):
             self.vocab_builder.save(self.vocab_word_freq_path)
 
         for section, texts in self.texts.items():
-            with open(os.path.join(self.data_dir, section + ".jsonl"), "w") as f:
-                for text in texts:
-                    f.write(json.dumps(text, ensure_ascii=False) + "\n")
+            indexed_file.write_jsonl(
+                os.path.join(self.data_dir, section + ".jsonl"),
+                texts,
+                encode=lambda text: json.dumps(text, ensure_ascii=False),
+            )
 
     def load(self):
         self.vocab = vocab.Vocab.load(self.vocab_path)
         self.vocab_builder.load(self.vocab_word_freq_path)
 
     def dataset(self, section):
-        return [
-            json.loads(line)
-            for line in open(os.path.join(self.data_dir, section + ".jsonl"))
-        ]
+        return indexed_file.load_jsonl(os.path.join(self.data_dir, section + ".jsonl"))
 
 
 @registry.register("encoder", "spiderv2")
@@ -788,16 +798,32 @@ class Bertokens:
             self.idx_map = idx_map
 
         # lemmatize "abc"
-        normalized_toks = []
-        for i, tok in enumerate(new_toks):
-            ann = corenlp.annotate(tok, annotators=["tokenize", "ssplit", "lemma"])
-            lemmas = [tok.lemma.lower() for sent in ann.sentence for tok in sent.token]
-            lemma_word = " ".join(lemmas)
-            normalized_toks.append(lemma_word)
+        normalized_toks = lemmatizer.lemmatize(new_toks)
 
         self.normalized_pieces = normalized_toks
         self.recovered_pieces = new_toks
 
+    def to_dict(self):
+        return {
+            "pieces": self.pieces,
+            "bert_version": self.bert_version,
+            "normalized_pieces": self.normalized_pieces,
+            "recovered_pieces": self.recovered_pieces,
+            # JSON keys are strings, so keep the index map as pairs
+            "idx_map": sorted(self.idx_map.items()),
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        """Restores normalized tokens without tokenizing or lemmatizing again."""
+        bertokens = cls.__new__(cls)
+        bertokens.pieces = d["pieces"]
+        bertokens.bert_version = d["bert_version"]
+        bertokens.normalized_pieces = d["normalized_pieces"]
+        bertokens.recovered_pieces = d["recovered_pieces"]
+        bertokens.idx_map = dict(d["idx_map"])
+        return bertokens
+
     def bert_schema_linking(self, columns, tables, manual_linking_info=None):
         question_tokens = self.normalized_pieces
         column_tokens = [c.normalized_pieces for c in columns]
@@ -838,6 +864,20 @@ class Bertokens:
         return new_cv_link
 
 
+def preprocessed_schema_to_dict(preproc_schema):
+    d = attr.asdict(preproc_schema, recurse=False)
+    for key in ("normalized_column_names", "normalized_table_names"):
+        d[key] = [bertokens.to_dict() for bertokens in d[key]]
+    return d
+
+
+def preprocessed_schema_from_dict(d):
+    d = dict(d)
+    for key in ("normalized_column_names", "normalized_table_names"):
+        d[key] = [Bertokens.from_dict(bertokens) for bertokens in d[key]]
+    return PreprocessedSchema(**d)
+
+
 class SpiderEncoderBertPreproc(SpiderEncoderV2Preproc):
 
     def __init__(
@@ -871,6 +911,10 @@ class SpiderEncoderBertPreproc(SpiderEncoderV2Preproc):
 
         self.counted_db_ids = set()
         self.preprocessed_schemas = {}
+        # Preprocessed schemas persisted per db_id and shared by all processes
+        self.schema_artifacts = SchemaArtifactStore(
+            os.path.join(self.data_dir, "schemas")
+        )
 
         """ jjkim - Sep 30, 2021
         use transformers.AutoModel instead of specific models such as BertModel or ElectraModel
@@ -935,6 +979,9 @@ class SpiderEncoderBertPreproc(SpiderEncoderV2Preproc):
     def add_item_from_cache(self, cached_item, section):
         self.texts[section].append(cached_item)
 
+    def add_preprocessed_item(self, item, section, preprocessed):
+        self.texts[section].append(preprocessed)
+
     def preprocess_item(
         self,
         item,
@@ -1054,15 +1101,33 @@ class SpiderEncoderBertPreproc(SpiderEncoderV2Preproc):
     def _preprocess_schema(self, schema, bert_version="bert-base-uncased"):
         if schema.db_id in self.preprocessed_schemas:
             return self.preprocessed_schemas[schema.db_id]
-        result = preprocess_schema_uncached(
+        digest = schema_digest(
             schema,
-            self._tokenize,
-            self.include_table_name_in_column,
-            self.fix_issue_16_primary_keys,
-            bert=True,
             bert_version=bert_version,
+            include_table_name_in_column=self.include_table_name_in_column,
+            fix_issue_16_primary_keys=self.fix_issue_16_primary_keys,
             use_column_description=self.use_column_description,
         )
+        result = self.schema_artifacts.load_json(
+            schema.db_id, digest, "schema", decode=preprocessed_schema_from_dict
+        )
+        if result is None:
+            result = preprocess_schema_uncached(
+                schema,
+                self._tokenize,
+                self.include_table_name_in_column,
+                self.fix_issue_16_primary_keys,
+                bert=True,
+                bert_version=bert_version,
+                use_column_description=self.use_column_description,
+            )
+            self.schema_artifacts.save_json(
+                schema.db_id,
+                digest,
+                "schema",
+                result,
+                encode=preprocessed_schema_to_dict,
+            )
         self.preprocessed_schemas[schema.db_id] = result
         return result
 
@@ -1072,9 +1137,11 @@ class SpiderEncoderBertPreproc(SpiderEncoderV2Preproc):
             self.tokenizer.save_pretrained(self.data_dir)
 
         for section, texts in self.texts.items():
-            with open(os.path.join(self.data_dir, section + ".jsonl"), "w") as f:
-                for text in texts:
-                    f.write(json.dumps(text, ensure_ascii=False) + "\n")
+            indexed_file.write_jsonl(
+                os.path.join(self.data_dir, section + ".jsonl"),
+                texts,
+                encode=lambda text: json.dumps(text, ensure_ascii=False),
+            )
 
     def load(self):
         """jjkim - Sep 30, 2021
@@ -1178,7 +1245,8 @@ class SpiderEncoderBert(torch.nn.Module):
                 if self.preproc.use_column_description:
                     # JHCHO - 21.11.02: Add [REPLACE] token for col-desc emb
                     if self.preproc.use_column_desc_emb:
-                        col += ["[REPLACE]"]
+                        # copy, desc["columns"] may be the shared preprocessed schema
+                        col = col + ["[REPLACE]"]
                         col_desc = self.pad_single_sentence_for_bert(
                             desc["col_descs"][i], cls=True
                         )
@@ -1187,7 +1255,7 @@ class SpiderEncoderBert(torch.nn.Module):
                         )
                         batch_col_descs.append(indexed_col_desc)
                     else:
-                        col += ["."] + desc["col_descs"][i]
+                        col = col + ["."] + desc["col_descs"][i]
                 cols.append(self.pad_single_sentence_for_bert(col, cls=False))
 
             tabs = [
@@ -1204,34 +1272,9 @@ class SpiderEncoderBert(torch.nn.Module):
 
             # JHCHO - 21.11.02: Generate col-desc emb
             if self.preproc.use_column_description and self.preproc.use_column_desc_emb:
-                (
-                    padded_col_desc_token_lists,
-                    col_desc_att_mask_lists,
-                    col_desc_tok_type_lists,
-                ) = self.pad_sequence_for_bert_batch(batch_col_descs)
-                col_desc_tokens_tensor = torch.tensor(
-                    padded_col_desc_token_lists, dtype=torch.long, device=self._device
-                )
-                col_desc_att_masks_tensor = torch.tensor(
-                    col_desc_att_mask_lists, dtype=torch.long, device=self._device
-                )
-                if not isinstance(
-                    self.bert_col_emb_model, transformers.XLMRobertaModel
-                ):
-                    col_desc_tok_type_tensor = torch.tensor(
-                        col_desc_tok_type_lists, dtype=torch.long, device=self._device
-                    )
-                else:
-                    col_desc_tok_type_tensor = None
-
-                col_desc_output = self.bert_col_emb_model(
-                    col_desc_tokens_tensor,
-                    attention_mask=col_desc_att_masks_tensor,
-                    token_type_ids=col_desc_tok_type_tensor,
-                )[0]
                 batch_col_desc_emb_lists.append(
-                    col_desc_output[:, 0]
-                )  # Get [CLS] embedding
+                    self._col_desc_embeddings(desc, batch_col_descs)
+                )
 
             q_b = len(qs)
             col_b = q_b + sum(len(c) for c in cols)
@@ -1514,6 +1557,63 @@ class SpiderEncoderBert(torch.nn.Module):
         else:
             return False
 
+    def _col_desc_embeddings(self, desc, batch_col_descs):
+        # The col-desc model is frozen, so in eval mode its [CLS] embeddings only
+        # depend on the tokenized descriptions and the checkpoint, and are persisted
+        # with the schema, keyed by a digest of the descriptions
+        if self.training or "db_id" not in desc:
+            return self._compute_col_desc_embeddings(batch_col_descs)
+        db_id = desc["db_id"]
+        digest = hashlib.sha1(json.dumps(batch_col_descs).encode("utf-8")).hexdigest()
+        name = f"col_desc_emb.{self._col_emb_fingerprint()}"
+        cached = self.preproc.schema_artifacts.load_array(db_id, digest, name)
+        if cached is not None:
+            return torch.tensor(np.asarray(cached), device=self._device)
+        col_desc_emb = self._compute_col_desc_embeddings(batch_col_descs)
+        self.preproc.schema_artifacts.save_array(
+            db_id, digest, name, col_desc_emb.detach().cpu().numpy()
+        )
+        return col_desc_emb
+
+    def _col_emb_fingerprint(self):
+        if getattr(self, "_col_emb_digest", None) is None:
+            h = hashlib.sha1()
+            for key, tensor in self.bert_col_emb_model.state_dict().items():
+                tensor = tensor.detach().cpu().contiguous()
+                if tensor.dtype == torch.bfloat16:
+                    # numpy has no bfloat16, float32 holds its values exactly
+                    tensor = tensor.float()
+                h.update(key.encode("utf-8"))
+                h.update(tensor.numpy().tobytes())
+            self._col_emb_digest = h.hexdigest()[:16]
+        return self._col_emb_digest
+
+    def _compute_col_desc_embeddings(self, batch_col_descs):
+        (
+            padded_col_desc_token_lists,
+            col_desc_att_mask_lists,
+            col_desc_tok_type_lists,
+        ) = self.pad_sequence_for_bert_batch(batch_col_descs)
+        col_desc_tokens_tensor = torch.tensor(
+            padded_col_desc_token_lists, dtype=torch.long, device=self._device
+        )
+        col_desc_att_masks_tensor = torch.tensor(
+            col_desc_att_mask_lists, dtype=torch.long, device=self._device
+        )
+        if not isinstance(self.bert_col_emb_model, transformers.XLMRobertaModel):
+            col_desc_tok_type_tensor = torch.tensor(
+                col_desc_tok_type_lists, dtype=torch.long, device=self._device
+            )
+        else:
+            col_desc_tok_type_tensor = None
+
+        col_desc_output = self.bert_col_emb_model(
+            col_desc_tokens_tensor,
+            attention_mask=col_desc_att_masks_tensor,
+            token_type_ids=col_desc_tok_type_tensor,
+        )[0]
+        return col_desc_output[:, 0]  # Get [CLS] embedding
+
     def pad_single_sentence_for_bert(self, toks, cls=True):
         if cls:
             return [self.tokenizer.cls_token] + toks + [self.tokenizer.sep_token]
@@ -16,6 +16,10 @@ def clamp(value, abs_max):
     return value
 
 
+def _none_to(value, default):
+    return default if value is None else value
+
+
 def get_attn_mask(seq_lengths, device):
     # Given seq_lengths like [3, 1, 2], this will produce
     # [[[1, 1, 1],
@@ -346,6 +350,8 @@ class RelationalTransformerUpdate(torch.nn.Module):
         self.tc_foreign_key = tc_foreign_key
         self.tt_max_dist = tt_max_dist
         self.tt_foreign_key = tt_foreign_key
+        # Relations among the schema items only depend on the schema, see _schema_relations
+        self._schema_relations_cache = {}
 
         self.relation_ids = {}
 
@@ -629,6 +635,161 @@ class RelationalTransformerUpdate(torch.nn.Module):
     def compute_relations(
         self, desc, enc_length, q_enc_length, c_enc_length, c_boundaries, t_boundaries
     ):
+        # Same relations as _compute_relations_loop, filled block by block with numpy
+        c_base = q_enc_length
+        t_base = q_enc_length + c_enc_length
+        t_enc_length = enc_length - t_base
+        sc_link = desc.get("sc_link", {"q_col_match": {}, "q_tab_match": {}})
+        cv_link = desc.get("cv_link", {"num_date_match": {}, "cell_match": {}})
+
+        relations = np.empty((enc_length, enc_length), dtype=np.int64)
+        relations[:c_base, :c_base] = self._dist_relations(
+            "qq_dist", q_enc_length, self.qq_max_dist
+        )
+        (
+            relations[:c_base, c_base:t_base],
+            relations[c_base:t_base, :c_base],
+        ) = self._link_relations(
+            "c",
+            (sc_link["q_col_match"], cv_link["cell_match"], cv_link["num_date_match"]),
+            q_enc_length,
+            c_enc_length,
+        )
+        (
+            relations[:c_base, t_base:],
+            relations[t_base:, :c_base],
+        ) = self._link_relations(
+            "t", (sc_link["q_tab_match"],), q_enc_length, t_enc_length
+        )
+        relations[c_base:, c_base:] = self._schema_relations(
+            desc, c_boundaries, t_boundaries
+        )
+        return relations
+
+    def _dist_relations(self, name, length, max_dist):
+        ids = np.array(
+            [self.relation_ids[name, d] for d in range(-max_dist, max_dist + 1)],
+            dtype=np.int64,
+        )
+        positions = np.arange(length)
+        # dist[i, j] = j - i
+        dist = np.clip(-np.subtract.outer(positions, positions), -max_dist, max_dist)
+        return ids[dist + max_dist]
+
+    def _link_relations(self, kind, matches, q_length, length):
+        """The question-to-kind and kind-to-question blocks; earlier matches take precedence."""
+        forward = np.full(
+            (q_length, length), self.relation_ids[f"q{kind}_default"], dtype=np.int64
+        )
+        backward = np.full(
+            (length, q_length), self.relation_ids[f"{kind}q_default"], dtype=np.int64
+        )
+        tags = {}
+        for match in matches:
+            for key, tag in match.items():
+                i, j = map(int, key.split(","))
+                if 0 <= i < q_length and 0 <= j < length:
+                    tags.setdefault((i, j), tag)
+        if tags:
+            rows, cols = np.array(list(tags.keys()), dtype=np.int64).T
+            forward[rows, cols] = [self.relation_ids[f"q{kind}{tag}"] for tag in tags.values()]
+            backward[cols, rows] = [self.relation_ids[f"{kind}q{tag}"] for tag in tags.values()]
+        return forward, backward
+
+    def _schema_relations(self, desc, c_boundaries, t_boundaries):
+        """The (columns + tables) x (columns + tables) block, cached per db_id."""
+        key = None
+        if desc.get("db_id") is not None:
+            key = (
+                desc["db_id"],
+                tuple(c_boundaries),
+                tuple(t_boundaries),
+                tuple(sorted(desc["column_to_table"].items())),
+                tuple(sorted(desc["foreign_keys"].items())),
+                tuple(desc["primary_keys"]),
+            )
+            cached = self._schema_relations_cache.get(key)
+            if cached is not None:
+                return cached
+
+        ids = self.relation_ids
+        num_columns = len(c_boundaries) - 1
+        num_tables = len(t_boundaries) - 1
+        # Column (table) id of every column (table) token
+        c_ids = np.repeat(np.arange(num_columns), np.diff(c_boundaries))
+        t_ids = np.repeat(np.arange(num_tables), np.diff(t_boundaries))
+
+        # -1 stands for None: no table (e.g. for *), or no foreign key
+        column_to_table = np.array(
+            [_none_to(desc["column_to_table"][str(col)], -1) for col in range(num_columns)],
+            dtype=np.int64,
+        )
+        foreign_keys = np.array(
+            [_none_to(desc["foreign_keys"].get(str(col)), -1) for col in range(num_columns)],
+            dtype=np.int64,
+        )
+        primary_keys = np.isin(np.arange(num_columns), list(desc["primary_keys"]))
+        columns, tables = np.arange(num_columns), np.arange(num_tables)
+        # match_foreign_key, which only depends on the column
+        foreign_key_match = (foreign_keys >= 0) & (
+            column_to_table == column_to_table[np.maximum(foreign_keys, 0)]
+        )
+
+        cc = np.full((num_columns, num_columns), ids["cc_default"], dtype=np.int64)
+        if self.cc_foreign_key:
+            cc[foreign_keys[:, None] == columns[None, :]] = ids["cc_foreign_key_forward"]
+            cc[columns[:, None] == foreign_keys[None, :]] = ids["cc_foreign_key_backward"]
+        if self.cc_table_match:
+            cc[column_to_table[:, None] == column_to_table[None, :]] = ids["cc_table_match"]
+
+        def column_table(prefix, foreign_key, table_match):
+            rel = np.full((num_columns, num_tables), ids[f"{prefix}_default"], dtype=np.int64)
+            if foreign_key:
+                rel[foreign_key_match] = ids[f"{prefix}_foreign_key"]
+            if table_match:
+                own = column_to_table[:, None] == tables[None, :]
+                rel[own & primary_keys[:, None]] = ids[f"{prefix}_primary_key"]
+                rel[own & ~primary_keys[:, None]] = ids[f"{prefix}_table_match"]
+                rel[column_to_table < 0] = ids[f"{prefix}_any_table"]
+            return rel
+
+        ct = column_table("ct", self.ct_foreign_key, self.ct_table_match)
+        tc = column_table("tc", self.tc_foreign_key, self.tc_table_match).T
+
+        tt = np.full((num_tables, num_tables), ids["tt_default"], dtype=np.int64)
+        if self.tt_foreign_key:
+            forward = np.zeros((num_tables, num_tables), dtype=bool)
+            for table1, targets in desc["foreign_keys_tables"].items():
+                for table2 in targets:
+                    if int(table1) < num_tables and table2 < num_tables:
+                        forward[int(table1), table2] = True
+            backward = forward.T
+            tt[forward & ~backward] = ids["tt_foreign_key_forward"]
+            tt[backward & ~forward] = ids["tt_foreign_key_backward"]
+            tt[forward & backward] = ids["tt_foreign_key_both"]
+
+        # Expand to tokens; tokens of the same column (table) get distance relations
+        c_length, t_length = len(c_ids), len(t_ids)
+        relations = np.empty((c_length + t_length,) * 2, dtype=np.int64)
+        cc = cc[c_ids[:, None], c_ids[None, :]]
+        same = c_ids[:, None] == c_ids[None, :]
+        cc[same] = self._dist_relations("cc_dist", c_length, self.cc_max_dist)[same]
+        tt = tt[t_ids[:, None], t_ids[None, :]]
+        same = t_ids[:, None] == t_ids[None, :]
+        tt[same] = self._dist_relations("tt_dist", t_length, self.tt_max_dist)[same]
+        relations[:c_length, :c_length] = cc
+        relations[:c_length, c_length:] = ct[c_ids[:, None], t_ids[None, :]]
+        relations[c_length:, :c_length] = tc[t_ids[:, None], c_ids[None, :]]
+        relations[c_length:, c_length:] = tt
+
+        if key is not None:
+            self._schema_relations_cache[key] = relations
+        return relations
+
+    def _compute_relations_loop(
+        self, desc, enc_length, q_enc_length, c_enc_length, c_boundaries, t_boundaries
+    ):
+        # Cell by cell reference implementation of compute_relations
         sc_link = desc.get("sc_link", {"q_col_match": {}, "q_tab_match": {}})
         cv_link = desc.get("cv_link", {"num_date_match": {}, "cell_match": {}})
 
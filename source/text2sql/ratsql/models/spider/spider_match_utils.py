@@ -1,5 +1,8 @@
 import re
+import sqlite3
 import string
+import threading
+from collections import defaultdict
 
 import nltk.corpus
 try:
@@ -12,6 +15,11 @@ except:
 
 PUNKS = set(a for a in string.punctuation)
 
+# SQLite's LIKE only folds the case of ASCII characters
+ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+UNINDEXED_COLUMN_TYPES = ['ARRAY', 'timestamp without time zone', 'numeric', 'integer', 'double precision',
+                          'bigint', 'smallint']
+
 
 def is_int(text):
     try:
@@ -134,6 +142,116 @@ def compute_schema_linking(question, column, table, manual_linking_info=None):
     return {"q_col_match": q_col_match, "q_tab_match": q_tab_match}
 
 
+class CellValueIndex:
+    """Inverted index from cell-value tokens to the ids of the columns containing them.
+
+    A word matches a cell in db_word_match when it is one of the space separated
+    tokens of the cell (ASCII case-insensitive), so looking the word up here gives
+    the same CELLMATCH links as probing every column with LIKE queries.
+    Only sqlite connections are indexed. The index is rebuilt per table when the
+    content of the database changes.
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.connection = schema.connection
+        self.token_to_columns = defaultdict(set)
+        self.table_fingerprints = {}
+        self.table_tokens = {}
+        self.version = None
+        # Turns of different sessions may link against the same database concurrently
+        self.lock = threading.Lock()
+        self.refresh()
+
+    @staticmethod
+    def is_indexable(connection):
+        return isinstance(connection, sqlite3.Connection)
+
+    def _db_version(self):
+        data_version = self.connection.execute("PRAGMA data_version").fetchone()[0]
+        return self.connection.total_changes, data_version
+
+    def _table_columns(self):
+        table_columns = defaultdict(list)
+        for col_id, column in enumerate(self.schema.columns):
+            if col_id == 0 or column.table is None:
+                continue
+            if column.type in UNINDEXED_COLUMN_TYPES:
+                continue
+            table_columns[column.table.orig_name].append((col_id, column.orig_name))
+        return table_columns
+
+    def _fingerprint(self, table, columns):
+        lengths = " + ".join(f"total(length(\"{name}\"))" for _, name in columns)
+        try:
+            return tuple(self.connection.execute(f"select count(*), {lengths} from \"{table}\"").fetchone())
+        except sqlite3.Error:
+            return None
+
+    def _index_table(self, table, columns):
+        tokens = defaultdict(set)
+        names = ", ".join(f"\"{name}\"" for _, name in columns)
+        try:
+            rows = self.connection.execute(f"select distinct {names} from \"{table}\"").fetchall()
+        except sqlite3.Error:
+            rows = []
+        for row in rows:
+            for (col_id, _), value in zip(columns, row):
+                if value is None:
+                    continue
+                if isinstance(value, bytes):
+                    value = value.decode("utf-8", errors="ignore")
+                for token in str(value).translate(ASCII_LOWER).split(" "):
+                    tokens[token].add(col_id)
+        return tokens
+
+    def refresh(self):
+        """Re-index the tables whose content changed since the last refresh."""
+        with self.lock:
+            version = self._db_version()
+            if version == self.version:
+                return
+            changed = False
+            for table, columns in self._table_columns().items():
+                fingerprint = self._fingerprint(table, columns)
+                if table in self.table_tokens and fingerprint == self.table_fingerprints[table]:
+                    continue
+                self.table_fingerprints[table] = fingerprint
+                self.table_tokens[table] = self._index_table(table, columns)
+                changed = True
+            if changed:
+                self._rebuild_token_to_columns()
+            self.version = version
+
+    def _rebuild_token_to_columns(self):
+        token_to_columns = defaultdict(set)
+        for tokens in self.table_tokens.values():
+            for token, col_ids in tokens.items():
+                token_to_columns[token] |= col_ids
+        self.token_to_columns = token_to_columns
+
+    def lookup(self, word):
+        """Ids of the columns having a cell that contains the word as a token."""
+        word = word.strip("'")
+        if "'" in word:
+            # the LIKE probe is not valid SQL for these words
+            return set()
+        return self.token_to_columns.get(word.translate(ASCII_LOWER), set())
+
+
+def get_cell_value_index(schema):
+    """Returns the up-to-date cell value index of the schema, or None if its database can't be indexed."""
+    if not CellValueIndex.is_indexable(schema.connection):
+        return None
+    index = getattr(schema, "value_index", None)
+    if index is None or index.connection is not schema.connection:
+        index = CellValueIndex(schema)
+        schema.value_index = index
+    else:
+        index.refresh()
+    return index
+
+
 def compute_cell_value_linking(tokens, schema, manual_linking_info=None):
     def isnumber(word):
         try:
@@ -178,6 +296,7 @@ def compute_cell_value_linking(tokens, schema, manual_linking_info=None):
 
     num_date_match = {}
     cell_match = {}
+    value_index = get_cell_value_index(schema)
 
     for q_id, word in enumerate(tokens):
         if len(word.strip()) == 0:
@@ -191,6 +310,12 @@ def compute_cell_value_linking(tokens, schema, manual_linking_info=None):
 
         CELL_MATCH_FLAG = "CELLMATCH"
 
+        # LIKE wildcards in the word can't be answered by exact token lookups
+        if value_index is not None and not num_flag and "%" not in word and "_" not in word:
+            for col_id in sorted(value_index.lookup(word)):
+                cell_match[f"{q_id},{col_id}"] = CELL_MATCH_FLAG
+            continue
+
         for col_id, column in enumerate(schema.columns):
             if col_id == 0:
                 assert column.orig_name == "*"
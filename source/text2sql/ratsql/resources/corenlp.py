@@ -1,5 +1,6 @@
 import os
 import sys
+import threading
 
 from stanfordnlp.server import CoreNLPClient
 from stanfordnlp.server.client import PermanentlyFailedException
@@ -28,8 +29,14 @@ class CoreNLP:
         self.client.stop()
 
     def annotate(self, text, annotators=None, output_format=None, properties=None):
+        # Keyword arguments: the fourth positional parameter of the client is properties_key
         try:
-            result = self.client.annotate(text, annotators, output_format, properties)
+            result = self.client.annotate(
+                text,
+                annotators=annotators,
+                output_format=output_format,
+                properties=properties,
+            )
         except (PermanentlyFailedException, requests.exceptions.ConnectionError) as e:
             print(
                 "\nWARNING: CoreNLP connection timeout. Recreating the server...",
@@ -37,16 +44,26 @@ class CoreNLP:
             )
             self.client.stop()
             self.client.start()
-            result = self.client.annotate(text, annotators, output_format, properties)
+            result = self.client.annotate(
+                text,
+                annotators=annotators,
+                output_format=output_format,
+                properties=properties,
+            )
 
         return result
 
 
 _singleton = None
+_singleton_lock = threading.Lock()
 
 
 def annotate(text, annotators=None, output_format=None, properties=None):
     global _singleton
     if not _singleton:
-        _singleton = CoreNLP()
-    return _singleton.annotate(text, annotators, output_format, properties)
+        with _singleton_lock:
+            if not _singleton:
+                _singleton = CoreNLP()
+    return _singleton.annotate(
+        text, annotators=annotators, output_format=output_format, properties=properties
+    )
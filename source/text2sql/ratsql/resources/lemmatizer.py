@@ -0,0 +1,84 @@
+import collections
+import threading
+
+from source.text2sql.ratsql.resources import corenlp
+
+LEMMA_ANNOTATORS = ["tokenize", "ssplit", "lemma"]
+# One word per line, so every word is tokenized and tagged as if annotated alone
+ONE_WORD_PER_SENTENCE = {"ssplit.eolonly": "true"}
+
+
+class Lemmatizer:
+    """Lemmatizes words with CoreNLP, one request per batch of uncached words.
+
+    Lemmas are memoized in a bounded LRU cache that is shared by all callers, so
+    words seen in earlier questions or schemas don't go to the server again.
+    """
+
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.cache = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def _get(self, word):
+        with self.lock:
+            lemma = self.cache.get(word)
+            if lemma is not None:
+                self.cache.move_to_end(word)
+            return lemma
+
+    def _put(self, word, lemma):
+        with self.lock:
+            self.cache[word] = lemma
+            self.cache.move_to_end(word)
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+
+    @staticmethod
+    def _annotate_one(word):
+        ann = corenlp.annotate(word, annotators=LEMMA_ANNOTATORS)
+        return " ".join(tok.lemma.lower() for sent in ann.sentence for tok in sent.token)
+
+    def _annotate(self, words):
+        ann = corenlp.annotate(
+            "\n".join(words), annotators=LEMMA_ANNOTATORS, properties=ONE_WORD_PER_SENTENCE
+        )
+        if len(ann.sentence) != len(words):
+            # CoreNLP dropped or split a line: fall back to one request per word
+            return [self._annotate_one(word) for word in words]
+        return [" ".join(tok.lemma.lower() for tok in sent.token) for sent in ann.sentence]
+
+    def lemmatize(self, words):
+        """Returns the space-joined lowercase lemmas of each word."""
+        lemmas = [self._get(word) for word in words]
+        misses = list(dict.fromkeys(
+            word for word, lemma in zip(words, lemmas) if lemma is None and word.strip()
+        ))
+        annotated = dict(zip(misses, self._annotate(misses))) if misses else {}
+        for word, lemma in annotated.items():
+            self._put(word, lemma)
+        return [
+            lemma if lemma is not None else annotated.get(word, "")
+            for word, lemma in zip(words, lemmas)
+        ]
+
+    def preload(self, words):
+        """Lemmatizes the words ahead of time, e.g. the vocabulary of all schemas."""
+        self.lemmatize(list(dict.fromkeys(words)))
+
+
+_singleton = None
+_singleton_lock = threading.Lock()
+
+
+def get_lemmatizer():
+    global _singleton
+    if not _singleton:
+        with _singleton_lock:
+            if not _singleton:
+                _singleton = Lemmatizer()
+    return _singleton
+
+
+def lemmatize(words):
+    return get_lemmatizer().lemmatize(words)
@@ -1,51 +1,167 @@
+import json
+import mmap
 import os
 import struct
 
+# Each index entry is the (offset, length) of a record in the data file. An
+# entry is written only after its record, so the index is the commit log: a
+# record without entry (e.g. after a crash) is discarded when resuming.
+ENTRY = struct.Struct('<QQ')
+
 
 def read_index(filename):
     index = []
-    with open(filename) as index_file:
-        while True:
-            offset = index_file.read(8)
-            if not offset:
-                break
-            offset, = struct.unpack('<Q', offset)
-            index.append(offset)
+    with open(filename, 'rb') as index_file:
+        data = index_file.read()
+    # A partially written entry at the end is not committed
+    usable = len(data) - len(data) % ENTRY.size
+    for offset, length in ENTRY.iter_unpack(data[:usable]):
+        index.append((offset, length))
     return index
 
 
 class IndexedFileWriter(object):
-    def __init__(self, path):
-        self.f = open(path, 'wb')
-        self.index_f = open(path + '.index', 'wb')
+    """Appends records to a data file and their (offset, length) to path + '.index'.
+
+    With resume=True an existing file is continued after its last committed
+    record instead of being truncated.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.index_path = path + '.index'
+        self.num_records = 0
+        if resume and os.path.exists(path) and os.path.exists(self.index_path):
+            index = read_index(self.index_path)
+            size = os.path.getsize(path)
+            while index and sum(index[-1]) > size:
+                index.pop()
+            end = sum(index[-1]) if index else 0
+            # Drop anything written after the last committed record
+            with open(path, 'r+b') as f:
+                f.truncate(end)
+            with open(self.index_path, 'r+b') as f:
+                f.truncate(len(index) * ENTRY.size)
+            self.num_records = len(index)
+            self.f = open(path, 'ab')
+            self.index_f = open(self.index_path, 'ab')
+        else:
+            self.f = open(path, 'wb')
+            self.index_f = open(self.index_path, 'wb')
+
+    def __len__(self):
+        return self.num_records
 
     def append(self, record):
         offset = self.f.tell()
         self.f.write(record)
-        self.index_f.write(struct.pack('<Q', offset))
+        self.f.flush()
+        self.index_f.write(ENTRY.pack(offset, len(record)))
+        self.index_f.flush()
+        self.num_records += 1
 
     def close(self):
         self.f.close()
         self.index_f.close()
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
 
 class IndexedFileReader(object):
-    def __init__(self, path):
-        self.f = open(path, 'rb')
+    """O(1) random access to the records of an indexed file, through mmap.
+
+    The file is opened on first access, so readers can be passed to worker
+    processes (e.g. by a DataLoader) before being used.
+    """
 
+    def __init__(self, path):
+        self.path = path
         self.index = read_index(path + '.index')
-        self.lengths = [
-            end - start
-            for start, end in zip([0] + self.index, self.index +
-                                  [os.path.getsize(path)])
-        ]
+        self._mmap = None
+
+    def _data(self):
+        if self._mmap is None:
+            with open(self.path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    self._mmap = b''
+                else:
+                    self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
 
     def __len__(self):
         return len(self.index)
 
     def __getitem__(self, idx):
-        # TODO: support slices
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
         if not isinstance(idx, int):
-            return TypeError('index must be integer')
-        self.file.seek(self.index[idx])
-        return self.file.read(self.lengths[idx])
+            raise TypeError('index must be integer or slice')
+        offset, length = self.index[idx]
+        return self._data()[offset:offset + length]
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def head(self, idx, sep=b'\n'):
+        """The start of a record up to sep (excluded), without reading the rest."""
+        offset, length = self.index[idx]
+        data = self._data()
+        end = data.find(sep, offset, offset + length)
+        return data[offset:offset + length if end < 0 else end]
+
+    def close(self):
+        if isinstance(self._mmap, mmap.mmap):
+            self._mmap.close()
+        self._mmap = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_mmap'] = None
+        return state
+
+
+class IndexedJsonDataset(object):
+    """A JSON Lines file read record by record through its index, decoded on access."""
+
+    def __init__(self, path, transform=None):
+        self.reader = IndexedFileReader(path)
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.reader)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        value = json.loads(self.reader[idx])
+        return self.transform(value) if self.transform else value
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+
+def write_jsonl(path, values, encode=json.dumps):
+    """Writes values as JSON Lines, with an index for IndexedJsonDataset."""
+    with IndexedFileWriter(path) as writer:
+        for value in values:
+            writer.append((encode(value) + '\n').encode('utf-8'))
+
+
+def load_jsonl(path, transform=None):
+    """Random access to a JSON Lines file written by write_jsonl; files without index are read whole.
+
+    An index that does not end where the data file ends was left by an older
+    write of the file (e.g. by a writer that does not keep an index) and is ignored.
+    """
+    if os.path.exists(path + '.index'):
+        index = read_index(path + '.index')
+        if (sum(index[-1]) if index else 0) == os.path.getsize(path):
+            return IndexedJsonDataset(path, transform)
+    with open(path) as f:
+        return [transform(json.loads(line)) if transform else json.loads(line) for line in f]
@@ -2,10 +2,11 @@ import os
 import json
 import hydra
 import _jsonnet
-from typing import Tuple, List, Any
+from typing import Tuple, List, Any, Optional
 from config.path import ABS_CONFIG_DIR
 from omegaconf import DictConfig
-from source.utils import One_time_Preprocesser, add_value_one_sql
+from source.utils import One_time_Preprocesser, TurnContext, add_value_one_sql
+from source.value_filling import get_value_filler
 from source.text2sql.ratsql.commands.infer import Inferer
 from source.text2sql.ratsql.models.spider import spider_beam_search
 
@@ -50,7 +51,10 @@ class Text2SQL:
             raise RuntimeError(f"config file does not exist: {experiment_config_path}")
 
         self.preprocessor = One_time_Preprocesser(
-            db_path, table_path, model_config["model"]["encoder_preproc"]
+            db_path,
+            table_path,
+            model_config["model"]["encoder_preproc"],
+            preload_lemmas=cfg.preload_lemmas,
         )
 
         inferer = Inferer(model_config)
@@ -58,8 +62,18 @@ class Text2SQL:
         model.to(device)
         self.model = model
 
+        self.value_filler = get_value_filler(
+            max_connections=cfg.value_filling.max_connections,
+            row_cap=cfg.value_filling.row_cap,
+            refresh_interval_sec=cfg.value_filling.refresh_interval_sec,
+        )
+
     def translate(
-        self, text: str, text_history: str, db_id: str
+        self,
+        text: str,
+        text_history: str,
+        db_id: str,
+        turn: Optional[TurnContext] = None,
     ) -> Tuple[List[Any], str]:
         """Translate natural language text to SQL query.
 
@@ -67,15 +81,38 @@ class Text2SQL:
             text: Current user query text
             text_history: Conversation history with previous queries
             db_id: Database identifier for schema context
+            turn: Turn context holding already computed preprocessing results
 
         Returns:
             Tuple containing:
                 - beams: List of beam search results with scores
                 - inferred_code: Generated SQL query string with values filled
         """
-        orig_item, preproc_item = self.preprocess(text, text_history, db_id)
-        if not text_history.endswith(text):
-            text_history += " <s> " + text
+        if turn is None:
+            turn = TurnContext(self.preprocessor, text, text_history, db_id)
+        return self._decode(turn)
+
+    def translate_batch(self, turns: List[TurnContext]) -> List[Tuple[List[Any], str]]:
+        """Translate the turns of several concurrent requests.
+
+        The turns are encoded together in one padded encoder pass, then each one
+        is decoded from its own slice of the encoding.
+
+        Args:
+            turns: Turn context of each request
+
+        Returns:
+            (beams, inferred_code) of each turn, as returned by translate
+        """
+        items = [turn.preprocess() for turn in turns]
+        begun = self.model.begin_inference_batch(
+            [orig_item for orig_item, _ in items],
+            [(preproc_item, None) for _, preproc_item in items],
+        )
+        return [self._decode(turn, begun=b) for turn, b in zip(turns, begun)]
+
+    def _decode(self, turn: TurnContext, begun=None) -> Tuple[List[Any], str]:
+        orig_item, preproc_item = turn.preprocess()
 
         beams = spider_beam_search.beam_search_with_heuristics(
             self.model,
@@ -83,18 +120,28 @@ class Text2SQL:
             (preproc_item, None),
             beam_size=self.cfg.beam_size,
             max_steps=self.cfg.max_steps,
+            batched=self.cfg.batched_beam_search,
+            begun=begun,
         )
 
         _, inferred_code = beams[0].inference_state.finalize()
 
         inferred_code = add_value_one_sql(
-            question=text, db_name=db_id, sql=inferred_code, history=text_history
+            question=turn.text,
+            db_name=turn.db_id,
+            sql=inferred_code,
+            history=turn.history,
+            filler=self.value_filler,
         )
 
         return beams, inferred_code
 
     def preprocess(
-        self, text: str, text_history: str, db_id: str
+        self,
+        text: str,
+        text_history: str,
+        db_id: str,
+        turn: Optional[TurnContext] = None,
     ) -> Tuple[Any, Any]:
         """Preprocess input text with conversation history for model inference.
 
@@ -102,15 +149,29 @@ class Text2SQL:
             text: Current user query text
             text_history: Conversation history with previous queries
             db_id: Database identifier for schema context
+            turn: Turn context to memoize the result in
 
         Returns:
             Tuple containing:
                 - orig_item: Original preprocessed item with schema information
                 - preproc_item: Model-ready preprocessed item with encoded features
         """
-        input_text = "<s> " + text + text_history
-        orig_item, preproc_item = self.preprocessor.run(input_text, db_id)
-        return orig_item, preproc_item
+        if turn is None:
+            turn = TurnContext(self.preprocessor, text, text_history, db_id)
+        return turn.preprocess()
+
+    def new_turn(self, text: str, text_history: str, db_id: str) -> TurnContext:
+        """Create a turn context sharing this translator's preprocessor.
+
+        Args:
+            text: Current user query text
+            text_history: Conversation history before this turn
+            db_id: Database identifier for schema context
+
+        Returns:
+            TurnContext to pass to translate, intent inference and analysis
+        """
+        return TurnContext(self.preprocessor, text, text_history, db_id)
 
 
 @hydra.main(version_base=None, config_path=ABS_CONFIG_DIR, config_name="config")
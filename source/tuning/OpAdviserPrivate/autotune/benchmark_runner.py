@@ -0,0 +1,167 @@
+import os
+import time
+import signal
+import subprocess
+import numpy as np
+from scipy import stats
+
+from .knobs import logger
+
+FINISHED, EARLY_STOPPED, TIMED_OUT = 'finished', 'early_stopped', 'timeout'
+
+
+class RunningStats:
+    """Running mean and variance (Welford) of the interim samples of a benchmark, per metric."""
+
+    def __init__(self):
+        self.n = dict()
+        self.mean = dict()
+        self.m2 = dict()
+        self.values = dict()
+
+    def add(self, sample):
+        for metric, value in sample.items():
+            n = self.n.get(metric, 0) + 1
+            mean = self.mean.get(metric, 0.)
+            delta = value - mean
+            mean += delta / n
+            self.m2[metric] = self.m2.get(metric, 0.) + delta * (value - mean)
+            self.n[metric], self.mean[metric] = n, mean
+            self.values.setdefault(metric, list()).append(value)
+
+    def count(self, metric):
+        return self.n.get(metric, 0)
+
+    def var(self, metric):
+        """Sample variance, like statistics.variance."""
+        n = self.count(metric)
+        return self.m2[metric] / (n - 1) if n > 1 else 0.
+
+    def external_metrics(self):
+        """[tps, lat, qps, tps_var, lat_var, qps_var] of the samples, in the format of parse_sysbench."""
+        means = [self.mean.get(metric, -1) for metric in ('tps', 'lat', 'qps')]
+        variances = [self.var(metric) if metric in self.n else -1 for metric in ('tps', 'lat', 'qps')]
+        return means + variances
+
+
+class ConfidenceBoundRule:
+    """Stops a trial once its interim performance is confidently worse than the incumbent's.
+
+    For a maximized metric, the trial is stopped when the upper bound of the
+    Student-t confidence interval of its mean falls below the incumbent's mean
+    (lowered by a relative margin); for a minimized metric, when the lower
+    bound exceeds it. Nothing is decided before min_samples samples.
+    """
+
+    def __init__(self, metric, maximize, incumbent, confidence=0.99, min_samples=3, margin=0.):
+        self.metric = metric
+        self.maximize = maximize
+        self.incumbent = incumbent
+        self.confidence = confidence
+        self.min_samples = max(2, int(min_samples))
+        self.margin = margin
+
+    def bound(self, running_stats):
+        n = running_stats.count(self.metric)
+        half_width = stats.t.ppf(self.confidence, n - 1) * np.sqrt(running_stats.var(self.metric) / n)
+        mean = running_stats.mean[self.metric]
+        return mean + half_width if self.maximize else mean - half_width
+
+    def should_stop(self, running_stats):
+        if running_stats.count(self.metric) < self.min_samples:
+            return False
+        if self.maximize:
+            return self.bound(running_stats) < self.incumbent * (1 - self.margin)
+        return self.bound(running_stats) > self.incumbent * (1 + self.margin)
+
+
+class _FileTail:
+    """Reads the lines appended to a file since the last read."""
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.partial = b''
+
+    def read_lines(self, final=False):
+        if self.path is None or not os.path.exists(self.path):
+            return []
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read()
+        self.offset += len(data)
+        lines = (self.partial + data).split(b'\n')
+        self.partial = lines.pop()
+        if final and self.partial:
+            lines.append(self.partial)
+            self.partial = b''
+        return [line.decode(errors='replace') for line in lines]
+
+
+class BenchmarkRunner:
+    """Runs a benchmark command while tailing its output file.
+
+    Each line appended to output_file is parsed by parse_line (returning
+    {metric: value} or None) into RunningStats, so the interim tps/latency is
+    known while the benchmark runs. The benchmark is terminated when the
+    stop_rule (e.g. ConfidenceBoundRule) fires, or after timeout seconds.
+    """
+
+    def __init__(self, cmd, output_file=None, parse_line=None, timeout=None, stop_rule=None, poll_interval=0.5):
+        self.cmd = cmd
+        self.output_file = output_file
+        self.parse_line = parse_line
+        self.timeout = timeout
+        self.stop_rule = stop_rule
+        self.poll_interval = poll_interval
+        self.stats = RunningStats()
+        self.status = None
+        self.returncode = None
+
+    def _consume(self, tail, final=False):
+        if self.parse_line is None:
+            return
+        for line in tail.read_lines(final):
+            sample = self.parse_line(line)
+            if sample is not None:
+                self.stats.add(sample)
+
+    def _terminate(self, proc):
+        # The command runs in a shell of its own session, stop the whole process group
+        try:
+            os.killpg(proc.pid, signal.SIGTERM)
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            os.killpg(proc.pid, signal.SIGKILL)
+            proc.wait()
+        except ProcessLookupError:
+            pass
+
+    def run(self):
+        """Runs the benchmark to completion, early stop or timeout; returns the status."""
+        proc = subprocess.Popen(self.cmd, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                close_fds=True, start_new_session=True)
+        tail = _FileTail(self.output_file)
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while True:
+            try:
+                self.returncode = proc.wait(timeout=self.poll_interval)
+            except subprocess.TimeoutExpired:
+                pass
+            self._consume(tail)
+            if self.returncode is not None:
+                self.status = FINISHED
+                break
+            if self.stop_rule is not None and self.stop_rule.should_stop(self.stats):
+                logger.info('early stop: {} bound {:.4f} vs incumbent {:.4f} after {} samples'.format(
+                    self.stop_rule.metric, self.stop_rule.bound(self.stats), self.stop_rule.incumbent,
+                    self.stats.count(self.stop_rule.metric)))
+                self._terminate(proc)
+                self.status = EARLY_STOPPED
+                break
+            if deadline is not None and time.monotonic() > deadline:
+                self._terminate(proc)
+                self.status = TIMED_OUT
+                break
+        self._consume(tail, final=True)
+        return self.status
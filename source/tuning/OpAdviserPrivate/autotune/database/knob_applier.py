@@ -0,0 +1,39 @@
+import numbers
+
+
+def canonical_knob_value(value):
+    """Normalizes a knob value as set by the tuner or reported by the server, for comparison."""
+    text = str(value).strip()
+    if text.upper() in ('ON', 'TRUE'):
+        return 1.0
+    if text.upper() in ('OFF', 'FALSE'):
+        return 0.0
+    try:
+        return float(text)
+    except ValueError:
+        return text.lower()
+
+
+def same_knob_value(current, target):
+    return canonical_knob_value(current) == canonical_knob_value(target)
+
+
+def changed_knobs(current, knobs):
+    """The knobs whose target differs from the current value (or that the server did not report)."""
+    return {k: v for k, v in knobs.items() if k not in current or not same_knob_value(current[k], v)}
+
+
+def sql_literal(value):
+    """Numbers are passed as is, anything else as a quoted string."""
+    if isinstance(value, numbers.Number) and not isinstance(value, bool):
+        return str(value)
+    text = str(value)
+    try:
+        float(text)
+        return text
+    except ValueError:
+        return "'{}'".format(text.replace("'", "''"))
+
+
+def sql_name_list(names):
+    return ', '.join("'{}'".format(str(name).replace("'", "''")) for name in names)
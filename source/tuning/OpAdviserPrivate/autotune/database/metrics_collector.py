@@ -0,0 +1,160 @@
+import time
+import threading
+import numpy as np
+from autotune.knobs import logger
+
+
+class MetricsRingBuffer:
+    """Preallocated (samples x metrics) buffer keeping the latest `capacity` samples.
+
+    The metric names are fixed by the first sample; later samples are aligned by
+    name (metrics missing in a sample are NaN).
+    """
+
+    def __init__(self, capacity, num_metrics=None):
+        self.capacity = max(1, int(capacity))
+        self.num_metrics = num_metrics
+        self.names = None
+        self._index = None
+        self._data = None
+        self._next = 0
+        self._count = 0
+
+    @classmethod
+    def from_records(cls, records):
+        """Builds a buffer from a list of {name: value} samples."""
+        buffer = cls(len(records))
+        for record in records:
+            buffer.append_dict(record)
+        return buffer
+
+    def __len__(self):
+        return self._count
+
+    def _init(self, names):
+        self.names = list(names)
+        self._index = {name: i for i, name in enumerate(self.names)}
+        width = len(self.names) if self.num_metrics is None else max(self.num_metrics, len(self.names))
+        self._data = np.full((self.capacity, width), np.nan)
+
+    def append(self, names, values):
+        """Stores one sample given as parallel sequences of names and values."""
+        if self._data is None:
+            self._init(names)
+        row = self._data[self._next]
+        if list(names) == self.names:
+            row[:len(self.names)] = np.asarray(values, dtype=np.float64)
+        else:
+            row.fill(np.nan)
+            for name, value in zip(names, values):
+                i = self._index.get(name)
+                if i is not None:
+                    row[i] = value
+        self._next = (self._next + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def append_dict(self, sample):
+        self.append(list(sample.keys()), [float(v) for v in sample.values()])
+
+    def samples(self):
+        """The stored samples, oldest first, one column per name."""
+        if self._data is None:
+            return np.empty((0, 0))
+        width = len(self.names)
+        if self._count < self.capacity:
+            return self._data[:self._count, :width]
+        return np.roll(self._data, -self._next, axis=0)[:, :width]
+
+    def last(self):
+        if not self._count:
+            return None
+        return self._data[(self._next - 1) % self.capacity, :len(self.names)].copy()
+
+    def counter_deltas(self):
+        """Increase of each counter metric between the first and the last sample."""
+        samples = self.samples()
+        return samples[-1] - samples[0]
+
+    def value_means(self):
+        """Average of each value metric over the samples."""
+        return np.nanmean(self.samples(), axis=0)
+
+    def sorted_order(self):
+        """Column order sorting the metrics by name."""
+        return np.argsort(np.array(self.names, dtype=object), kind='stable')
+
+
+class InternalMetricsCollector:
+    """Samples the internal metrics of a database on one persistent connection.
+
+    Samples are taken by a thread of the calling process every `interval`
+    seconds on a monotonic schedule (a slow sample delays only itself, missed
+    ticks are skipped), starting after `warmup` seconds, and are written into a
+    MetricsRingBuffer. `fetch(db_conn)` returns the (names, values) of one
+    sample; `connect()` opens the connection, which is reopened after errors.
+    """
+
+    def __init__(self, connect, fetch, interval, duration, warmup=0, num_metrics=None):
+        self.connect = connect
+        self.fetch = fetch
+        self.interval = float(interval)
+        self.duration = duration
+        self.warmup = warmup
+        self.buffer = MetricsRingBuffer(int(np.ceil(duration / self.interval)) + 2, num_metrics)
+        self.db_conn = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='InternalMetricsCollector', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        start = time.monotonic()
+        deadline = start + self.duration
+        tick = 1
+        while True:
+            next_time = start + tick * self.interval
+            if next_time >= deadline or self._stop.wait(max(0.0, next_time - time.monotonic())):
+                break
+            if next_time - start > self.warmup:
+                self.sample()
+            # Skip the ticks a slow sample ran into
+            tick = max(tick + 1, int((time.monotonic() - start) // self.interval) + 1)
+
+    def sample(self):
+        """Takes one sample now, returns False if the database could not be queried."""
+        with self._lock:
+            try:
+                if self.db_conn is None:
+                    self.db_conn = self.connect()
+                names, values = self.fetch(self.db_conn)
+            except Exception as err:
+                logger.info("connection failed during internal metrics collection")
+                logger.info(err)
+                self._close()
+                return False
+            self.buffer.append(names, values)
+            return True
+
+    def stop(self, final_sample=True):
+        """Stops sampling, optionally takes a last snapshot, and closes the connection."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if final_sample:
+            self.sample()
+        with self._lock:
+            self._close()
+        return self.buffer
+
+    def _close(self):
+        if self.db_conn is not None:
+            try:
+                self.db_conn.close_db()
+            except Exception:
+                pass
+            self.db_conn = None
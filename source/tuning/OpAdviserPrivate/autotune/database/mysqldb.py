@@ -9,6 +9,9 @@ import numpy as np
 import multiprocessing as mp
 from getpass import getpass
 from autotune.dbconnector import MysqlConnector
+from autotune.database.metrics_collector import InternalMetricsCollector, MetricsRingBuffer
+from autotune.database.knob_applier import changed_knobs, same_knob_value, sql_literal, sql_name_list
+from autotune.database.restart_manager import RestartManager
 from autotune.knobs import logger
 from autotune.utils.parser import ConfigParser
 from autotune.knobs import initialize_knobs, get_default_knobs
@@ -18,7 +21,7 @@ src_data_path = os.environ.get("DATASRC")
 log_num_default = 2
 log_size_default = 50331648
 
-RESTART_WAIT_TIME = 5
+RESTART_TIMEOUT = 600
 TIMEOUT_CLOSE = 60
 
 logging.getLogger("paramiko").setLevel(logging.ERROR)
@@ -55,6 +58,7 @@ class MysqlDB:
             self.connection_info['socket'] = self.sock
         # resource isolation information
         self.isolation_mode = eval(args['isolation_mode'])
+        self.cgroup = args['cgroup'] or 'server'
         if self.isolation_mode and self.remote_mode:
             self.ssh_passwd = getpass(prompt='Password on host for cgroups commands: ')
 
@@ -67,12 +71,14 @@ class MysqlDB:
             'buffer_pool_pages_dirty', 'buffer_pool_bytes_dirty', 'buffer_pool_pages_free',
             'trx_rseg_history_len', 'file_num_open_files', 'innodb_page_size'
         ]
-        self.im_alive_init()  # im collection signal
 
         # MySQL Knobs
         self.knobs_detail = initialize_knobs(args['knob_config_file'], int(args['knob_num']))
         self.default_knobs = get_default_knobs()
         self.pre_combine_log_file_size = log_num_default * log_size_default
+        self.knob_apply_failures = dict()
+        self.restart_manager = RestartManager(self.knobs_detail, self.host, self.port, sock=self.sock,
+                                              timeout=RESTART_TIMEOUT)
 
         self.clear_cmd = """mysqladmin processlist -uroot -S$MYSQL_SOCK | awk '$2 ~ /^[0-9]/ {print "KILL "$2";"}' | mysql -uroot -S$MYSQL_SOCK """
 
@@ -168,81 +174,128 @@ class MysqlDB:
             self.pid = int(start_stdout.readline())
 
             if self.isolation_mode:
-                cgroup_cmd = 'sudo -S cgclassify -g memory,cpuset:server ' + str(self.pid)
+                cgroup_cmd = 'sudo -S cgclassify -g memory,cpuset:{} {}'.format(self.cgroup, self.pid)
                 ssh_stdin, ssh_stdout, _ = ssh.exec_command(cgroup_cmd)
                 ssh_stdin.write(self.ssh_passwd + '\n')
                 ssh_stdin.flush()
                 ret_code = ssh_stdout.channel.recv_exit_status()
                 ssh.close()
                 if not ret_code:
-                    logger.info('add {} to memory,cpuset:server'.format(self.pid))
+                    logger.info('add {} to memory,cpuset:{}'.format(self.pid, self.cgroup))
                 else:
-                    logger.info('Failed: add {} to memory,cpuset:server'.format(self.pid))
+                    logger.info('Failed: add {} to memory,cpuset:{}'.format(self.pid, self.cgroup))
 
         else:
             proc = subprocess.Popen([self.mysqld, '--defaults-file={}'.format(self.mycnf)])
             self.pid = proc.pid
             if self.isolation_mode:
-                command = 'sudo cgclassify -g memory,cpuset:server ' + str(self.pid)
+                command = 'sudo cgclassify -g memory,cpuset:{} {}'.format(self.cgroup, self.pid)
                 p = os.system(command)
                 if not p:
-                    logger.info('add {} to memory,cpuset:server'.format(self.pid))
+                    logger.info('add {} to memory,cpuset:{}'.format(self.pid, self.cgroup))
                 else:
-                    logger.info('Failed: add {} to memory,cpuset:server'.format(self.pid))
+                    logger.info('Failed: add {} to memory,cpuset:{}'.format(self.pid, self.cgroup))
 
-        count = 0
-        start_sucess = True
         logger.info('wait for connection')
-        error, db_conn = None, None
-        while True:
-            try:
-                dbc = MysqlConnector(**self.connection_info)
-                db_conn = dbc.conn
-                if db_conn.is_connected():
-                    logger.info('Connected to MySQL db')
-                    db_conn.close()
-                    break
-            except Exception as result:
-                if count > 30:
-                    logger.info(result)
-                pass
-
-            time.sleep(1)
-            count = count + 1
-            if count > 600:
-                start_sucess = False
-                logger.info("can not connect to DB")
-                break
-
-        logger.info('finish {} seconds waiting for connection'.format(count))
+        alive = None if self.remote_mode else (lambda: proc.poll() is None)
+        start_sucess = self.restart_manager.wait_until_ready(self._mysql_ready, alive=alive,
+                                                             remote=self.remote_mode)
+        if not start_sucess:
+            logger.info("can not connect to DB")
         logger.info('{} --defaults-file={}'.format(self.mysqld, self.mycnf))
         logger.info('mysql is up')
         return start_sucess
 
+    def _mysql_ready(self):
+        db_conn = MysqlConnector(**self.connection_info)
+        connected = db_conn.conn.is_connected()
+        db_conn.close_db()
+        return connected
+
     def reinitdb_magic(self):
         self._kill_mysqld()
-        time.sleep(10)
+        self.restart_manager.wait_until_stopped(self.remote_mode)
         os.system('rm -rf {}'.format(self.sock))
-        os.system('rm -rf {}'.format(dst_data_path))  # avoid moving src into dst
-        logger.info('remove all files in {}'.format(dst_data_path))
-        os.system('cp -r {} {}'.format(src_data_path, dst_data_path))
-        logger.info('cp -r {} {}'.format(src_data_path, dst_data_path))
+        self.restart_manager.restore_data_dir(src_data_path, dst_data_path)
         self.pre_combine_log_file_size = log_num_default * log_size_default
         self.apply_knobs_offline(self.default_knobs)
         self.reinit_interval = 0
 
     def apply_knobs_online(self, knobs):
-        db_conn = MysqlConnector(**self.connection_info)
+        """Applies the knobs whose value differs from the server's in one SET statement.
+
+        The current values are read in one query before and after the SET. Knobs the server
+        rejects are kept in self.knob_apply_failures and logged, the others are still applied.
+        """
+        targets = dict()
         if 'innodb_io_capacity' in knobs.keys():
-            self.set_knob_value(db_conn, 'innodb_io_capacity_max', 2 * int(knobs['innodb_io_capacity']))
+            # innodb_io_capacity may not exceed innodb_io_capacity_max, so the max goes first
+            targets['innodb_io_capacity_max'] = 2 * int(knobs['innodb_io_capacity'])
+        targets.update(knobs)
 
-        for key in knobs.keys():
-            self.set_knob_value(db_conn, key, knobs[key])
+        db_conn = MysqlConnector(**self.connection_info)
+        changed = changed_knobs(self._get_global_variables(db_conn, targets.keys()), targets)
+        failures = dict()
+        if changed:
+            sql = 'SET ' + ', '.join('GLOBAL {}={}'.format(k, sql_literal(v)) for k, v in changed.items())
+            try:
+                db_conn.execute(sql)
+            except Exception:
+                # The whole statement is rejected, find the culprits and apply the rest
+                for k, v in changed.items():
+                    try:
+                        db_conn.execute('SET GLOBAL {}={}'.format(k, sql_literal(v)))
+                    except Exception as err:
+                        failures[k] = str(err)
+            applied = self._get_global_variables(db_conn, changed.keys())
+            for k, v in changed.items():
+                if k not in failures and not same_knob_value(applied.get(k), v):
+                    logger.info("Knob {} is {} instead of {}".format(k, applied.get(k), v))
         db_conn.close_db()
-        logger.info("[{}] Knobs applied online!".format(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())))
+
+        self.knob_apply_failures = failures
+        for k, err in failures.items():
+            logger.info("Failed: set {}={}: {}".format(k, targets[k], err))
+        logger.info("[{}] {} of {} knobs changed online!".format(
+            time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()), len(changed) - len(failures), len(targets)))
+        return True
+
+    def _get_global_variables(self, db_conn, names):
+        sql = 'SHOW GLOBAL VARIABLES WHERE Variable_name IN ({});'.format(sql_name_list(names))
+        return {r['Variable_name']: r['Value'] for r in db_conn.fetch_results(sql)}
+
+    def _apply_knobs_without_restart(self, knobs):
+        """Sets the knobs online if none of the knobs that change is static, returns whether it did.
+
+        The config file is rewritten as well, so that a later restart keeps the values.
+        """
+        try:
+            db_conn = MysqlConnector(**self.connection_info)
+            current = self._get_global_variables(db_conn, knobs.keys())
+            db_conn.close_db()
+        except Exception:
+            # mysqld is not running
+            return False
+        changed = changed_knobs(current, knobs)
+        if 'innodb_thread_concurrency' in changed and \
+                changed['innodb_thread_concurrency'] * (200 * 1024) > self.pre_combine_log_file_size:
+            return False
+        static = self.restart_manager.restart_knobs(changed)
+        if static:
+            logger.info('restart for static knobs: {}'.format(', '.join(static)))
+            return False
+
+        self._gen_config_file(knobs)
+        self.apply_knobs_online(changed)
+        if self.knob_apply_failures:
+            return False
+        logger.info('all {} changed knobs are dynamic, skip the restart'.format(len(changed)))
         return True
 
     def apply_knobs_offline(self, knobs):
+        if self._apply_knobs_without_restart(knobs):
+            return True
+
         # modify cnf and restart db
         self._kill_mysqld()
         modify_concurrency = False
@@ -270,8 +323,6 @@ class MysqlDB:
         knobs_rdsL = self._gen_config_file(knobs)
         sucess = self._start_mysqld()
         try:
-            logger.info('sleeping for {} seconds after restarting mysql'.format(RESTART_WAIT_TIME))
-            time.sleep(RESTART_WAIT_TIME)
             db_conn = MysqlConnector(**self.connection_info)
             sql1 = 'SHOW VARIABLES LIKE "innodb_log_file_size";'
             sql2 = 'SHOW VARIABLES LIKE "innodb_log_files_in_group";'
@@ -295,136 +346,49 @@ class MysqlDB:
 
         return sucess
 
-    def _check_apply(self, db_conn, k, v0):
-        sql = 'SHOW GLOBAL VARIABLES LIKE "{}";'.format(k)
-        r = db_conn.fetch_results(sql)
-        if r[0]['Value'] == 'ON':
-            vv = 1
-        elif r[0]['Value'] == 'OFF':
-            vv = 0
-        else:
-            vv = r[0]['Value'].strip()
-        if vv == v0:
-            return False
-        return True
-
-    def set_knob_value(self, db_conn, k, v):
-        sql = 'SHOW GLOBAL VARIABLES LIKE "{}";'.format(k)
-        r = db_conn.fetch_results(sql)
-
-        # type convert
-        if v == 'ON':
-            v = 1
-        elif v == 'OFF':
-            v = 0
-        if r[0]['Value'] == 'ON':
-            v0 = 1
-        elif r[0]['Value'] == 'OFF':
-            v0 = 0
-        else:
-            try:
-                v0 = eval(r[0]['Value'])
-            except:
-                v0 = r[0]['Value'].strip()
-
-        if v0 == v:
-            return True
-
-        if str(v).isdigit():
-            sql = "SET GLOBAL {}={}".format(k, v)
-        else:
-            sql = "SET GLOBAL {}='{}'".format(k, v)
-        try:
-            db_conn.execute(sql)
-        except:
-            logger.info("Failed: execute {}".format(sql))
-
-        while not self._check_apply(db_conn, k, v0):
-            time.sleep(1)
-        return True
-
-    def im_alive_init(self):
-        global im_alive
-        im_alive = mp.Value('b', True)
+    def _connect_internal_metrics(self):
+        db_conn = MysqlConnector(**self.connection_info)
+        # Every sample has to see the current counters
+        db_conn.conn.autocommit = True
+        return db_conn
 
-    def set_im_alive(self, value):
-        im_alive.value = value
+    def _fetch_internal_metrics(self, db_conn):
+        sql = 'SELECT NAME, COUNT from information_schema.INNODB_METRICS where status="enabled" ORDER BY NAME'
+        res = db_conn.fetch_results(sql, json=False)
+        return [k for (k, v) in res], [v for (k, v) in res]
 
-    def get_internal_metrics(self, internal_metrics, BENCHMARK_RUNNING_TIME, BENCHMARK_WARMING_TIME):
+    def get_internal_metrics(self, BENCHMARK_RUNNING_TIME, BENCHMARK_WARMING_TIME):
         """Get the all internal metrics of MySQL, like io_read, physical_read.
 
-        This func uses a SQL statement to lookup system table: information_schema.INNODB_METRICS
-        and returns the lookup result.
+        Starts sampling information_schema.INNODB_METRICS every second, after the warm-up,
+        on one connection. Returns the running InternalMetricsCollector; its stop() takes
+        a final snapshot and returns the MetricsRingBuffer of all samples.
         """
-        _counter = 0
-        _period = 1
-        count = (BENCHMARK_RUNNING_TIME + BENCHMARK_WARMING_TIME) / _period - 1
-        warmup = BENCHMARK_WARMING_TIME / _period
-
-        def collect_metric(counter):
-            counter += 1
-            timer = threading.Timer(float(_period), collect_metric, (counter,))
-            timer.start()
-            if counter >= count or not im_alive.value:
-                timer.cancel()
-            if counter > warmup:
-                try:
-                    print('collect internal metrics {}'.format(counter))
-                    db_conn = MysqlConnector(**self.connection_info)
-
-                    sql = 'SELECT NAME, COUNT from information_schema.INNODB_METRICS where status="enabled" ORDER BY NAME'
-                    res = db_conn.fetch_results(sql, json=False)
-                    res_dict = {}
-                    for (k, v) in res:
-                        res_dict[k] = v
-                    internal_metrics.append(res_dict)
-
-                except Exception as err:
-                    self.connect_sucess = False
-                    logger.info("connection failed during internal metrics collection")
-                    logger.info(err)
-
-        collect_metric(_counter)
-        return internal_metrics
+        return InternalMetricsCollector(self._connect_internal_metrics, self._fetch_internal_metrics,
+                                        interval=1,
+                                        duration=BENCHMARK_RUNNING_TIME + BENCHMARK_WARMING_TIME,
+                                        warmup=BENCHMARK_WARMING_TIME,
+                                        num_metrics=self.num_metrics).start()
 
     def _post_handle(self, metrics):
-        def do(metric_name, metric_values):
-            metric_type = 'counter'
-            if metric_name in self.value_type_metrics:
-                metric_type = 'value'
-            if metric_type == 'counter':
-                return float(metric_values[-1] - metric_values[0]) * 23 / len(metric_values)
-            else:
-                return float(sum(metric_values)) / len(metric_values)
+        if not isinstance(metrics, MetricsRingBuffer):
+            metrics = MetricsRingBuffer.from_records(metrics)
+        order = metrics.sorted_order()
+        keys = [metrics.names[i] for i in order]
+        is_value = np.isin(keys, self.value_type_metrics)
+        counters = metrics.counter_deltas()[order] * 23 / len(metrics)
+        values = np.where(is_value, metrics.value_means()[order], counters)
 
         result = np.zeros(65)
-        keys = list(metrics[0].keys())
-        keys.sort()
-        total_pages = 0
-        dirty_pages = 0
-        request = 0
-        reads = 0
-        page_data = 0
-        page_size = 0
-        page_misc = 0
-        for idx in range(len(keys)):
-            key = keys[idx]
-            data = [x[key] for x in metrics]
-            result[idx] = do(key, data)
-            if key == 'buffer_pool_pages_total':
-                total_pages = result[idx]
-            elif key == 'buffer_pool_pages_dirty':
-                dirty_pages = result[idx]
-            elif key == 'buffer_pool_read_requests':
-                request = result[idx]
-            elif key == 'buffer_pool_reads':
-                reads = result[idx]
-            elif key == 'buffer_pool_pages_data':
-                page_data = result[idx]
-            elif key == 'innodb_page_size':
-                page_size = result[idx]
-            elif key == 'buffer_pool_pages_misc':
-                page_misc = result[idx]
+        result[:len(keys)] = values
+        named = dict(zip(keys, values))
+        total_pages = named.get('buffer_pool_pages_total', 0)
+        dirty_pages = named.get('buffer_pool_pages_dirty', 0)
+        request = named.get('buffer_pool_read_requests', 0)
+        reads = named.get('buffer_pool_reads', 0)
+        page_data = named.get('buffer_pool_pages_data', 0)
+        page_size = named.get('innodb_page_size', 0)
+        page_misc = named.get('buffer_pool_pages_misc', 0)
         dirty_pages_per = dirty_pages / total_pages
         hit_ratio = request / float(request + reads)
         page_data = (page_data + page_misc) * page_size / (1024.0 * 1024.0 * 1024.0)
@@ -8,13 +8,19 @@ import numpy as np
 import multiprocessing as mp
 from getpass import getpass
 from autotune.dbconnector import PostgresqlConnector
+from autotune.database.metrics_collector import InternalMetricsCollector, MetricsRingBuffer
+from autotune.database.knob_applier import changed_knobs, same_knob_value, sql_literal, sql_name_list
+from autotune.database.restart_manager import RestartManager
 from autotune.knobs import logger
 from autotune.utils.parser import ConfigParser
 from autotune.knobs import initialize_knobs, get_default_knobs
 
 dst_data_path = os.environ.get("DATADST")
 src_data_path = os.environ.get("DATASRC")
-RESTART_WAIT_TIME = 20
+RESTART_TIMEOUT = 600
+RELOAD_WAIT_TIME = 1
+# pg_settings contexts of the parameters that can only be changed by a restart
+STATIC_CONTEXTS = ('postmaster', 'internal')
 TIMEOUT_CLOSE = 60
 
 logging.getLogger("paramiko").setLevel(logging.ERROR)
@@ -46,6 +52,7 @@ class PostgresqlDB:
 
         # resource isolation information
         self.isolation_mode = eval(args['isolation_mode'])
+        self.cgroup = args['cgroup'] or 'server'
         if self.isolation_mode:
             self.ssh_passwd = getpass(prompt='Password on host for cgroups commands: ')
 
@@ -78,11 +85,14 @@ class PostgresqlDB:
             # index
             'idx_blks_hit', 'idx_blks_read', 'idx_scan', 'idx_tup_fetch', 'idx_tup_read'
         ]
-        self.im_alive_init()
 
         # PostgreSQL Knobs
         self.knobs_detail = initialize_knobs(args['knob_config_file'], int(args['knob_num']))
         self.default_knobs = get_default_knobs()
+        self.knob_apply_failures = dict()
+        pidfile = None if self.remote_mode else os.path.join(self.pgdata, 'postmaster.pid')
+        self.restart_manager = RestartManager(self.knobs_detail, self.host, self.port, sock=self.sock,
+                                              pidfile=pidfile, timeout=RESTART_TIMEOUT)
 
         self.clear_cmd = """psql -c \"select pg_terminate_backend(pid) from pg_stat_activity where datname = 'imdbload';\" """
 
@@ -175,92 +185,169 @@ class PostgresqlDB:
             self.pid = int(start_stdout.readline())
 
             if self.isolation_mode:
-                cgroup_cmd = 'sudo -S cgclassify -g memory,cpuset:server ' + str(self.pid)
+                cgroup_cmd = 'sudo -S cgclassify -g memory,cpuset:{} {}'.format(self.cgroup, self.pid)
                 ssh_stdin, ssh_stdout, _ = ssh.exec_command(cgroup_cmd)
                 ssh_stdin.write(self.ssh_passwd + '\n')
                 ssh_stdin.flush()
                 ret_code = ssh_stdout.channel.recv_exit_status()
                 ssh.close()
                 if not ret_code:
-                    logger.info('add {} to memory,cpuset:server'.format(self.pid))
+                    logger.info('add {} to memory,cpuset:{}'.format(self.pid, self.cgroup))
                 else:
-                    logger.info('Failed: add {} to memory,cpuset:server'.format(self.pid))
+                    logger.info('Failed: add {} to memory,cpuset:{}'.format(self.pid, self.cgroup))
 
         else:
             proc = subprocess.Popen([self.postgres, '--config_file={}'.format(self.pgcnf), '-D',  self.pgdata])
             self.pid = proc.pid
             if self.isolation_mode:
-                command = 'sudo cgclassify -g memory,cpuset:server ' + str(self.pid)
+                command = 'sudo cgclassify -g memory,cpuset:{} {}'.format(self.cgroup, self.pid)
                 p = os.system(command)
                 if not p:
-                    logger.info('add {} to memory,cpuset:server'.format(self.pid))
+                    logger.info('add {} to memory,cpuset:{}'.format(self.pid, self.cgroup))
                 else:
-                    logger.info('Failed: add {} to memory,cpuset:server'.format(self.pid))
+                    logger.info('Failed: add {} to memory,cpuset:{}'.format(self.pid, self.cgroup))
 
-        count = 0
-        start_sucess = True
         logger.info('wait for connection')
-        while True:
-            try:
-                dbc = PostgresqlConnector(host=self.host,
-                                          port=self.port,
-                                          user=self.user,
-                                          passwd=self.passwd,
-                                          name=self.dbname)
-                db_conn = dbc.conn
-                if db_conn.closed == 0:
-                    logger.info('Connected to PostgreSQL db')
-                    db_conn.close()
-                    break
-            except:
-                pass
-
-            time.sleep(1)
-            count = count + 1
-            if count > 600:
-                start_sucess = False
-                logger.info("can not connect to DB")
-                clear_cmd = """ps -ef|grep postgres|grep -v grep|cut -c 9-15|xargs kill -9"""
-                subprocess.Popen(clear_cmd, shell=True, stderr=subprocess.STDOUT, stdout=subprocess.PIPE,
-                                 close_fds=True)
-                logger.info("kill all postgres process")
-                break
-
-        logger.info('finish {} seconds waiting for connection'.format(count))
+        alive = None if self.remote_mode else (lambda: proc.poll() is None)
+        start_sucess = self.restart_manager.wait_until_ready(self._postgres_ready, alive=alive,
+                                                             remote=self.remote_mode)
+        if not start_sucess:
+            logger.info("can not connect to DB")
+            clear_cmd = """ps -ef|grep postgres|grep -v grep|cut -c 9-15|xargs kill -9"""
+            subprocess.Popen(clear_cmd, shell=True, stderr=subprocess.STDOUT, stdout=subprocess.PIPE,
+                             close_fds=True)
+            logger.info("kill all postgres process")
+
         logger.info('postgres --config_file={}'.format(self.pgcnf))
         logger.info('postgres is up')
         return start_sucess
 
+    def _postgres_ready(self):
+        db_conn = PostgresqlConnector(host=self.host,
+                                      port=self.port,
+                                      user=self.user,
+                                      passwd=self.passwd,
+                                      name=self.dbname)
+        connected = db_conn.conn.closed == 0
+        db_conn.close_db()
+        return connected
+
     def reinitdb_magic(self):
         self._kill_postgres()
-        time.sleep(10)
+        self.restart_manager.wait_until_stopped(self.remote_mode)
         # os.system('rm -rf {}'.format(self.sock))
-        os.system('rm -rf {}'.format(dst_data_path))  # avoid moving src into dst
-        logger.info('remove all files in {}'.format(dst_data_path))
-        os.system('cp -r {} {}'.format(src_data_path, dst_data_path))
-        logger.info('cp -r {} {}'.format(src_data_path, dst_data_path))
+        self.restart_manager.restore_data_dir(src_data_path, dst_data_path)
         # self.pre_combine_log_file_size = log_num_default * log_size_default
         self.apply_knobs_offline(self.default_knobs)
         self.reinit_interval = 0
 
     def apply_knobs_online(self, knobs):
-        # self.restart_rds()
-        # apply knobs remotely
+        """Writes the knobs whose value differs from the server's with ALTER SYSTEM and reloads once.
+
+        The current values are read from pg_settings in one query before and after the reload.
+        Knobs the server rejects, or that only take effect after a restart, are kept in
+        self.knob_apply_failures and logged.
+        """
         db_conn = PostgresqlConnector(host=self.host,
                                       port=self.port,
                                       user=self.user,
                                       passwd=self.passwd,
                                       name=self.dbname)
-
-        for key in knobs.keys():
-            self.set_knob_value(db_conn, key, knobs[key])
+        # ALTER SYSTEM cannot run in a transaction block (nor in a multi-statement query)
+        db_conn.conn.autocommit = True
+        changed = changed_knobs(self._get_settings(db_conn, knobs.keys()), knobs)
+        failures = dict()
+        for k, v in changed.items():
+            try:
+                db_conn.execute('ALTER SYSTEM SET {} = {}'.format(k, sql_literal(v)))
+            except Exception as err:
+                failures[k] = str(err)
+
+        if len(changed) > len(failures):
+            pending = {k: v for k, v in changed.items() if k not in failures}
+            applied, waiting = self._reload_conf(db_conn, pending)
+            for k, v in pending.items():
+                setting, pending_restart = applied.get(k, (None, False))
+                if pending_restart:
+                    failures[k] = 'requires a restart'
+                elif k in waiting:
+                    logger.info("Knob {} is {} instead of {}".format(k, setting, v))
         db_conn.close_db()
-        logger.info("[{}] Knobs applied online!".format(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())))
+
+        self.knob_apply_failures = failures
+        for k, err in failures.items():
+            logger.info("Failed: set {}={}: {}".format(k, knobs[k], err))
+        logger.info("[{}] {} of {} knobs changed online!".format(
+            time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()), len(changed) - len(failures), len(knobs)))
         return True
 
-    def apply_knobs_offline(self, knobs):
-        self._kill_postgres()
+    def _reload_conf(self, db_conn, pending):
+        """Reloads the configuration and waits briefly until the pending {knob: value} show up in pg_settings.
+
+        Returns the {knob: (setting, pending_restart)} read last, and the knobs that still differ.
+        """
+        db_conn.execute('SELECT pg_reload_conf()')
+        # The reload signal is handled asynchronously
+        deadline = time.monotonic() + RELOAD_WAIT_TIME
+        while True:
+            applied = self._get_settings(db_conn, pending.keys(), with_pending_restart=True)
+            waiting = [k for k, v in pending.items()
+                       if k in applied and not applied[k][1] and not same_knob_value(applied[k][0], v)]
+            if not waiting or time.monotonic() > deadline:
+                return applied, waiting
+            time.sleep(0.01)
+
+    def _get_settings(self, db_conn, names, with_pending_restart=False):
+        sql = 'SELECT name, setting, pending_restart FROM pg_settings WHERE name IN ({});'.format(sql_name_list(names))
+        results = db_conn.fetch_results(sql, json=False)
+        if with_pending_restart:
+            return {name: (setting, pending_restart) for name, setting, pending_restart in results}
+        return {name: setting for name, setting, _ in results}
+
+    def _get_contexts(self, db_conn, names):
+        sql = 'SELECT name, context FROM pg_settings WHERE name IN ({});'.format(sql_name_list(names))
+        return dict(db_conn.fetch_results(sql, json=False))
+
+    def _apply_knobs_without_restart(self, knobs):
+        """Reloads the config file if none of the knobs that change is static, returns whether it did.
+
+        Knobs whose JSON entry does not say whether they are dynamic are classified
+        by their pg_settings context.
+        """
+        try:
+            db_conn = PostgresqlConnector(host=self.host,
+                                          port=self.port,
+                                          user=self.user,
+                                          passwd=self.passwd,
+                                          name=self.dbname)
+        except Exception:
+            # postgres is not running
+            return False
+        try:
+            db_conn.conn.autocommit = True
+            changed = changed_knobs(self._get_settings(db_conn, knobs.keys()), knobs)
+            contexts = self._get_contexts(db_conn, changed.keys())
+            dynamic = {k: context not in STATIC_CONTEXTS for k, context in contexts.items()}
+            static = self.restart_manager.restart_knobs(changed, dynamic)
+            if static:
+                logger.info('restart for static knobs: {}'.format(', '.join(static)))
+                return False
+
+            knobs_not_in_cnf = self._gen_config_file(knobs)
+            pending = {k: v for k, v in changed.items() if k not in knobs_not_in_cnf}
+            if pending:
+                applied, _ = self._reload_conf(db_conn, pending)
+                if any(applied.get(k, (None, False))[1] for k in pending):
+                    return False
+        finally:
+            db_conn.close_db()
+
+        if len(knobs_not_in_cnf) > 0:
+            self.apply_knobs_online({k: knobs[k] for k in knobs_not_in_cnf})
+        logger.info('all {} changed knobs are dynamic, skip the restart'.format(len(changed)))
+        return True
 
+    def apply_knobs_offline(self, knobs):
         if 'min_wal_size' in knobs.keys():
             if 'wal_segment_size' in knobs.keys():
                 wal_segment_size = knobs['wal_segment_size']
@@ -270,12 +357,13 @@ class PostgresqlDB:
                 knobs['min_wal_size'] = 2 * wal_segment_size
                 logger.info('"min_wal_size" must be at least twice "wal_segment_size"')
 
+        if self._apply_knobs_without_restart(knobs):
+            return True
+
+        self._kill_postgres()
         knobs_not_in_cnf = self._gen_config_file(knobs)
         sucess = self._start_postgres()
         try:
-            logger.info('sleeping for {} seconds after restarting postgres'.format(RESTART_WAIT_TIME))
-            time.sleep(RESTART_WAIT_TIME)
-
             if len(knobs_not_in_cnf) > 0:
                 tmp_rds = {}
                 for knob_rds in knobs_not_in_cnf:
@@ -286,140 +374,80 @@ class PostgresqlDB:
 
         return sucess
 
-    def _check_apply(self, db_conn, k, v0):
-        sql = 'SHOW {};'.format(k)
-        r = db_conn.fetch_results(sql)
-        if r[0]['Value'] == 'ON':
-            vv = 1
-        elif r[0]['Value'] == 'OFF':
-            vv = 0
-        else:
-            vv = r[0]['Value'].strip()
-        if vv == v0:
-            return False
-        return True
-
-    def set_knob_value(self, db_conn, k, v):
-        sql = 'SHOW {};'.format(k)
-        r = db_conn.fetch_results(sql)
-
-        # type convert
-        if v == 'ON':
-            v = 1
-        elif v == 'OFF':
-            v = 0
-        if r[0]['Value'] == 'ON':
-            v0 = 1
-        elif r[0]['Value'] == 'OFF':
-            v0 = 0
-        else:
-            try:
-                v0 = eval(r[0]['Value'])
-            except:
-                v0 = r[0]['Value'].strip()
-        if v0 == v:
-            return True
-
+    def _connect_internal_metrics(self):
+        db_conn = PostgresqlConnector(host=self.host,
+                                      port=self.port,
+                                      user=self.user,
+                                      passwd=self.passwd,
+                                      name=self.dbname)
+        # Statistics views are frozen for the duration of a transaction
+        db_conn.conn.autocommit = True
+        return db_conn
+
+    def _fetch_internal_metrics(self, db_conn):
+        metrics_dict = {
+            'global': {},
+            'local': {
+                'db': {},
+                'table': {},
+                'index': {}
+            }
+        }
+
+        for view in self.PG_STAT_VIEWS:
+            sql = 'SELECT * from {}'.format(view)
+            results = db_conn.fetch_results(sql, json=True)
+            if view in ["pg_stat_archiver", "pg_stat_bgwriter"]:
+                metrics_dict['global'][view] = results[0]
+            else:
+                if view in self.PG_STAT_VIEWS_LOCAL_DATABASE:
+                    type = 'db'
+                    type_key = 'datname'
+                elif view in self.PG_STAT_VIEWS_LOCAL_TABLE:
+                    type = 'table'
+                    type_key = 'relname'
+                elif view in self.PG_STAT_VIEWS_LOCAL_INDEX:
+                    type = 'index'
+                    type_key = 'relname'
+                metrics_dict['local'][type][view] = {}
+                for res in results:
+                    type_name = res[type_key]
+                    metrics_dict['local'][type][view][type_name] = res
+
+        metrics = {}
+        for scope, sub_vars in list(metrics_dict.items()):
+            if scope == 'global':
+                metrics.update(self.parse_helper(metrics, sub_vars))
+            elif scope == 'local':
+                for _, viewnames in list(sub_vars.items()):
+                    for viewname, objnames in list(viewnames.items()):
+                        for _, view_vars in list(objnames.items()):
+                            metrics.update(self.parse_helper(metrics, {viewname: view_vars}))
+
+        # Combine values
+        valid_metrics = {}
+        for name, values in list(metrics.items()):
+            if name.split('.')[-1] in self.NUMERIC_METRICS:
+                values = [float(v) for v in values if v is not None]
+                if len(values) == 0:
+                    valid_metrics[name] = 0
+                else:
+                    valid_metrics[name] = sum(values)
 
-        if str(v).isdigit():
-            sql = "SET {}={}".format(k, v)
-        else:
-            sql = "SET {}='{}'".format(k, v)
-        try:
-            db_conn.execute(sql)
-        except:
-            logger.info("Failed: execute {}".format(sql))
+        names = sorted(valid_metrics.keys())
+        return names, [valid_metrics[name] for name in names]
 
-        while not self._check_apply(db_conn, k, v0):
-            time.sleep(1)
-        return True
+    def get_internal_metrics(self, BENCHMARK_RUNNING_TIME, BENCHMARK_WARMING_TIME):
+        """Samples the pg_stat views every 5 seconds, after the warm-up, on one connection.
 
-    def im_alive_init(self):
-        global im_alive
-        im_alive = mp.Value('b', True)
-
-    def set_im_alive(self, value):
-        im_alive.value = value
-
-    def get_internal_metrics(self, internal_metrics, BENCHMARK_RUNNING_TIME, BENCHMARK_WARMING_TIME):
-        _counter = 0
-        _period = 5
-        count = (BENCHMARK_RUNNING_TIME + BENCHMARK_WARMING_TIME) / _period - 1
-        warmup = BENCHMARK_WARMING_TIME / _period
-
-        def collect_metric(counter):
-            counter += 1
-            timer = threading.Timer(float(_period), collect_metric, (counter,))
-            timer.start()
-            if counter >= count or not im_alive.value:
-                timer.cancel()
-            if counter > warmup:
-                try:
-                    # print('collect internal metrics {}'.format(counter))
-                    db_conn = PostgresqlConnector(host=self.host,
-                                                  port=self.port,
-                                                  user=self.user,
-                                                  passwd=self.passwd,
-                                                  name=self.dbname)
-                    metrics_dict = {
-                        'global': {},
-                        'local': {
-                            'db': {},
-                            'table': {},
-                            'index': {}
-                        }
-                    }
-
-                    for view in self.PG_STAT_VIEWS:
-                        sql = 'SELECT * from {}'.format(view)
-                        results = db_conn.fetch_results(sql, json=True)
-                        if view in ["pg_stat_archiver", "pg_stat_bgwriter"]:
-                            metrics_dict['global'][view] = results[0]
-                        else:
-                            if view in self.PG_STAT_VIEWS_LOCAL_DATABASE:
-                                type = 'db'
-                                type_key = 'datname'
-                            elif view in self.PG_STAT_VIEWS_LOCAL_TABLE:
-                                type = 'table'
-                                type_key = 'relname'
-                            elif view in self.PG_STAT_VIEWS_LOCAL_INDEX:
-                                type = 'index'
-                                type_key = 'relname'
-                            metrics_dict['local'][type][view] = {}
-                            for res in results:
-                                type_name = res[type_key]
-                                metrics_dict['local'][type][view][type_name] = res
-
-                    metrics = {}
-                    for scope, sub_vars in list(metrics_dict.items()):
-                        if scope == 'global':
-                            metrics.update(self.parse_helper(metrics, sub_vars))
-                        elif scope == 'local':
-                            for _, viewnames in list(sub_vars.items()):
-                                for viewname, objnames in list(viewnames.items()):
-                                    for _, view_vars in list(objnames.items()):
-                                        metrics.update(self.parse_helper(metrics, {viewname: view_vars}))
-
-                    # Combine values
-                    valid_metrics = {}
-                    for name, values in list(metrics.items()):
-                        if name.split('.')[-1] in self.NUMERIC_METRICS:
-                            values = [float(v) for v in values if v is not None]
-                            if len(values) == 0:
-                                valid_metrics[name] = 0
-                            else:
-                                valid_metrics[name] = str(sum(values))
-
-                    internal_metrics.append(valid_metrics)
-
-                except Exception as err:
-                    self.connect_sucess = False
-                    logger.info("connection failed during internal metrics collection")
-                    logger.info(err)
-
-        collect_metric(_counter)
-        # f.close()
-        return internal_metrics
+        Returns the running InternalMetricsCollector; its stop() takes a final snapshot
+        and returns the MetricsRingBuffer of all samples.
+        """
+        return InternalMetricsCollector(self._connect_internal_metrics, self._fetch_internal_metrics,
+                                        interval=5,
+                                        duration=BENCHMARK_RUNNING_TIME + BENCHMARK_WARMING_TIME,
+                                        warmup=BENCHMARK_WARMING_TIME,
+                                        num_metrics=self.num_metrics).start()
 
     def parse_helper(self, valid_variables, view_variables):
         for view_name, variables in list(view_variables.items()):
@@ -431,16 +459,11 @@ class PostgresqlDB:
         return valid_variables
 
     def _post_handle(self, metrics):
-        def do(metric_name, metric_values):
-            return float(float(metric_values[-1]) - float(metric_values[0])) / len(metric_values)
-
+        if not isinstance(metrics, MetricsRingBuffer):
+            metrics = MetricsRingBuffer.from_records(metrics)
+        order = metrics.sorted_order()
         result = np.zeros(self.num_metrics)
-        keys = list(metrics[0].keys())
-        keys.sort()
-        for idx in range(len(keys)):
-            key = keys[idx]
-            data = [x[key] for x in metrics]
-            result[idx] = do(key, data)
+        result[:len(order)] = metrics.counter_deltas()[order] / len(metrics)
         # TODO:
         dirty_pages_per, hit_ratio, page_data = 0, 0, 0
         return result, dirty_pages_per, hit_ratio, page_data
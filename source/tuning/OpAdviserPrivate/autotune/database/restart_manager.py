@@ -0,0 +1,179 @@
+import os
+import time
+import shutil
+import socket
+import subprocess
+from autotune.knobs import logger
+
+# Backoff of the readiness probes, in seconds
+PROBE_INITIAL_DELAY = 0.05
+PROBE_MAX_DELAY = 2.0
+
+
+def is_dynamic_knob(detail):
+    """Reads the 'dynamic' field of a knob JSON entry: True, False, or None if it does not say."""
+    if not isinstance(detail, dict) or detail.get('dynamic') is None:
+        return None
+    dynamic = detail['dynamic']
+    if isinstance(dynamic, str):
+        return dynamic.strip().lower() in ('yes', 'true', '1')
+    return bool(dynamic)
+
+
+def backoff(timeout, initial_delay=PROBE_INITIAL_DELAY, max_delay=PROBE_MAX_DELAY):
+    """Yields the elapsed time before each attempt, sleeping exponentially longer in between, until timeout."""
+    start = time.monotonic()
+    delay = initial_delay
+    while True:
+        elapsed = time.monotonic() - start
+        yield elapsed
+        if elapsed >= timeout:
+            return
+        time.sleep(min(delay, max(0.0, timeout - elapsed)))
+        delay = min(delay * 2, max_delay)
+
+
+class RestartManager:
+    """Restarts of a database instance: when they are needed, readiness, and data directory restore.
+
+    A knob change needs a restart only if some changed knob is static, as
+    classified by the 'dynamic' field of the knob JSON (or by the server, see
+    restart_knobs). Readiness is detected by probing the unix socket (or TCP
+    port) and the pidfile with exponential backoff, before the caller's own
+    probe (e.g. a real login) is tried, instead of polling once a second.
+    """
+
+    def __init__(self, knobs_detail, host, port, sock=None, pidfile=None, timeout=600):
+        self.knobs_detail = knobs_detail
+        self.host = host
+        self.port = int(port)
+        self.sock = sock
+        self.pidfile = pidfile
+        self.timeout = timeout
+        # Whether the filesystem supports reflinks, known after the first restore
+        self.reflink = None
+
+    def restart_knobs(self, knobs, dynamic=None):
+        """The knobs that only take effect after a restart.
+
+        dynamic is an optional {name: bool} reported by the server, used for
+        knobs whose JSON entry does not say; knobs unknown to both are assumed
+        static. Knobs without JSON entry are not written to the config file
+        and always set online, so they never need a restart.
+        """
+        dynamic = dynamic or dict()
+        static = list()
+        for name in knobs:
+            if name not in self.knobs_detail:
+                continue
+            is_dynamic = is_dynamic_knob(self.knobs_detail[name])
+            if is_dynamic is None:
+                is_dynamic = dynamic.get(name, False)
+            if not is_dynamic:
+                static.append(name)
+        return static
+
+    def _socket_path(self):
+        if not self.sock:
+            return None
+        if os.path.isdir(self.sock):
+            # PostgreSQL takes the socket directory
+            return os.path.join(self.sock, '.s.PGSQL.{}'.format(self.port))
+        return self.sock
+
+    def endpoint_open(self, remote=False):
+        """Whether the server accepts connections on its unix socket (locally) or TCP port."""
+        path = None if remote else self._socket_path()
+        if path is not None and os.path.exists(path):
+            family, address = socket.AF_UNIX, path
+        else:
+            family, address = socket.AF_INET, (self.host, self.port)
+        s = socket.socket(family, socket.SOCK_STREAM)
+        s.settimeout(1)
+        try:
+            s.connect(address)
+            return True
+        except OSError:
+            return False
+        finally:
+            s.close()
+
+    def pidfile_ready(self):
+        """Checks the pidfile, if any: its process is alive and, for PostgreSQL, its status line says ready."""
+        if self.pidfile is None:
+            return True
+        try:
+            with open(self.pidfile) as f:
+                lines = f.read().splitlines()
+            pid = int(lines[0])
+            os.kill(pid, 0)
+        except (OSError, ValueError, IndexError):
+            return False
+        # postmaster.pid ends with the postmaster status since PostgreSQL 10
+        if len(lines) >= 8 and lines[7].strip() in ('starting', 'stopping', 'standby'):
+            return False
+        return True
+
+    def wait_until_ready(self, probe, alive=None, remote=False, timeout=None):
+        """Waits until the endpoint and pidfile probes pass and probe() returns True.
+
+        alive() tells whether the started process still runs; if it exits (e.g.
+        on an invalid knob value) waiting stops at once. Returns whether the
+        server became ready.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        attempts = 0
+        for elapsed in backoff(timeout):
+            attempts += 1
+            if (remote or self.pidfile_ready()) and self.endpoint_open(remote):
+                try:
+                    if probe():
+                        logger.info('ready after {:.2f} seconds ({} probes)'.format(elapsed, attempts))
+                        return True
+                except Exception as err:
+                    if elapsed > 30:
+                        logger.info(err)
+            if alive is not None and not alive():
+                logger.info('the server exited during startup after {:.2f} seconds'.format(elapsed))
+                return False
+        logger.info('not ready after {} seconds'.format(timeout))
+        return False
+
+    def wait_until_stopped(self, remote=False, timeout=10):
+        """Waits until the server no longer accepts connections."""
+        for _ in backoff(timeout):
+            if not self.endpoint_open(remote):
+                return True
+        return False
+
+    def restore_data_dir(self, src, dst):
+        """Makes dst an exact copy of the snapshot src, returns the method used.
+
+        On filesystems supporting reflinks (btrfs, xfs, ...) the copy shares the
+        snapshot's blocks until they are written, so it takes only metadata
+        operations. Otherwise rsync copies only the files that differ from the
+        snapshot, falling back to a full copy if rsync is not installed.
+        """
+        if self.reflink is not False:
+            tmp = dst.rstrip('/') + '.restore'
+            shutil.rmtree(tmp, ignore_errors=True)
+            ret = subprocess.run(['cp', '-a', '--reflink=always', src, tmp],
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode
+            self.reflink = ret == 0
+            if self.reflink:
+                shutil.rmtree(dst, ignore_errors=True)
+                os.rename(tmp, dst)
+                logger.info('restored {} from {} by reflink'.format(dst, src))
+                return 'reflink'
+            shutil.rmtree(tmp, ignore_errors=True)
+            logger.info('reflinks are not supported for {}'.format(src))
+
+        if shutil.which('rsync') is not None and os.path.isdir(dst):
+            subprocess.run(['rsync', '-a', '--delete', os.path.join(src, ''), os.path.join(dst, '')], check=True)
+            logger.info('restored {} from {} by rsync'.format(dst, src))
+            return 'rsync'
+
+        shutil.rmtree(dst, ignore_errors=True)
+        subprocess.run(['cp', '-a', src, dst], check=True)
+        logger.info('restored {} from {} by copy'.format(dst, src))
+        return 'copy'
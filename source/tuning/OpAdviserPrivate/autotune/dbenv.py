@@ -4,17 +4,16 @@ import time
 import subprocess
 import traceback
 import numpy as np
-from multiprocessing import Manager
 from multiprocessing.connection import Client
 import sys
 
-from autotune.dbconnector import MysqlConnector
 from .knobs import logger
-from .utils.parser import parse_sysbench, parse_oltpbench, parse_job
+from .utils.parser import parse_sysbench, parse_oltpbench, parse_job, parse_sysbench_line, parse_job_line
 from .knobs import initialize_knobs, get_default_knobs
 import psutil
 import multiprocessing as mp
 from .resource_monitor import ResourceMonitor
+from .benchmark_runner import BenchmarkRunner, ConfidenceBoundRule, EARLY_STOPPED, FINISHED, TIMED_OUT
 from autotune.workload import DEMO_WORKLOAD, SYSBENCH_WORKLOAD, JOB_WORKLOAD, OLTPBENCH_WORKLOADS, TPCH_WORKLOAD
 from autotune.utils.constants import MAXINT, SUCCESS, FAILED, TIMEOUT
 from autotune.utils.parser import is_number
@@ -49,6 +48,12 @@ class DBEnv:
             self.constraints = []
         else:
             self.constraints = eval(args_tune['constraints'])
+        # early stopping of trials confidently worse than the incumbent
+        self.early_stop = eval(args['early_stop'])
+        self.early_stop_confidence = float(args['early_stop_confidence'])
+        self.early_stop_min_samples = int(args['early_stop_min_samples'])
+        self.early_stop_margin = float(args['early_stop_margin'])
+        self.incumbent_perf = None
         self.lhs_log = args['lhs_log']
         self.cpu_core = args['cpu_core']
         self.info =  {
@@ -193,9 +198,53 @@ class DBEnv:
             raise ValueError('Invalid workload name!')
         return result,latL
 
+    def get_benchmark_stream(self, filename):
+        """The file the benchmark writes its interim results to, and the parser of its lines."""
+        if self.workload['name'] == 'sysbench':
+            return filename, parse_sysbench_line
+        elif self.workload['name'] in ('job', 'tpch', 'demo'):
+            return filename, parse_job_line
+        # OLTPBench only writes its summary at the end
+        return None, None
+
+    def _stream_objective(self):
+        """The streamed metric of the first objective, and whether it is maximized; None if it is not streamed."""
+        objective = self.y_variable[0].strip()
+        metric = objective.strip('-')
+        if metric not in ('tps', 'lat', 'qps'):
+            return None, None
+        return metric, not objective.startswith('-')
+
+    def get_stop_rule(self, parse_line):
+        """The early-stop rule of a benchmark run, only for sysbench.
+
+        Sysbench reports identically distributed samples at a fixed interval. The
+        samples of job/tpch/demo are the latencies of different queries in a fixed
+        order, whose running mean says nothing about the mean of the whole run.
+        """
+        metric, maximize = self._stream_objective()
+        if not self.early_stop or self.workload['name'] != 'sysbench':
+            return None
+        if parse_line is None or metric is None or self.incumbent_perf is None:
+            return None
+        return ConfidenceBoundRule(metric, maximize, self.incumbent_perf,
+                                   confidence=self.early_stop_confidence,
+                                   min_samples=self.early_stop_min_samples,
+                                   margin=self.early_stop_margin)
+
+    def update_incumbent(self, running_stats):
+        """Keeps the best mean of the streamed objective over the benchmark runs that finished."""
+        metric, maximize = self._stream_objective()
+        if metric is None or not running_stats.count(metric):
+            return
+        perf = running_stats.mean[metric]
+        if self.incumbent_perf is None or (perf > self.incumbent_perf if maximize else perf < self.incumbent_perf):
+            self.incumbent_perf = perf
+
     def get_benchmark_cmd(self):
         timestamp = int(time.time())
-        filename = self.log_path + '/{}.log'.format(timestamp)
+        # the port tells apart the logs of instances benchmarked at the same time
+        filename = self.log_path + '/{}_{}.log'.format(timestamp, self.db.port)
         dirname, _ = os.path.split(os.path.abspath(__file__))
         if self.workload['name'] == 'sysbench':
             if(isinstance(self.db, PostgresqlDB)):
@@ -248,11 +297,7 @@ class DBEnv:
 
     def get_states(self, collect_resource=0):
         # start Internal Metrics Collection
-        internal_metrics = Manager().list()
-        im = mp.Process(target=self.db.get_internal_metrics,
-                        args=(internal_metrics, BENCHMARK_RUNNING_TIME, BENCHMARK_WARMING_TIME))
-        self.db.set_im_alive(True)
-        im.start()
+        im = self.db.get_internal_metrics(BENCHMARK_RUNNING_TIME, BENCHMARK_WARMING_TIME)
 
         # start Resource Monition (if activated)
         if collect_resource:
@@ -270,26 +315,24 @@ class DBEnv:
         cmd, filename = self.get_benchmark_cmd()
         print(cmd)
         print("[{}] benchmark start!".format(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())))
-        p_benchmark = subprocess.Popen(cmd, shell=True, stderr=subprocess.STDOUT, stdout=subprocess.PIPE,
-                                       close_fds=True)
-        try:
-            outs, errs = p_benchmark.communicate(timeout=TIMEOUT_TIME)
-            ret_code = p_benchmark.poll()
-            if ret_code == 0:
-                print("[{}] benchmark finished!".format(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())))
-            else:
-                print("run benchmark get error {}".format(ret_code))
-        except subprocess.TimeoutExpired:
+        output_file, parse_line = self.get_benchmark_stream(filename)
+        runner = BenchmarkRunner(cmd, output_file, parse_line, timeout=TIMEOUT_TIME,
+                                 stop_rule=self.get_stop_rule(parse_line))
+        status = runner.run()
+        if status == EARLY_STOPPED:
+            print("[{}] benchmark stopped early!".format(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())))
+        elif status == TIMED_OUT:
             #benchmark_timeout = True
             print("[{}] benchmark timeout!".format(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())))
+        elif runner.returncode == 0:
+            print("[{}] benchmark finished!".format(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())))
+        else:
+            print("run benchmark get error {}".format(runner.returncode))
 
-        db_conn = MysqlConnector(**self.db.connection_info)
-
-        sql = 'SELECT NAME, COUNT from information_schema.INNODB_METRICS where status="enabled" ORDER BY NAME'
-        res = db_conn.fetch_results(sql, json=False)
-        internal_metrics=[]
-        for (k, v) in res:
-            internal_metrics.append(v)
+        # stop Internal Metrics Collection, the final snapshot is taken on the collector's connection
+        im_samples = im.stop()
+        last = im_samples.last()
+        internal_metrics = [] if last is None else last.tolist()
 
         # terminate Benchmark
         if not self.remote_mode:
@@ -297,10 +340,6 @@ class DBEnv:
                              close_fds=True)
             print("[{}] clear processlist".format(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())))
 
-        # stop Internal Metrics Collection
-        self.db.set_im_alive(False)
-        im.join()
-
         # stop Resource Monition (if activated)
         if collect_resource:
             if self.remote_mode:
@@ -318,7 +357,14 @@ class DBEnv:
         else:
             cpu, avg_read_io, avg_write_io, avg_virtual_memory, avg_physical_memory = 0, 0, 0, 0, 0
 
-        external_metrics,latL = self.get_external_metrics(filename)
+        if status == EARLY_STOPPED and self.workload['name'] == 'sysbench':
+            # the result file is incomplete, report the interim statistics
+            external_metrics, latL = runner.stats.external_metrics(), runner.stats.values.get('lat', [])
+        else:
+            external_metrics, latL = self.get_external_metrics(filename)
+        # only complete runs, the mean of a run stopped or timed out is partial
+        if status == FINISHED and runner.returncode == 0:
+            self.update_incumbent(runner.stats)
         
         # internal_metrics, dirty_pages, hit_ratio, page_data = self.db._post_handle(internal_metrics)
         dirty_pages, hit_ratio, page_data = 0,0,0
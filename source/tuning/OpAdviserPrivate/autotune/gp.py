@@ -150,23 +150,27 @@ class GPRNP(object):
             setattr(self, param, val)
         return self
 
-def gp_predict(X, y, X_target, workload, metric_id):
-    model = None
-    if not os.path.exists('gp_model_numpy'):
-        os.makedirs('gp_model_numpy')
+def load_gp_model(X, y, workload, metric_id):
+    """Fits the GP of one metric of a workload, or loads it from the disk cache."""
+    os.makedirs('gp_model_numpy', exist_ok=True)
     load_path = os.path.join('gp_model_numpy', workload.split('.')[0] + '_' + str(metric_id) + '.pkl')
     if os.path.exists(load_path):
         with open(load_path, 'rb') as file:
-            model = pickle.loads(file.read())
-    else:
-        model = GPRNP(length_scale=DEFAULT_LENGTH_SCALE,
-                  magnitude=DEFAULT_MAGNITUDE,
-                  max_train_size=MAX_TRAIN_SIZE,
-                  batch_size=BATCH_SIZE)
-        model.fit(X, y, ridge=DEFAULT_RIDGE)
-        output_file = open(load_path, 'wb')
-        file_str = pickle.dumps(model)
-        output_file.write(file_str)
-        output_file.close()
+            return pickle.loads(file.read())
+
+    model = GPRNP(length_scale=DEFAULT_LENGTH_SCALE,
+              magnitude=DEFAULT_MAGNITUDE,
+              max_train_size=MAX_TRAIN_SIZE,
+              batch_size=BATCH_SIZE)
+    model.fit(X, y, ridge=DEFAULT_RIDGE)
+    # Models are fitted by several processes, so the file is replaced atomically
+    tmp_path = '%s.%d.tmp' % (load_path, os.getpid())
+    with open(tmp_path, 'wb') as output_file:
+        output_file.write(pickle.dumps(model))
+    os.replace(tmp_path, load_path)
+    return model
 
+
+def gp_predict(X, y, X_target, workload, metric_id):
+    model = load_gp_model(X, y, workload, metric_id)
     return model.predict(X_target).ypreds.ravel()
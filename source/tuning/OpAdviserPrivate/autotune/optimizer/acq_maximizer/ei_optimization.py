@@ -6,6 +6,7 @@
 # Author: Aaron Klein, Marius Lindauer
 
 import abc
+import itertools
 import logging
 import time
 from typing import Iterable, List, Union, Tuple, Optional
@@ -233,6 +234,11 @@ class LocalSearch(AcquisitionFunctionMaximizer):
     n_steps_plateau_walk: int
         number of steps during a plateau walk before local search terminates
 
+    neighbor_chunk_size: int, optional
+        number of neighbors of each incumbent evaluated per acquisition call.
+        The chunks of all start points are evaluated together in one call.
+        None evaluates the whole one-exchange neighbourhood at once.
+
     """
 
     def __init__(
@@ -242,10 +248,12 @@ class LocalSearch(AcquisitionFunctionMaximizer):
             rng: Union[bool, np.random.RandomState] = None,
             max_steps: Optional[int] = None,
             n_steps_plateau_walk: int = 10,
+            neighbor_chunk_size: Optional[int] = 20,
     ):
         super().__init__(acquisition_function, config_space, rng)
         self.max_steps = max_steps
         self.n_steps_plateau_walk = n_steps_plateau_walk
+        self.neighbor_chunk_size = neighbor_chunk_size
 
 
     def _maximize(
@@ -283,11 +291,8 @@ class LocalSearch(AcquisitionFunctionMaximizer):
             num_points, runhistory)
 
         acq_configs = []
-        # Start N local search from different random start points
-        for start_point in init_points:
-            acq_val, configuration = self._one_iter(
-                start_point, **kwargs)
-
+        # Start N local search from different random start points, in lockstep
+        for acq_val, configuration in self._do_search(init_points, **kwargs):
             configuration.origin = "Local Search"
             acq_configs.append((acq_val, configuration))
 
@@ -327,57 +332,78 @@ class LocalSearch(AcquisitionFunctionMaximizer):
             start_point: Configuration,
             **kwargs
     ) -> Tuple[float, Configuration]:
+        return self._do_search([start_point], **kwargs)[0]
 
-        incumbent = start_point
-        # Compute the acquisition value of the incumbent
-        acq_val_incumbent = self.acquisition_function([incumbent], **kwargs)[0]
+    def _next_chunk(self, neighbors):
+        if self.neighbor_chunk_size is None:
+            return list(neighbors)
+        return list(itertools.islice(neighbors, self.neighbor_chunk_size))
 
-        local_search_steps = 0
+    def _do_search(
+            self,
+            start_points: List[Configuration],
+            **kwargs
+    ) -> List[Tuple[float, Configuration]]:
+        """Run one local search per start point, evaluating neighbors in batches.
+
+        Each search moves to the first neighbor (in neighbourhood order) that
+        improves on its incumbent, exactly like a one-by-one scan. Neighbors are
+        evaluated in chunks, and the chunks of all searches go to the acquisition
+        function in a single call, so the surrogate predicts many rows at once.
+        """
+        incumbents = list(start_points)
+        if not incumbents:
+            return []
+        # Compute the acquisition value of the incumbents
+        acq_val_incumbents = list(self.acquisition_function(incumbents, **kwargs))
+
+        local_search_steps = [1] * len(incumbents)
+        neighbors = [get_one_exchange_neighbourhood(incumbent, seed=42) for incumbent in incumbents]
+        active = list(range(len(incumbents)))
         neighbors_looked_at = 0
-        time_n = []
-        while True:
-
-            local_search_steps += 1
-            if local_search_steps % 1000 == 0:
-                self.logger.warning(
-                    "Local search took already %d iterations. Is it maybe "
-                    "stuck in a infinite loop?", local_search_steps
-                )
-
-            # Get neighborhood of the current incumbent
-            # by randomly drawing configurations
-            changed_inc = False
-
-            # Get one exchange neighborhood returns an iterator (in contrast of
-            # the previously returned list).
-            all_neighbors = get_one_exchange_neighbourhood(
-                incumbent, seed=42)
-
-            for neighbor in all_neighbors:
-                s_time = time.time()
-                acq_val = self.acquisition_function([neighbor], **kwargs)
-                neighbors_looked_at += 1
-                time_n.append(time.time() - s_time)
-
-                if acq_val > acq_val_incumbent:
-                    self.logger.debug("Switch to one of the neighbors")
-                    incumbent = neighbor
-                    acq_val_incumbent = acq_val
-                    changed_inc = True
-                    break
-
-            if (not changed_inc) or \
-                    (self.max_steps is not None and
-                     local_search_steps == self.max_steps):
-                self.logger.debug("Local search took %d steps and looked at %d "
-                                  "configurations. Computing the acquisition "
-                                  "value for one configuration took %f seconds"
-                                  " on average.",
-                                  local_search_steps, neighbors_looked_at,
-                                  np.mean(time_n))
-                break
-
-        return acq_val_incumbent, incumbent
+        num_calls = 0
+        s_time = time.time()
+        while active:
+            chunks = [self._next_chunk(neighbors[idx]) for idx in active]
+            batch = [neighbor for chunk in chunks for neighbor in chunk]
+            if batch:
+                acq_vals = self.acquisition_function(batch, **kwargs)
+                neighbors_looked_at += len(batch)
+                num_calls += 1
+
+            still_active = []
+            offset = 0
+            for idx, chunk in zip(active, chunks):
+                chunk_vals = acq_vals[offset:offset + len(chunk)] if chunk else []
+                offset += len(chunk)
+                if not chunk:
+                    # the whole neighbourhood was looked at without improvement
+                    continue
+                improved = np.flatnonzero(np.reshape(chunk_vals, -1) > acq_val_incumbents[idx])
+                if len(improved) == 0:
+                    still_active.append(idx)
+                    continue
+
+                self.logger.debug("Switch to one of the neighbors")
+                incumbents[idx] = chunk[improved[0]]
+                acq_val_incumbents[idx] = chunk_vals[improved[0]]
+                if self.max_steps is not None and local_search_steps[idx] == self.max_steps:
+                    continue
+                local_search_steps[idx] += 1
+                if local_search_steps[idx] % 1000 == 0:
+                    self.logger.warning(
+                        "Local search took already %d iterations. Is it maybe "
+                        "stuck in a infinite loop?", local_search_steps[idx]
+                    )
+                neighbors[idx] = get_one_exchange_neighbourhood(incumbents[idx], seed=42)
+                still_active.append(idx)
+            active = still_active
+
+        self.logger.debug("Local search took %s steps and looked at %d "
+                          "configurations in %d acquisition calls (%f seconds).",
+                          local_search_steps, neighbors_looked_at, num_calls,
+                          time.time() - s_time)
+        return list(zip(acq_val_incumbents, incumbents))
 
 
 class RandomSearch(AcquisitionFunctionMaximizer):
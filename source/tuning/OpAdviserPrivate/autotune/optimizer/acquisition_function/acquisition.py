@@ -14,7 +14,7 @@ import numpy as np
 from scipy.stats import norm
 import math
 
-from autotune.utils.config_space import Configuration
+from autotune.utils.config_space import Configuration, ConfigurationBatch
 from autotune.utils.config_space.util import convert_configurations_to_array
 from autotune.optimizer.surrogate.base.base_model import AbstractModel
 from autotune.optimizer.surrogate.base.gp import GaussianProcess
@@ -61,12 +61,12 @@ class AbstractAcquisitionFunction(object, metaclass=abc.ABCMeta):
         for key in kwargs:
             setattr(self, key, kwargs[key])
 
-    def __call__(self, configurations: Union[List[Configuration], np.ndarray], convert=True, **kwargs):
+    def __call__(self, configurations: Union[List[Configuration], ConfigurationBatch, np.ndarray], convert=True, **kwargs):
         """Computes the acquisition value for a given X
 
         Parameters
         ----------
-        configurations : list
+        configurations : list or ConfigurationBatch
             The configurations where the acquisition function
             should be evaluated.
         convert : bool
@@ -78,15 +78,10 @@ class AbstractAcquisitionFunction(object, metaclass=abc.ABCMeta):
         """
 
         if  hasattr(self, 'compact_space') and  not self.compact_space  == None:
-            configurations_ = list()
-            for configuration in configurations:
-                knob_dict = configuration.get_dictionary()
-                for knob in self.incumbent.keys():
-                    if not knob in knob_dict.keys():
-                        knob_dict[knob] = self.incumbent[knob]
-                configurations_.append(Configuration(self.incumbent.configuration_space, values=knob_dict))
-
-            configurations = configurations_
+            # Knobs outside the compact space take the values of the incumbent
+            if not isinstance(configurations, ConfigurationBatch):
+                configurations = ConfigurationBatch.from_configurations(configurations)
+            configurations = configurations.to_space(self.incumbent.configuration_space, fill=self.incumbent)
 
         if convert:
             X = convert_configurations_to_array(configurations)
@@ -1,16 +1,29 @@
 import abc
-import pdb
-import random
+import heapq
+import numpy as np
 
 from autotune.utils.util_funcs import check_random_state
 from autotune.utils.logging_utils import get_logger
 from autotune.utils.history_container import HistoryContainer
 from autotune.utils.constants import MAXINT, SUCCESS
-from autotune.utils.config_space import get_one_exchange_neighbourhood
+from autotune.utils.config_space import Configuration, get_codec, get_one_exchange_neighbourhood
 from autotune.utils.history_container import Observation
 from autotune.utils.config_space.util import configs2space
+from ConfigSpace import OrdinalHyperparameter
+
+# Standard deviation of the mutation of numerical knobs in the normalized space, as in ConfigSpace
+NUMERICAL_STDEV = 0.2
+
 
 class GA_Optimizer(object, metaclass=abc.ABCMeta):
+    """Regularized evolution on the vector representation of the configurations.
+
+    Configurations are identified by their (rounded) vector, which is cheap to
+    hash, and mutations of a parent are sampled as one batch of vectors: each
+    candidate changes one random knob, and the first candidate that was not
+    seen before is taken. The population is a heap, so evicting the worst (or
+    oldest) member costs O(log population_size).
+    """
 
     def __init__(self, config_space,
                  history_container: HistoryContainer,
@@ -21,6 +34,7 @@ class GA_Optimizer(object, metaclass=abc.ABCMeta):
                  epsilon=0.2,
                  strategy='worst',  # 'worst', 'oldest'
                  optimization_strategy='ea',
+                 num_mutations=32,
                  output_dir='logs',
                  random_state=None):
 
@@ -41,42 +55,114 @@ class GA_Optimizer(object, metaclass=abc.ABCMeta):
         self.optimization_strategy = optimization_strategy
 
         # Init the basic ingredients
-        self.running_configs = list()
-        self.all_configs = set()
+        self.codec = get_codec(config_space)
+        self.seen = set()  # keys of all evaluated (or pending) configurations
         self.age = 0
-        self.population = list()
+        self.population = list()  # heap of (eviction priority, age, perf, vector)
         self.population_size = population_size
         self.subset_size = subset_size
         assert 0 < self.subset_size <= self.population_size
         self.epsilon = epsilon
         self.strategy = strategy
         assert self.strategy in ['worst', 'oldest']
+        self.num_mutations = num_mutations
+        # Conditions and forbidden clauses are only checked by ConfigSpace's own neighbourhood
+        self.vectorized = not config_space.get_conditions() and not config_space.get_forbiddens()
+        self._mutable = self._mutable_columns()
 
         # initialize
         self.initialize(history_container)
 
+    def _mutable_columns(self):
+        mutable = list()
+        for name in self.codec.names:
+            column = self.codec.columns[name]
+            if column.choices is not None and len(column.choices) < 2:
+                continue
+            if column.lower is not None and column.lower == column.upper:
+                continue
+            if column.choices is None and column.lower is None:
+                continue  # e.g. Constant
+            mutable.append(self.codec.index[name])
+        return np.array(mutable, dtype=np.int64)
+
+    def _canonical(self, array):
+        """Rounds vectors to the values they stand for (e.g. integers), so equal configurations get equal keys."""
+        return self.codec.encode(self.codec.decode(array), n=len(array))
+
+    @staticmethod
+    def _key(vector):
+        return np.round(vector, 8).tobytes()
+
+    def _config_keys(self, configs):
+        return [self._key(vector) for vector in self.codec.encode_records(configs)]
+
+    def _push(self, vector, perf):
+        priority = self.age if self.strategy == 'oldest' else -perf
+        heapq.heappush(self.population, (priority, self.age, perf, vector))
+        self.age += 1
+        if len(self.population) > self.population_size:
+            # The root is the oldest, or the worst (largest perf) member
+            heapq.heappop(self.population)
+
     def initialize(self, history_container: HistoryContainer):
         all_configs = configs2space(history_container.get_all_configs(), self.config_space)
         all_perfs = history_container.get_all_perfs()
-        self.all_configs = set(all_configs)
-
-        num_config_evaluated = len(all_perfs)
-        for i in range(num_config_evaluated):
-            self.population.append(dict(config=all_configs[i], age=self.age, perf=all_perfs[i]))
-            self.age += 1
-
-        if self.strategy == 'oldest':
-            self.population.sort(key=lambda x: x['age'])
-        elif self.strategy == 'worst':
-            self.population.sort(key=lambda x: x['perf'])
-
-        while len(self.population) > self.population_size:
-            if self.strategy == 'oldest':
-                self.population.pop(0)
-            elif self.strategy == 'worst':
-                self.population.pop(-1)
+        if not len(all_configs):
+            return
+        vectors = self.codec.encode_records(all_configs)
+        self.seen.update(self._key(vector) for vector in vectors)
+        for vector, perf in zip(vectors, all_perfs):
+            self._push(vector, perf)
+
+    def exclude(self, config: Configuration):
+        """Marks a configuration as evaluated, e.g. while it is pending in a batch."""
+        self.seen.update(self._config_keys([config]))
+
+    def _select_parent(self):
+        """Subset tournament with epsilon greedy."""
+        if self.rng.random_sample() < self.epsilon:
+            return self.population[self.rng.randint(len(self.population))][3]
+        subset = self.rng.choice(len(self.population), self.subset_size, replace=False)
+        best = min(subset, key=lambda i: self.population[i][2])  # minimize
+        return self.population[best][3]
+
+    def _mutate(self, parent):
+        """num_mutations vectors, each changing one knob of the parent."""
+        n = self.num_mutations
+        candidates = np.repeat(parent[np.newaxis, :], n, axis=0)
+        columns = self._mutable[self.rng.randint(len(self._mutable), size=n)]
+        for idx in np.unique(columns):
+            rows = np.flatnonzero(columns == idx)
+            column = self.codec.columns[self.codec.names[idx]]
+            values = parent[idx]
+            if column.choices is not None and isinstance(column.hp, OrdinalHyperparameter):
+                step = self.rng.choice([-1, 1], size=len(rows))
+                new = np.clip(values + step, 0, len(column.choices) - 1)
+            elif column.choices is not None:
+                # Another choice, uniformly
+                new = (values + self.rng.randint(1, len(column.choices), size=len(rows))) % len(column.choices)
             else:
-                raise ValueError('Unknown strategy: %s' % self.strategy)
+                # Gaussian step, reflected into [0, 1]
+                new = np.abs(values + self.rng.normal(0, NUMERICAL_STDEV, size=len(rows)))
+                new = np.clip(1 - np.abs(1 - new), 0, 1)
+            candidates[rows, idx] = new
+        return self._canonical(candidates)
+
+    def _sample_vectors(self, n):
+        vectors = self.rng.uniform(size=(n, len(self.codec.names)))
+        for name, column in self.codec.columns.items():
+            if column.choices is not None:
+                vectors[:, self.codec.index[name]] = self.rng.randint(len(column.choices), size=n)
+        return self._canonical(vectors)
+
+    def _first_unseen(self, vectors):
+        for vector in vectors:
+            key = self._key(vector)
+            if key not in self.seen:
+                self.seen.add(key)
+                return Configuration(self.config_space, vector=vector)
+        return None
 
     def get_suggestion(self, history_container: HistoryContainer, compact_space=None):
         """
@@ -85,29 +171,33 @@ class GA_Optimizer(object, metaclass=abc.ABCMeta):
         -------
         A configuration.
         """
-        if len(self.population) < self.population_size:
-            # Initialize population
-            next_config = self.sample_random_config(excluded_configs=self.all_configs)
-        else:
-            # Select a parent by subset tournament and epsilon greedy
-            if self.rng.random() < self.epsilon:
-                parent_config = random.sample(self.population, 1)[0]['config']
-            else:
-                subset = random.sample(self.population, self.subset_size)
-                subset.sort(key=lambda x: x['perf'])    # minimize
-                parent_config = subset[0]['config']
+        return self.get_suggestions(history_container, 1, compact_space)[0]
 
-            # Mutation to 1-step neighbors
+    def get_suggestions(self, history_container: HistoryContainer, num, compact_space=None):
+        """
+        Generate num distinct configurations, e.g. for a batch evaluated in parallel.
+        Each suggestion is excluded from later suggestions right away.
+        """
+        configs = list()
+        for _ in range(num):
             next_config = None
-            neighbors_gen = get_one_exchange_neighbourhood(parent_config, seed=42)
-            for neighbor in neighbors_gen:
-                if neighbor not in self.all_configs:
-                    next_config = neighbor
-                    break
-            if next_config is None:  # If all the neighors are evaluated, sample randomly!
-                next_config = self.sample_random_config(excluded_configs=self.all_configs)
-
-        return next_config
+            if len(self.population) >= self.population_size:
+                parent = self._select_parent()
+                if self.vectorized:
+                    next_config = self._first_unseen(self._mutate(parent))
+                else:
+                    parent_config = Configuration(self.config_space, vector=parent)
+                    seed = self.rng.randint(MAXINT)
+                    for neighbor in get_one_exchange_neighbourhood(parent_config, seed=seed):
+                        if self._config_keys([neighbor])[0] not in self.seen:
+                            next_config = neighbor
+                            self.exclude(neighbor)
+                            break
+            if next_config is None:
+                # Initialize population, or all sampled neighbors are evaluated
+                next_config = self.sample_random_config()
+            configs.append(next_config)
+        return configs
 
     def update(self, observation: Observation):
         """
@@ -123,37 +213,27 @@ class GA_Optimizer(object, metaclass=abc.ABCMeta):
         perf = observation.objs[0]
         trial_state = observation.trial_state
 
-        self.all_configs.add(config)
+        vector = self.codec.encode_records([config])[0]
+        self.seen.add(self._key(vector))
 
-
-        # update population
+        # update population, evicting the worst (or oldest) member if it is full
         if trial_state == SUCCESS and perf < MAXINT:
-            self.population.append(dict(config=config, age=self.age, perf=perf))
-            self.age += 1
-
-        # Eliminate samples
-        if len(self.population) > self.population_size:
-            if self.strategy == 'oldest':
-                self.population.sort(key=lambda x: x['age'])
-                self.population.pop(0)
-            elif self.strategy == 'worst':
-                self.population.sort(key=lambda x: x['perf'])
-                self.population.pop(-1)
-            else:
-                raise ValueError('Unknown strategy: %s' % self.strategy)
+            self._push(vector, perf)
 
     def sample_random_config(self, excluded_configs=None):
-        if excluded_configs is None:
-            excluded_configs = set()
-
-        sample_cnt = 0
         max_sample_cnt = 1000
-        while True:
-            config = self.config_space.sample_configuration()
-            sample_cnt += 1
-            if config not in excluded_configs:
-                break
-            if sample_cnt >= max_sample_cnt:
-                self.logger.warning('Cannot sample non duplicate configuration after %d iterations.' % max_sample_cnt)
-                break
-        return config
+        if self.vectorized and excluded_configs is None:
+            for _ in range(max_sample_cnt // self.num_mutations):
+                config = self._first_unseen(self._sample_vectors(self.num_mutations))
+                if config is not None:
+                    return config
+        else:
+            excluded = self.seen if excluded_configs is None else set(self._config_keys(list(excluded_configs)))
+            for _ in range(max_sample_cnt):
+                config = self.config_space.sample_configuration()
+                key = self._config_keys([config])[0]
+                if key not in excluded:
+                    self.seen.add(key)
+                    return config
+        self.logger.warning('Cannot sample non duplicate configuration after %d iterations.' % max_sample_cnt)
+        return self.config_space.sample_configuration()
@@ -0,0 +1,35 @@
+# License: MIT
+
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ParallelEvaluator(object):
+    """Evaluates configurations on several identical database instances at the same time.
+
+    Each objective function (e.g. DBEnv.step of one instance) evaluates one
+    configuration at a time; a submitted configuration runs on the next
+    instance that is free. Trials mostly wait for the database and the
+    benchmark processes, so one thread per instance is enough.
+    """
+
+    def __init__(self, objective_functions):
+        self.free = queue.Queue()
+        for objective_function in objective_functions:
+            self.free.put(objective_function)
+        self.num_instances = len(objective_functions)
+        self.executor = ThreadPoolExecutor(max_workers=self.num_instances, thread_name_prefix='Trial')
+
+    def _evaluate(self, config):
+        objective_function = self.free.get()
+        try:
+            return objective_function(config)
+        finally:
+            self.free.put(objective_function)
+
+    def submit(self, config):
+        """Returns a future of the result of the objective function for config."""
+        return self.executor.submit(self._evaluate, config)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
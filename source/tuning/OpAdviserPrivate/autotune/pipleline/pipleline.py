@@ -14,6 +14,7 @@ from typing import List
 import xgboost as xgb
 import json
 from collections import OrderedDict, defaultdict
+from concurrent.futures import as_completed
 from tqdm import tqdm
 from autotune.utils.util_funcs import check_random_state
 from autotune.utils.logging_utils import get_logger
@@ -81,6 +82,7 @@ class PipleLine(BOBase):
                  only_knob = False,
                  only_range = False,
                  advisor_kwargs: dict = None,
+                 evaluator=None,
                  #  latent_dim=0,
                  #2024-12-06 softmax transformer
                  softmax_weight=True,
@@ -300,6 +302,8 @@ class PipleLine(BOBase):
             self.optimizer_list = [SMAC, MBO, DDPG, GA]
             self.optimizer = SMAC
         self.tuning_result=list()
+        # evaluates several configurations at once on identical database instances, see run_parallel
+        self.evaluator = evaluator
         self.max_iterations=self.iteration_id+1
         #2024-12-06 softmax transformer
         self.softmax_weight=softmax_weight
@@ -327,6 +331,9 @@ class PipleLine(BOBase):
 
 
     def run(self):
+        if self.evaluator is not None:
+            return self.run_parallel()
+
         compact_space = self.config_space
         #2024-11-11: code for experiment
         # compact_space2=  None
@@ -335,57 +342,9 @@ class PipleLine(BOBase):
             if self.budget_left < 0:
                 self.logger.info('Time %f elapsed!' % self.runtime_limit)
                 break
-            time_b = time.time()
             start_time = time.time()
-            # get another compact space
-            if (self.space_transfer or self.auto_optimizer) and (self.space_step >= self.space_step_limit):
-                self.space_step_limit = 3
-                self.space_step = 0
-                if self.space_transfer:
-                    f = open('space.record','a')
-                    time_b = time.time()
-                    compact_space = self.get_compact_space()
-                    #2024-11-11: code for experiment
-                    # compact_space,compact_space2=  self.get_compact_space()
-                    #2024-11-11: code for experiment
-                    f.write(str(time.time() - time_b)+'\n')
-                    f.close()
-
-                if self.auto_optimizer:
-                    f = open('optimizer.record', 'a')
-                    time_b = time.time()
-                    self.optimizer = self.select_optimizer(type=self.auto_optimizer_type, space=self.config_space if compact_space is None else compact_space)
-                    f.write(str(time.time() - time_b) + '\n')
-                    f.close()
-
-                time_b = time.time()
-
-                if self.space_transfer and not compact_space == self.optimizer.config_space:
-                    if isinstance(self.optimizer, GA_Optimizer):
-                        self.optimizer = GA_Optimizer(compact_space,
-                                                      self.history_container,
-                                                      num_objs=self.num_objs,
-                                                      num_constraints=self.num_constraints,
-                                                      output_dir=self.optimizer.output_dir,
-                                                      random_state=self.random_state)
-                        if self.auto_optimizer:
-                            self.optimizer_list[-1] = self.optimizer
-
-                    if isinstance(self.optimizer, DDPG_Optimizer):
-                        self.optimizer = DDPG_Optimizer(compact_space,
-                                                        self.history_container,
-                                                        metrics_num=self.num_metrics,
-                                                        task_id=self.history_container.task_id,
-                                                        params=self.optimizer.params,
-                                                        batch_size=self.optimizer.batch_size,
-                                                        mean_var_file=self.optimizer.mean_var_file
-                                                        #2024-12-06 softmax transformer
-                                                        ,transformer=self.transformer,
-                                                        #2024-12-06 softmax transformer
-                                    )
-                        if self.auto_optimizer:
-                            self.optimizer_list[-2] = self.optimizer
-
+            compact_space = self.update_compact_space(compact_space)
+            time_b = time.time()
 
             if self.space_transfer:
                 space = compact_space if not compact_space is None else self.config_space
@@ -414,6 +373,104 @@ class PipleLine(BOBase):
 
         return self.get_history()
 
+    def run_parallel(self):
+        """Evaluates one configuration per database instance of self.evaluator at a time.
+
+        The configurations of a batch are proposed together (see get_suggestions),
+        and the history is updated as soon as each of their results comes in.
+        DDPG learns from its trials one at a time and in order, so it proposes
+        batches of one configuration.
+        """
+        compact_space = self.config_space
+        num_instances = self.evaluator.num_instances
+        progress = tqdm(total=max(self.max_iterations - self.iteration_id, 0))
+        while self.iteration_id < self.max_iterations:
+            if self.budget_left < 0:
+                self.logger.info('Time %f elapsed!' % self.runtime_limit)
+                break
+            start_time = time.time()
+            compact_space = self.update_compact_space(compact_space)
+
+            if self.space_transfer:
+                space = compact_space if not compact_space is None else self.config_space
+                self.logger.info("[Iteration {}] [{},{}] Total space size:{}".format(self.iteration_id,self.space_step , self.space_step_limit, estimate_size(space, self.knob_config_file)))
+
+            num = 1 if isinstance(self.optimizer, DDPG_Optimizer) else num_instances
+            configs = self.get_suggestions(min(num, self.max_iterations - self.iteration_id), compact_space)
+            iter_time = time.time() - self.iter_begin_time
+            futures = {self.evaluator.submit(config): (config, time.time()) for config in configs}
+            for future in as_completed(futures):
+                config, submit_time = futures[future]
+                _, _, _, objs, _ = self.update_observation(config, future.result(), time.time() - submit_time,
+                                                           iter_time)
+                self.tuning_result.append((objs, config))
+
+                # determine whether explore one more step in the space
+                if (self.space_transfer or self.auto_optimizer) and  len(self.history_container.get_incumbents()) > 0 and objs[0] < self.history_container.get_incumbents()[0][1]:
+                    self.space_step_limit += 1
+
+                self.save_history()
+                # recode the step in the space
+                if self.space_transfer or self.auto_optimizer:
+                    self.space_step += 1
+
+            progress.update(len(configs))
+            self.budget_left -= time.time() - start_time
+        progress.close()
+
+        return self.get_history()
+
+    def update_compact_space(self, compact_space):
+        """Switches to another compact space and/or optimizer once the current one has been explored."""
+        # get another compact space
+        if (self.space_transfer or self.auto_optimizer) and (self.space_step >= self.space_step_limit):
+            self.space_step_limit = 3
+            self.space_step = 0
+            if self.space_transfer:
+                f = open('space.record','a')
+                time_b = time.time()
+                compact_space = self.get_compact_space()
+                #2024-11-11: code for experiment
+                # compact_space,compact_space2=  self.get_compact_space()
+                #2024-11-11: code for experiment
+                f.write(str(time.time() - time_b)+'\n')
+                f.close()
+
+            if self.auto_optimizer:
+                f = open('optimizer.record', 'a')
+                time_b = time.time()
+                self.optimizer = self.select_optimizer(type=self.auto_optimizer_type, space=self.config_space if compact_space is None else compact_space)
+                f.write(str(time.time() - time_b) + '\n')
+                f.close()
+
+            if self.space_transfer and not compact_space == self.optimizer.config_space:
+                if isinstance(self.optimizer, GA_Optimizer):
+                    self.optimizer = GA_Optimizer(compact_space,
+                                                  self.history_container,
+                                                  num_objs=self.num_objs,
+                                                  num_constraints=self.num_constraints,
+                                                  output_dir=self.optimizer.output_dir,
+                                                  random_state=self.random_state)
+                    if self.auto_optimizer:
+                        self.optimizer_list[-1] = self.optimizer
+
+                if isinstance(self.optimizer, DDPG_Optimizer):
+                    self.optimizer = DDPG_Optimizer(compact_space,
+                                                    self.history_container,
+                                                    metrics_num=self.num_metrics,
+                                                    task_id=self.history_container.task_id,
+                                                    params=self.optimizer.params,
+                                                    batch_size=self.optimizer.batch_size,
+                                                    mean_var_file=self.optimizer.mean_var_file
+                                                    #2024-12-06 softmax transformer
+                                                    ,transformer=self.transformer,
+                                                    #2024-12-06 softmax transformer
+                                )
+                    if self.auto_optimizer:
+                        self.optimizer_list[-2] = self.optimizer
+
+        return compact_space
+
     def knob_selection(self):
         assert self.num_objs == 1
 
@@ -526,28 +583,40 @@ class PipleLine(BOBase):
         #2024-11-11: code for experiment                
                 ):
         self.knob_selection()
+        config = self.get_suggestion(self.history_container, compact_space)
+        _, trial_state, constraints, objs,latL = self.evaluate(config)
+        #2024-11-11: code for experiment
+        # _, trial_state, constraints, objs,_, trial_state2, constraints2, objs2 = self.evaluate(config,config2)
+        #2024-11-11: code for experiment
+        
+        return config, trial_state, constraints, objs,latL    
+        #2024-11-11: code for experiment
+        # return config, trial_state, constraints, objs,config2, trial_state2, constraints2, objs2
+        #2024-11-11: code for experiment
+
+    def get_suggestion(self, history_container, compact_space=None):
         #get configuration suggestion
-        if self.space_transfer and len(self.history_container.configurations) < self.init_num:
+        if self.space_transfer and len(history_container.configurations) < self.init_num:
             #space transfer: use best source config to init
-            config = self.initial_configurations[len(self.history_container.configurations)]
+            config = self.initial_configurations[len(history_container.configurations)]
         #2024-11-11: code for experiment
         # if self.space_transfer and len(self.history_container2.configurations) < self.init_num:
         #     #space transfer: use best source config to init
         #     config2 = self.initial_configurations[len(self.history_container2.configurations)]
         #2024-11-11: code for experiment
         else:
-            config = self.optimizer.get_suggestion(history_container=self.history_container, compact_space=compact_space)
+            config = self.optimizer.get_suggestion(history_container=history_container, compact_space=compact_space)
             #2024-11-11: code for experiment
             # config2 = self.optimizer2.get_suggestion(history_container=self.history_container2, compact_space=compact_space2)
             #2024-11-11: code for experiment
         if self.space_transfer:
-            if len(self.history_container.get_incumbents()):
-                config = impute_incumb_values(config, self.history_container.get_incumbents()[0][0])
+            if len(history_container.get_incumbents()):
+                config = impute_incumb_values(config, history_container.get_incumbents()[0][0])
             #2024-11-11: code for experiment
             # if len(self.history_container2.get_incumbents()):
             #     config2 = impute_incumb_values(config2, self.history_container2.get_incumbents()[0][0])
             #2024-11-11: code for experiment
-                config_space = self.history_container.get_incumbents()[0][0].configuration_space
+                config_space = history_container.get_incumbents()[0][0].configuration_space
             else:
                 config = impute_incumb_values(config, self.config_space.get_default_configuration())
                 config_space = self.config_space.get_default_configuration().configuration_space
@@ -555,7 +624,7 @@ class PipleLine(BOBase):
                 self.optimizer = DDPG_Optimizer(config_space,
                                                 self.history_container,
                                                 metrics_num=self.num_metrics,
-                                                task_id=self.history_container.task_id,
+                                                task_id=history_container.task_id,
                                                 params=self.optimizer.params,
                                                 batch_size=self.optimizer.batch_size,
                                                 mean_var_file=self.optimizer.mean_var_file
@@ -563,22 +632,68 @@ class PipleLine(BOBase):
                                                 ,transformer=self.transformer,
                                                 #2024-12-06 softmax transformer
                                                 )
-        _, trial_state, constraints, objs,latL = self.evaluate(config)
-        #2024-11-11: code for experiment
-        # _, trial_state, constraints, objs,_, trial_state2, constraints2, objs2 = self.evaluate(config,config2)
-        #2024-11-11: code for experiment
-        
-        return config, trial_state, constraints, objs,latL    
-        #2024-11-11: code for experiment
-        # return config, trial_state, constraints, objs,config2, trial_state2, constraints2, objs2
-        #2024-11-11: code for experiment
+        return config
+
+    def get_suggestions(self, num, compact_space=None):
+        """Proposes num configurations to be evaluated at the same time.
+
+        Each proposal is added to a copy of the history with the median of the
+        successful objective values (the 'constant liar'), so that the next
+        proposal is made as if it had been evaluated already. Its internal
+        metrics are the column-wise median of the recorded ones, for the
+        surrogates that use them (e.g. workload mapping). Before any trial
+        succeeded there is no value to lie with, so a batch does not go beyond
+        the initial design and fewer than num configurations may be returned.
+        """
+        self.knob_selection()
+        history_container = self.history_container
+        configs = list()
+        for i in range(num):
+            config = self.get_suggestion(history_container, compact_space)
+            configs.append(config)
+            if i == num - 1:
+                break
+            if history_container is self.history_container:
+                history_container = self.history_container.copy()
+            history_container.update_observation(self.get_pending_observation(history_container, config))
+            if not len(history_container.successful_perfs) and len(history_container.configurations) >= self.init_num:
+                break
+        return configs
+
+    def get_pending_observation(self, history_container, config):
+        if len(history_container.successful_perfs):
+            objs = np.atleast_1d(np.median(history_container.successful_perfs, axis=0)).tolist()
+            trial_state = SUCCESS
+        else:
+            objs = self.FAILED_PERF
+            trial_state = FAILED
+        constraints = None
+        if self.num_constraints > 0:
+            constraint_perfs = [c for c in history_container.constraint_perfs if c is not None]
+            constraints = np.median(constraint_perfs, axis=0).tolist() if constraint_perfs \
+                else [0.] * self.num_constraints
+        return Observation(config=config, objs=objs, constraints=constraints, trial_state=trial_state,
+                           elapsed_time=0, iter_time=0, EM={}, resource={},
+                           IM=self.get_pending_internal_metrics(history_container),
+                           info=history_container.info, context=self.current_context)
+
+    @staticmethod
+    def get_pending_internal_metrics(history_container):
+        """Column-wise median of the internal metrics of the successful trials (of all trials if none succeeded)."""
+        recorded = [(im, state) for im, state in zip(history_container.get_internal_metrics(),
+                                                     history_container.trial_states) if len(im)]
+        ims = [im for im, state in recorded if state == SUCCESS] or [im for im, _ in recorded]
+        if not ims:
+            return []
+        return np.median(np.vstack(ims), axis=0).tolist()
 
     def save_history(self):
         dir_path = os.path.join('repo')
         if not os.path.exists(dir_path):
             os.makedirs(dir_path)
-        file_name = 'history_%s.json' % self.task_id
-        return self.history_container.save_json(os.path.join(dir_path, file_name))
+        # only the new observations are appended, instead of re-dumping the whole history
+        file_name = 'history_%s.jsonl' % self.task_id
+        return self.history_container.append_jsonl(os.path.join(dir_path, file_name))
         #2024-11-11: code for experiment
         # return (
         #     self.history_container.save_json(os.path.join(dir_path, file_name)),
@@ -589,7 +704,10 @@ class PipleLine(BOBase):
 
     def load_history(self):
         # TODO: check info
-        fn = os.path.join('repo', 'history_%s.json' % self.task_id)
+        fn = os.path.join('repo', 'history_%s.jsonl' % self.task_id)
+        if not os.path.exists(fn):
+            # histories saved before the append-only log, migrated on the next save
+            fn = os.path.join('repo', 'history_%s.json' % self.task_id)
         if not os.path.exists(fn):
             self.logger.info('Start new DBTune task')
         else:
@@ -619,14 +737,17 @@ class PipleLine(BOBase):
         #2024-11-11: code for experiment   
         ):
         iter_time = time.time() - self.iter_begin_time
-        trial_state = SUCCESS
         start_time = time.time()
-        objs, constraints, em, resource, im, info, trial_state,latL = self.objective_function(config)
+        result = self.objective_function(config)
+        elapsed_time = time.time() - start_time
+        return self.update_observation(config, result, elapsed_time, iter_time)
+
+    def update_observation(self, config, result, elapsed_time, iter_time):
+        """Adds the result of the objective function for config to the history and the optimizer."""
+        objs, constraints, em, resource, im, info, trial_state,latL = result
         if trial_state == FAILED :
             objs = self.FAILED_PERF
 
-        elapsed_time = time.time() - start_time
-
         self.iter_begin_time = time.time()
 
         if self.surrogate_type == 'context_prf' and config == self.history_container.config_space.get_default_configuration():
@@ -1,100 +1,161 @@
-import pdb
+import os
 import time
+import threading
+import numpy as np
 import psutil
-import subprocess
-import multiprocessing as mp
-from multiprocessing import Manager
+
+MB = 1024.0 * 1024.0
+GB = 1024.0 * 1024.0 * 1024.0
+
+# Columns of the sample array
+CPU, MEM_VIRTUAL, MEM_PHYSICAL, IO_READ, IO_WRITE = range(5)
+METRIC_NAMES = ['cpu', 'mem_virtual', 'mem_physical', 'io_read', 'io_write']
+
+
+class ProcessStatReader:
+    """Reads the cumulative CPU time, memory and IO bytes of one process.
+
+    /proc/<pid>/stat, statm and io are parsed directly, which costs a few
+    microseconds per read; psutil is used for what procfs does not provide
+    (e.g. on other platforms, or /proc/<pid>/io of another user).
+    """
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.process = psutil.Process(pid)
+        self.clock_ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+        self.page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+        self.proc_dir = '/proc/{}'.format(pid)
+        self.use_procfs = {name: os.path.exists(os.path.join(self.proc_dir, name)) for name in ('stat', 'statm', 'io')}
+        self.io_readable = True
+
+    def _read_proc(self, name):
+        with open(os.path.join(self.proc_dir, name), 'rb') as f:
+            return f.read()
+
+    def cpu_seconds(self):
+        if self.use_procfs['stat']:
+            try:
+                # Fields after the command name, which may contain spaces
+                fields = self._read_proc('stat').rsplit(b')', 1)[1].split()
+                return (int(fields[11]) + int(fields[12])) / self.clock_ticks
+            except OSError:
+                self.use_procfs['stat'] = False
+        times = self.process.cpu_times()
+        return times.user + times.system
+
+    def memory_bytes(self):
+        """Virtual and physical (resident) memory."""
+        if self.use_procfs['statm']:
+            try:
+                size, resident = self._read_proc('statm').split()[:2]
+                return int(size) * self.page_size, int(resident) * self.page_size
+            except OSError:
+                self.use_procfs['statm'] = False
+        info = self.process.memory_info()
+        return info.vms, info.rss
+
+    def io_bytes(self):
+        """Bytes read from and written to storage; zero if the IO counters of the process cannot be read."""
+        if self.use_procfs['io']:
+            try:
+                counters = dict(line.split(b':') for line in self._read_proc('io').splitlines())
+                return int(counters[b'read_bytes']), int(counters[b'write_bytes'])
+            except (OSError, KeyError, ValueError):
+                self.use_procfs['io'] = False
+        if not self.io_readable:
+            return 0, 0
+        try:
+            counters = self.process.io_counters()
+        except psutil.AccessDenied:
+            # e.g. a process of another user, CPU and memory can still be sampled
+            self.io_readable = False
+            return 0, 0
+        return counters.read_bytes, counters.write_bytes
 
 
 class ResourceMonitor:
+    """Samples CPU, memory and IO usage of a process from one thread.
+
+    After `warmup` seconds, a sample is taken every `interval` seconds (which
+    may be below one second) on a monotonic schedule for `t` seconds, or until
+    terminate(). Samples are kept in a preallocated array with the columns of
+    METRIC_NAMES: CPU in percent (of one core), memory in GB and IO in MB/s.
+    """
 
     def __init__(self, pid, interval, warmup, t):
         self.interval = interval
         self.t = t
-        self.process = psutil.Process(pid)
         self.warmup = warmup
-        self.ticks = int(self.t / self.interval)
-        self.n_cpu = len(self.process.cpu_affinity())
-        self.cpu_usage_seq = Manager().list()
-        self.mem_virtual_usage_seq = Manager().list()
-        self.mem_physical_usage_seq = Manager().list()
-        self.io_read_seq, self.io_write_seq = Manager().list(), Manager().list()
-        self.dirty_pages_pct_seq = Manager().list()
-        self.processes = []
-        self.alive = mp.Value('b', False)
+        self.reader = ProcessStatReader(pid)
+        self.n_cpu = len(self.reader.process.cpu_affinity())
+        self.samples = np.zeros((int(np.ceil(self.t / self.interval)) + 1, len(METRIC_NAMES)))
+        self.n_samples = 0
+        self._stop = threading.Event()
+        self._thread = None
 
     def run(self):
-        p1 = mp.Process(target=self.monitor_cpu_usage, args=())
-        self.processes.append(p1)
-        p2 = mp.Process(target=self.monitor_mem_usage, args=())
-        self.processes.append(p2)
-        p3 = mp.Process(target=self.monitor_io_usage, args=())
-        self.processes.append(p3)
-        self.alive.value = True
-        [proc.start() for proc in self.processes]
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._monitor, name='ResourceMonitor', daemon=True)
+        self._thread.start()
+
+    def terminate(self):
+        self._stop.set()
+
+    def _read(self):
+        return time.monotonic(), self.reader.cpu_seconds(), self.reader.io_bytes()
+
+    def _monitor(self):
+        start = time.monotonic()
+        if self._stop.wait(self.warmup):
+            return
+        begin = start + self.warmup
+        try:
+            last_time, last_cpu, last_io = self._read()
+            tick = 1
+            while self.n_samples < len(self.samples):
+                next_time = begin + tick * self.interval
+                if next_time > begin + self.t or self._stop.wait(max(0.0, next_time - time.monotonic())):
+                    break
+                now, cpu, io = self._read()
+                mem_virtual, mem_physical = self.reader.memory_bytes()
+                elapsed = max(now - last_time, 1e-9)
+                self.samples[self.n_samples] = (
+                    100.0 * (cpu - last_cpu) / elapsed,
+                    mem_virtual / GB,
+                    mem_physical / GB,
+                    (io[0] - last_io[0]) / MB / elapsed,
+                    (io[1] - last_io[1]) / MB / elapsed,
+                )
+                self.n_samples += 1
+                last_time, last_cpu, last_io = now, cpu, io
+                # Skip the ticks a slow sample ran into
+                tick = max(tick + 1, int((time.monotonic() - begin) // self.interval) + 1)
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            # The monitored process is gone (e.g. the database was restarted) or can no longer be read
+            pass
+
+    def _collected(self):
+        if self._thread is not None:
+            self._thread.join()
+        return self.samples[:self.n_samples]
 
     def get_monitor_data(self):
-        [proc.join() for proc in self.processes]
-        return {
-            'mem_virtual': list(self.mem_virtual_usage_seq),
-            'mem_physical': list(self.mem_physical_usage_seq),
-            'io_read': list(self.io_read_seq),
-            'io_write': list(self.io_write_seq),
-        }
+        samples = self._collected()
+        return {name: samples[:, i].tolist() for i, name in enumerate(METRIC_NAMES)}
 
     def get_monitor_data_avg(self):
-        [proc.join() for proc in self.processes]
-        cpu = list(self.cpu_usage_seq)
-        mem_virtual = list(self.mem_virtual_usage_seq)
-        mem_physical = list(self.mem_physical_usage_seq)
-        io_read = list(self.io_read_seq)
-        io_write = list(self.io_write_seq)
-
-        avg_cpu = sum(cpu) / (len(cpu) + 1e-9) / self.n_cpu
-        avg_read_io = sum(io_read) / (len(io_read) + 1e-9)
-        avg_write_io = sum(io_write) / (len(io_write) + 1e-9)
-        avg_virtual_memory = sum(mem_virtual) / (len(mem_virtual) + 1e-9)
-        avg_physical_memory = sum(mem_physical) / (len(mem_physical) + 1e-9)
-        return avg_cpu, avg_read_io, avg_write_io, avg_virtual_memory, avg_physical_memory
-
-    def monitor_mem_usage(self):
-        count = 0
-        while self.alive.value and count < self.ticks:
-            if count < self.warmup:
-                time.sleep(self.interval)
-                count = count + 1
-                continue
-            mem_physical = self.process.memory_info()[0]/(1024.0 * 1024.0 * 1024.0)
-            mem_virtual = self.process.memory_info()[1]/(1024.0 * 1024.0 * 1024.0)
-            self.mem_physical_usage_seq.append(mem_physical)
-            self.mem_virtual_usage_seq.append(mem_virtual)
-            time.sleep(self.interval)
-            count += 1
-
-    def monitor_io_usage(self):
-        count = 0
-        while self.alive.value and count < self.ticks:
-            if count < self.warmup:
-                time.sleep(self.interval)
-                count = count + 1
-                continue
-            sp1 = self.process.io_counters()
-            time.sleep(self.interval)
-            sp2 = self.process.io_counters()
-            self.io_read_seq.append((sp2[2]-sp1[2])/(1024.0 * 1024.0))
-            self.io_write_seq.append((sp2[3]-sp1[3])/(1024.0 * 1024.0))
-            count += 1
-
-    def monitor_cpu_usage(self):
-        count = 0
-        while self.alive.value and count < self.ticks:
-            if count < self.warmup:
-                time.sleep(self.interval)
-                count = count + 1
-                continue
-            cpu = self.process.cpu_percent(interval=self.interval)
-            self.cpu_usage_seq.append(cpu)
-            count += 1
+        samples = self._collected()
+        if not len(samples):
+            return 0., 0., 0., 0., 0.
+        avg = samples.mean(axis=0)
+        return (avg[CPU] / self.n_cpu, avg[IO_READ], avg[IO_WRITE], avg[MEM_VIRTUAL], avg[MEM_PHYSICAL])
 
-    def terminate(self):
-        self.alive.value = False
+    def get_monitor_data_percentiles(self, q=(50, 90, 99)):
+        """Percentiles of each metric, e.g. {'cpu': [p50, p90, p99], ...}; CPU is normalized like the average."""
+        samples = self._collected()
+        if not len(samples):
+            return {name: [0.] * len(q) for name in METRIC_NAMES}
+        percentiles = np.percentile(samples, q, axis=0)
+        percentiles[:, CPU] /= self.n_cpu
+        return {name: percentiles[:, i].tolist() for i, name in enumerate(METRIC_NAMES)}
@@ -14,6 +14,7 @@ from autotune.utils.config_space import ConfigurationSpace
 from autotune.utils.config_space.util import convert_configurations_to_array
 from autotune.utils.normalization import zero_mean_unit_var_normalization, zero_one_normalization
 from autotune.utils.logging_utils import get_logger
+from autotune.transfer.tlbo.source_pool import SourceModelPool, SourceSurrogateModel, PooledSourceSurrogate
 
 
 class BaseTLSurrogate(object):
@@ -22,7 +23,8 @@ class BaseTLSurrogate(object):
                  seed: int,
                  history_dataset_features: List = None,
                  num_src_hpo_trial: int = 50,
-                 surrogate_type='rf'):
+                 surrogate_type='rf',
+                 n_jobs: int = 1):
         self.method_id = None
         self.config_space = config_space
         self.random_seed = 42
@@ -37,6 +39,10 @@ class BaseTLSurrogate(object):
             if history_dataset_features is not None:
                 assert len(history_dataset_features) == self.K
         self.surrogate_type = surrogate_type
+        # Source models live in this process by default; n_jobs>1 shards them over worker
+        # processes, which only pays off when predicting one source model costs more than a round-trip.
+        self.source_pool = SourceModelPool({'config_space': config_space, 'surrogate_type': surrogate_type},
+                                           n_jobs=n_jobs)
 
         self.types, self.bounds = get_types(config_space)
         self.instance_features = None
@@ -66,11 +72,10 @@ class BaseTLSurrogate(object):
 
         self.logger.info('Start to train base surrogates.')
         start_time = time.time()
-        self.source_surrogates = list()
-        for history_container in self.source_hpo_data:
-            print('.', end='')
-            model = build_surrogate(self.surrogate_type, self.config_space,
-                                    np.random.RandomState(42))
+        # Refitting replaces all source models
+        self.source_pool.reset()
+        jobs = list()
+        for i, history_container in enumerate(self.source_hpo_data):
             X = convert_configurations_to_array(history_container.configurations)
             y = history_container.get_transformed_perfs()
 
@@ -91,10 +96,22 @@ class BaseTLSurrogate(object):
                 raise ValueError('Invalid parameter in norm.')
 
             self.eta_list.append(np.min(y))
-            model.train(X, y)
-            self.source_surrogates.append(model)
+            jobs.append((i, SourceSurrogateModel, (X, y)))
+        self.source_pool.fit(jobs)
+        self.source_surrogates = [PooledSourceSurrogate(self.source_pool, i) for i in range(len(jobs))]
         self.logger.info('Building base surrogates took %.3fs.' % (time.time() - start_time))
 
+    def predict_sources(self, X: np.ndarray, ids=None, memoize=False):
+        """Predicts X with the source surrogates of ids (default: all) in one parallel request.
+
+        Returns the lists of means and variances, each of shape [n_samples, 1].
+        Use memoize for configurations that are predicted again in later
+        iterations, like the target history.
+        """
+        ids = range(self.K) if ids is None else ids
+        predictions = self.source_pool.predict(ids, X, memoize=memoize)
+        return [p[:, :1] for p in predictions], [p[:, 1:] for p in predictions]
+
     def build_single_surrogate(self, X: np.ndarray, y: np.array, normalize):
         assert normalize in ['standardize', 'scale', 'none']
         model = build_surrogate(self.surrogate_type, self.config_space, np.random.RandomState(42))
@@ -6,11 +6,35 @@ from autotune.utils.history_container import HistoryContainer
 from openbox.utils.config_space.util import convert_configurations_to_array
 
 
+def ranking_loss(y, sampled_y, rows=None, max_block_size=1 << 24):
+    """Count the ordered pairs (i, j) whose order in y and in sampled_y disagree.
+
+    sampled_y may hold many predictions of y stacked on its leading axes (e.g.
+    samples x surrogates x observations); one loss is returned per prediction.
+    rows restricts i to a subset of the observations. Predictions are compared
+    in blocks of at most max_block_size pairs.
+    """
+    y = np.ravel(y)
+    n = len(y)
+    lead_shape = np.shape(sampled_y)[:-1]
+    sampled_y = np.reshape(sampled_y, (-1, n))
+    rows = np.arange(n) if rows is None else np.asarray(rows)
+
+    y_order = y[rows, None] < y[None, :]
+    block = max(1, max_block_size // max(1, y_order.size))
+    losses = np.empty(len(sampled_y), dtype=np.int64)
+    for start in range(0, len(sampled_y), block):
+        s = sampled_y[start:start + block]
+        s_order = s[:, rows, None] < s[:, None, :]
+        losses[start:start + block] = np.count_nonzero(s_order ^ y_order, axis=(1, 2))
+    return losses.reshape(lead_shape)
+
+
 class RGPE(BaseTLSurrogate):
     def __init__(self, config_space, source_hpo_data, seed,
-                 surrogate_type='prf', num_src_hpo_trial=50, only_source=False):
+                 surrogate_type='prf', num_src_hpo_trial=50, only_source=False, n_jobs=1):
         super().__init__(config_space, source_hpo_data, 42,
-                         surrogate_type=surrogate_type, num_src_hpo_trial=num_src_hpo_trial)
+                         surrogate_type=surrogate_type, num_src_hpo_trial=num_src_hpo_trial, n_jobs=n_jobs)
         np.random.seed(42)
         self.method_id = 'rgpe'
         self.only_source = only_source
@@ -38,11 +62,7 @@ class RGPE(BaseTLSurrogate):
             return
 
         # Train the target surrogate and update the weight w.
-        mu_list, var_list = list(), list()
-        for id in range(self.K):
-            mu, var = self.source_surrogates[id].predict(X)
-            mu_list.append(mu)
-            var_list.append(var)
+        mu_list, var_list = self.predict_sources(X, memoize=True)
 
         # Pretrain the leave-one-out surrogates.
         k_fold_num = 5
@@ -83,51 +103,29 @@ class RGPE(BaseTLSurrogate):
                     cached_mu_list.append(mu)
                     cached_var_list.append(var)
 
-        argmin_list = [0] * (self.K + 1)
-        ranking_loss_caches = list()
-        for _ in range(self.num_sample):
-            ranking_loss_list = list()
-            for id in range(self.K):
-                sampled_y = np.random.normal(mu_list[id], var_list[id])
-                rank_loss = 0
-                for i in range(len(y)):
-                    for j in range(len(y)):
-                        if (y[i] < y[j]) ^ (sampled_y[i] < sampled_y[j]):
-                            rank_loss += 1
-                ranking_loss_list.append(rank_loss)
-
-            # Compute ranking loss for target surrogate.
-            rank_loss = 0
-            if not skip_target_surrogate:
-                if instance_num < k_fold_num:
-                    for i in range(instance_num):
-                        sampled_y = np.random.normal(cached_mu_list[i], cached_var_list[i])
-                        for j in range(instance_num):
-                            if (y[i] < y[j]) ^ (sampled_y[i] < sampled_y[j]):
-                                rank_loss += 1
-                else:
-                    fold_num = instance_num // k_fold_num
-                    for fold in range(k_fold_num):
-                        sampled_y = np.random.normal(cached_mu_list[fold], cached_var_list[fold])
-                        bound = instance_num if fold == (k_fold_num - 1) else (fold + 1) * fold_num
-                        for i in range(fold_num * fold, bound):
-                            for j in range(instance_num):
-                                if (y[i] < y[j]) ^ (sampled_y[i] < sampled_y[j]):
-                                    rank_loss += 1
-            else:
-                rank_loss = instance_num * instance_num
-            ranking_loss_list.append(rank_loss)
-            ranking_loss_caches.append(ranking_loss_list)
+        # Ranking losses of all Monte-Carlo samples, one column per surrogate.
+        sampled_y = np.random.normal(self._stack(mu_list, instance_num),
+                                     self._stack(var_list, instance_num),
+                                     size=(self.num_sample, self.K, instance_num))
+        source_losses = ranking_loss(y, sampled_y)
 
-            argmin_task = np.argmin(ranking_loss_list)
-            argmin_list[argmin_task] += 1
+        # Compute ranking loss for target surrogate.
+        if not skip_target_surrogate:
+            target_losses = np.zeros(self.num_sample, dtype=np.int64)
+            for rows, mu, var in zip(self._cv_rows(instance_num, k_fold_num), cached_mu_list, cached_var_list):
+                sampled_y = np.random.normal(np.ravel(mu), np.ravel(var), size=(self.num_sample, instance_num))
+                target_losses += ranking_loss(y, sampled_y, rows=rows)
+        else:
+            target_losses = np.full(self.num_sample, instance_num * instance_num)
+        ranking_loss_caches = np.column_stack([source_losses, target_losses])
+
+        argmin_list = np.bincount(np.argmin(ranking_loss_caches, axis=1), minlength=self.K + 1)
 
         # Update the weights.
         for id in range(self.K + 1):
             self.w[id] = argmin_list[id] / self.num_sample
 
         # Set weight dilution flag.
-        ranking_loss_caches = np.array(ranking_loss_caches)
         threshold = sorted(ranking_loss_caches[:, -1])[int(self.num_sample * 0.95)]
         for id in range(self.K):
             median = sorted(ranking_loss_caches[:, id])[int(self.num_sample * 0.5)]
@@ -164,11 +162,7 @@ class RGPE(BaseTLSurrogate):
             return
 
         # Train the target surrogate and update the weight w.
-        mu_list, var_list = list(), list()
-        for id in range(self.K):
-            mu, var = self.source_surrogates[id].predict(X)
-            mu_list.append(mu)
-            var_list.append(var)
+        mu_list, var_list = self.predict_sources(X, memoize=True)
 
         # Pretrain the leave-one-out surrogates.
         k_fold_num = 5
@@ -209,40 +203,36 @@ class RGPE(BaseTLSurrogate):
                     cached_mu_list.append(mu)
                     cached_var_list.append(var)
 
-        ranking_loss_list = list()
-        for id in range(self.K):
-                #sampled_y = np.random.normal(mu_list[id], var_list[id])
-            rank_loss = 0
-            for i in range(len(y)):
-                for j in range(len(y)):
-                    if (y[i] < y[j]) ^ (mu_list[id][i] < mu_list[id][j]):
-                        rank_loss += 1
-            ranking_loss_list.append(rank_loss / (instance_num * instance_num))
-
-            # Compute ranking loss for target surrogate.
-            rank_loss = 0
+        source_losses = ranking_loss(y, self._stack(mu_list, instance_num))
+        ranking_loss_list = (source_losses / (instance_num * instance_num)).tolist()
+
+        # Compute ranking loss for target surrogate.
+        rank_loss = 0
         if not skip_target_surrogate:
-            if instance_num < k_fold_num:
-                for i in range(instance_num):
-                    sampled_y = np.random.normal(cached_mu_list[i], cached_var_list[i])
-                    for j in range(instance_num):
-                        if (y[i] < y[j]) ^ (sampled_y[i] < sampled_y[j]):
-                            rank_loss += 1
-            else:
-                fold_num = instance_num // k_fold_num
-                for fold in range(k_fold_num):
-                    sampled_y = np.random.normal(cached_mu_list[fold], cached_var_list[fold])
-                    bound = instance_num if fold == (k_fold_num - 1) else (fold + 1) * fold_num
-                    for i in range(fold_num * fold, bound):
-                        for j in range(instance_num):
-                            if (y[i] < y[j]) ^ (sampled_y[i] < sampled_y[j]):
-                                rank_loss += 1
+            for rows, mu, var in zip(self._cv_rows(instance_num, k_fold_num), cached_mu_list, cached_var_list):
+                sampled_y = np.random.normal(np.ravel(mu), np.ravel(var))
+                rank_loss += int(ranking_loss(y, sampled_y, rows=rows))
         else:
             rank_loss = instance_num * instance_num
         ranking_loss_list.append(rank_loss / (instance_num * instance_num))
 
         return ranking_loss_list
 
+    @staticmethod
+    def _stack(arrays, n):
+        return np.reshape([np.ravel(a) for a in arrays], (len(arrays), n))
+
+    @staticmethod
+    def _cv_rows(instance_num, k_fold_num):
+        """Rows held out by each leave-one-out or cross-validation surrogate."""
+        if instance_num < k_fold_num:
+            return [[i] for i in range(instance_num)]
+        fold_num = instance_num // k_fold_num
+        return [
+            range(fold_num * fold, instance_num if fold == (k_fold_num - 1) else (fold + 1) * fold_num)
+            for fold in range(k_fold_num)
+        ]
+
 
     def predict(self, X: np.array):
         mu, var = self.target_surrogate.predict(X)
@@ -254,11 +244,10 @@ class RGPE(BaseTLSurrogate):
         var *= (self.w[-1] * self.w[-1])
 
         # Base surrogate predictions with corresponding weights.
-        for i in range(0, self.K):
-            if not self.ignored_flag[i]:
-                mu_t, var_t = self.source_surrogates[i].predict(X)
-                mu += self.w[i] * mu_t
-                var += self.w[i] * self.w[i] * var_t
+        ids = [i for i in range(0, self.K) if not self.ignored_flag[i]]
+        for i, mu_t, var_t in zip(ids, *self.predict_sources(X, ids)):
+            mu += self.w[i] * mu_t
+            var += self.w[i] * self.w[i] * var_t
         return mu, var
 
     def get_weights(self):
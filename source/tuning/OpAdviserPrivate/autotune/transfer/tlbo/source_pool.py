@@ -0,0 +1,246 @@
+# License: MIT
+
+import os
+import threading
+import traceback
+import weakref
+import multiprocessing as mp
+from collections import OrderedDict
+import numpy as np
+
+from autotune.gp import load_gp_model
+from autotune.optimizer.surrogate.core import build_surrogate
+from autotune.utils.logging_utils import get_logger
+
+
+class SourceSurrogateModel(object):
+    """A source surrogate predicting [mean, variance] columns."""
+
+    def __init__(self, context, X, y):
+        self.model = build_surrogate(context['surrogate_type'], context['config_space'],
+                                     np.random.RandomState(42))
+        self.model.train(X, y)
+
+    def predict(self, X):
+        mu, var = self.model.predict(X)
+        return np.column_stack([np.ravel(mu), np.ravel(var)])
+
+
+class MetricGPModel(object):
+    """The GP of one internal-metric column of a source task (see gp_predict)."""
+
+    def __init__(self, context, X, y, workload, metric_id):
+        self.model = load_gp_model(X, y, workload, metric_id)
+
+    def predict(self, X):
+        return self.model.predict(X).ypreds.reshape(-1, 1)
+
+
+def _handle(models, context, cmd, payload):
+    if cmd == 'fit':
+        for key, model_cls, args in payload:
+            models[key] = model_cls(context, *args)
+        return None
+    if cmd == 'predict':
+        keys, X = payload
+        return [models[key].predict(X) for key in keys]
+    if cmd == 'clear':
+        models.clear()
+        return None
+    raise ValueError('Invalid command %s.' % cmd)
+
+
+def _shard_worker(conn, context):
+    models = dict()
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            break
+        try:
+            conn.send((True, _handle(models, context, *msg)))
+        except Exception:
+            conn.send((False, traceback.format_exc()))
+    conn.close()
+
+
+class _LocalShard(object):
+    def __init__(self, context):
+        self.context = context
+        self.models = dict()
+        self._result = None
+
+    def send(self, cmd, payload):
+        self._result = _handle(self.models, self.context, cmd, payload)
+
+    def recv(self):
+        return self._result
+
+    def close(self):
+        self.models.clear()
+
+
+class _ProcessShard(object):
+    def __init__(self, context):
+        self.conn, child_conn = mp.Pipe()
+        self.process = mp.Process(target=_shard_worker, args=(child_conn, context), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def send(self, cmd, payload):
+        self.conn.send((cmd, payload))
+
+    def recv(self):
+        ok, result = self.conn.recv()
+        if not ok:
+            raise RuntimeError('Source model worker failed:\n%s' % result)
+        return result
+
+    def close(self):
+        try:
+            self.conn.send(None)
+            self.conn.close()
+        except (OSError, EOFError):
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+def _close_shards(shards):
+    for shard in shards:
+        shard.close()
+
+
+class SourceModelPool(object):
+    """Source-task models sharded over worker processes.
+
+    Each worker trains and keeps the models of its shard, so only training data
+    and predictions cross process boundaries and the models never need to be
+    pickled. A prediction request is sent to all shards at once and runs on as
+    many cores as there are shards. With n_jobs=1 (the default, or if workers
+    cannot be started) the models live in this process; n_jobs=None uses all cores.
+
+    Predictions can be memoized per configuration row: source models never
+    change after training, so rows predicted in an earlier iteration (e.g. the
+    target history in RGPE) are not predicted again. At most max_memo_rows rows
+    are kept per model, the least recently used ones are forgotten first.
+    """
+
+    def __init__(self, context, n_jobs=1, max_memo_rows=10000):
+        self.logger = get_logger(self.__class__.__name__)
+        self.context = context
+        self.n_jobs = (os.cpu_count() or 1) if n_jobs is None or n_jobs < 1 else n_jobs
+        self.shards = list()
+        self.key_shard = dict()
+        self.memo = dict()
+        self.max_memo_rows = max_memo_rows
+        self.lock = threading.Lock()
+        self._finalizer = weakref.finalize(self, _close_shards, self.shards)
+
+    def __contains__(self, key):
+        return key in self.key_shard
+
+    def _start_shards(self, num_models):
+        num_shards = min(self.n_jobs, num_models)
+        if num_shards > 1:
+            try:
+                self.shards.extend(_ProcessShard(self.context) for _ in range(num_shards))
+                return
+            except (OSError, AssertionError) as e:
+                # e.g. daemonic processes are not allowed to have children
+                self.logger.warning('Failed to start source model workers (%s), use one process.' % e)
+                _close_shards(self.shards)
+                del self.shards[:]
+        self.shards.append(_LocalShard(self.context))
+
+    def _request(self, jobs):
+        """Sends {shard_id: (cmd, payload)} to all shards before collecting the results."""
+        for shard_id, (cmd, payload) in jobs.items():
+            self.shards[shard_id].send(cmd, payload)
+        results, error = dict(), None
+        for shard_id in jobs:
+            # Drain every shard even if one failed, to keep the pipes in sync
+            try:
+                results[shard_id] = self.shards[shard_id].recv()
+            except RuntimeError as e:
+                error = e
+        if error is not None:
+            raise error
+        return results
+
+    def fit(self, jobs):
+        """Trains the models given as (key, model_cls, args); keys already trained are skipped."""
+        jobs = [job for job in jobs if job[0] not in self.key_shard]
+        if not jobs:
+            return
+        with self.lock:
+            if not self.shards:
+                self._start_shards(len(jobs))
+            # Round-robin over the shards, in the order the models are added
+            start = len(self.key_shard)
+            shard_ids = [(start + i) % len(self.shards) for i in range(len(jobs))]
+            shard_jobs = dict()
+            for shard_id, job in zip(shard_ids, jobs):
+                shard_jobs.setdefault(shard_id, ('fit', list()))[1].append(job)
+            self._request(shard_jobs)
+            for shard_id, job in zip(shard_ids, jobs):
+                self.key_shard[job[0]] = shard_id
+
+    def _predict(self, keys, X):
+        shard_keys = dict()
+        for key in keys:
+            shard_keys.setdefault(self.key_shard[key], list()).append(key)
+        results = self._request({shard_id: ('predict', (_keys, X)) for shard_id, _keys in shard_keys.items()})
+        predictions = dict()
+        for shard_id, _keys in shard_keys.items():
+            predictions.update(zip(_keys, results[shard_id]))
+        return [predictions[key] for key in keys]
+
+    def predict(self, keys, X, memoize=False):
+        """Predicts X with the models of the keys, one (n, c) array per key."""
+        keys = list(keys)
+        if not keys:
+            return list()
+        X = np.asarray(X)
+        with self.lock:
+            if not memoize:
+                return self._predict(keys, X)
+
+            rows = [row.tobytes() for row in X]
+            memos = [self.memo.setdefault(key, OrderedDict()) for key in keys]
+            missing = [i for i, row in enumerate(rows) if any(row not in memo for memo in memos)]
+            if missing:
+                for memo, prediction in zip(memos, self._predict(keys, X[missing])):
+                    for i, values in zip(missing, prediction):
+                        memo[rows[i]] = values
+            results = list()
+            for memo in memos:
+                results.append(np.array([memo[row] for row in rows]))
+                for row in rows:
+                    memo.move_to_end(row)
+                while len(memo) > self.max_memo_rows:
+                    memo.popitem(last=False)
+            return results
+
+    def reset(self):
+        """Forgets all models and memoized predictions, keeping the workers."""
+        with self.lock:
+            if self.shards:
+                self._request({shard_id: ('clear', None) for shard_id in range(len(self.shards))})
+            self.key_shard.clear()
+            self.memo.clear()
+
+    def close(self):
+        self._finalizer()
+
+
+class PooledSourceSurrogate(object):
+    """Stand-in for a source surrogate trained in a SourceModelPool."""
+
+    def __init__(self, pool, key):
+        self.pool = pool
+        self.key = key
+
+    def predict(self, X):
+        prediction = self.pool.predict([self.key], X)[0]
+        return prediction[:, :1], prediction[:, 1:]
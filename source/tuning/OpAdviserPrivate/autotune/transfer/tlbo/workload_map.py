@@ -8,7 +8,7 @@ from autotune.transfer.tlbo.base import BaseTLSurrogate
 from autotune.utils.parser import get_action_data_json
 from autotune.utils.binner import Bin
 from autotune.knobs import knobDF2action
-from autotune.gp import gp_predict
+from autotune.transfer.tlbo.source_pool import MetricGPModel
 from autotune.utils.history_container import HistoryContainer
 from openbox.utils.config_space import Configuration
 from openbox.utils.config_space.util import convert_configurations_to_array
@@ -17,9 +17,9 @@ from openbox.utils.config_space import ConfigurationSpace, UniformIntegerHyperpa
 
 class WorkloadMapping(BaseTLSurrogate):
     def __init__(self, config_space, source_hpo_data, seed,
-                 surrogate_type='rf', num_src_hpo_trial=50, only_source=False):
+                 surrogate_type='rf', num_src_hpo_trial=50, only_source=False, n_jobs=1):
         super().__init__(config_space, source_hpo_data, 42,
-                         surrogate_type=surrogate_type, num_src_hpo_trial=num_src_hpo_trial)
+                         surrogate_type=surrogate_type, num_src_hpo_trial=num_src_hpo_trial, n_jobs=n_jobs)
         self.method_id = 'mapping'
         self.source_dict = {}
         self.scaler = StandardScaler()
@@ -50,14 +50,21 @@ class WorkloadMapping(BaseTLSurrogate):
         target_IM = self.scaler.transform(target_IM)
         target_IM = self.binner.transform(target_IM)
 
-        scores = {}
+        # One GP per source task and internal-metric column, fitted once in the source pool.
+        jobs = list()
         for task_id, item in list(self.source_dict.items()):
-            predictions = np.empty_like(target_IM)
-            source_X_scaled = item['X']
+            if (task_id, 0) in self.source_pool:
+                continue
             source_IM_scaled = self.scaler.transform(item['IM'])
             for j, col in enumerate(source_IM_scaled.T):
-                col = col.reshape(-1, 1)
-                predictions[:, j] = gp_predict(source_X_scaled, col, target_X_scaled, task_id, j)
+                jobs.append(((task_id, j), MetricGPModel, (item['X'], col.reshape(-1, 1), task_id, j)))
+        self.source_pool.fit(jobs)
+
+        keys = [(task_id, j) for task_id in self.source_dict for j in range(target_IM.shape[1])]
+        columns = dict(zip(keys, self.source_pool.predict(keys, target_X_scaled, memoize=True)))
+        scores = {}
+        for task_id in self.source_dict:
+            predictions = np.hstack([columns[(task_id, j)] for j in range(target_IM.shape[1])])
             predictions = self.binner.transform(predictions)
             dists = np.sqrt(np.sum(np.square(np.subtract(predictions, target_IM)), axis=1))
             scores[task_id] = np.mean(dists)
@@ -11,6 +11,8 @@ from autotune.utils.config_space.util import convert_configurations_to_array
 from autotune.utils.util_funcs import check_random_state
 from autotune.workload_map import WorkloadMapping
 from autotune.pipleline.pipleline import PipleLine
+from autotune.pipleline.evaluator import ParallelEvaluator
+from autotune.dbenv import DBEnv
 from .knobs import ts, logger, initialize_knobs
 from .utils.parser import  get_hist_json
 from autotune.utils.history_container import HistoryContainer, load_history_from_filelist
@@ -93,6 +95,9 @@ class DBTuner:
             try:
                 task_id = f.split('.')[0]
                 fn = os.path.join(self.hc_path, f)
+                if not os.path.isfile(fn):
+                    # e.g. the .artifacts directory of cached source-task data
+                    continue
                 history_container = HistoryContainer(task_id, config_space=config_space)
                 history_container.load_history_from_json(fn)
                 self.hcL.append(history_container)
@@ -167,7 +172,27 @@ class DBTuner:
 
         return history_workload_data
 
+    def setup_evaluator(self):
+        """Evaluates configurations on more database instances in parallel, if args_db['instances'] lists any.
+
+        Each instance is given as the [database] options that differ from the
+        tuned one, e.g. [{'port': 3309, 'sock': '/var/run/mysqld/mysqld2.sock', 'cgroup': 'server2'}].
+        """
+        instances = eval(self.args_db['instances']) if self.args_db['instances'] else []
+        if not instances:
+            return None
+
+        envs = [self.env]
+        for overrides in instances:
+            args_db = defaultdict(str, self.args_db)
+            args_db.update({k: str(v) for k, v in overrides.items()})
+            db = type(self.env.db)(args_db)
+            envs.append(DBEnv(args_db, self.args_tune, db))
+        logger.info('evaluate configurations on {} instances in parallel'.format(len(envs)))
+        return ParallelEvaluator([env.step for env in envs])
+
     def tune(self):
+        evaluator = self.setup_evaluator()
         bo = PipleLine(self.env.step,
                        self.config_space,
                        num_objs=len(self.objs),
@@ -204,6 +229,7 @@ class DBTuner:
                  softmax_weight=self.args_tune['softmax_weight'],
                  transformer=self.args_tune['transformer'],
                  #2024-11-22 softmax weight
+                       evaluator=evaluator,
                        )
         
 #         id=self.args_tune['task_id']
@@ -240,6 +266,8 @@ class DBTuner:
 #         print(s)
 
         history = bo.run()
+        if evaluator is not None:
+            evaluator.shutdown()
         #2024-11-11: code for experiment
         # history,history2 = bo.run()
         #2024-11-11: code for experiment
@@ -34,7 +34,13 @@ default_value = {
 'tr_init': 'True',
 'batch_size':16,
 'transfer_framework':'auto',
-'data_repo': 'repo'
+'data_repo': 'repo',
+'instances': '',
+'cgroup': 'server',
+'early_stop': 'False',
+'early_stop_confidence': 0.99,
+'early_stop_min_samples': 3,
+'early_stop_margin': 0.
 }
 
 auto_setting = ['knob_num', 'initial_tunable_knob_num', 'incremental_every',  'transfer_framework']
@@ -5,6 +5,7 @@ from ConfigSpace import ConfigurationSpace, Configuration, Constant,\
      CategoricalHyperparameter, UniformFloatHyperparameter, \
      UniformIntegerHyperparameter, InCondition
 from autotune.utils.config_space.util import convert_configurations_to_array
+from autotune.utils.config_space.batch import ConfigurationBatch, SpaceCodec, get_codec
 from ConfigSpace.util import get_one_exchange_neighbourhood
 
 import warnings
@@ -0,0 +1,227 @@
+# License: MIT
+
+from typing import Dict, List, Mapping, Sequence
+import numpy as np
+import pandas as pd
+
+from ConfigSpace import Configuration, ConfigurationSpace, CategoricalHyperparameter, \
+    OrdinalHyperparameter, UniformFloatHyperparameter, UniformIntegerHyperparameter
+
+
+def _as_float(values) -> np.ndarray:
+    try:
+        return np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+
+
+class _Column(object):
+    """Vector encoding of one hyperparameter, following ConfigSpace's _transform/_inverse_transform."""
+
+    def __init__(self, hp):
+        self.hp = hp
+        self.choices = None
+        self.numeric = False
+        self.integer = isinstance(hp, UniformIntegerHyperparameter)
+        if isinstance(hp, (CategoricalHyperparameter, OrdinalHyperparameter)):
+            self.choices = list(hp.choices if isinstance(hp, CategoricalHyperparameter) else hp.sequence)
+            self.choice_index = {value: i for i, value in enumerate(self.choices)}
+            self.lower, self.upper = None, None
+        elif isinstance(hp, (UniformFloatHyperparameter, UniformIntegerHyperparameter)) and hp.q is None \
+                and not (self.integer and hp.log):
+            self.numeric = True
+            self.log = hp.log
+            self.lower, self.upper = hp.lower, hp.upper
+            # Integers are encoded like ConfigSpace's float on [lower - 0.49999, upper + 0.49999]
+            _lower, _upper = (self.lower - 0.49999, self.upper + 0.49999) if self.integer else (self.lower, self.upper)
+            self._lower = np.log(_lower) if self.log else _lower
+            self._upper = np.log(_upper) if self.log else _upper
+        else:
+            self.lower, self.upper = getattr(hp, 'lower', None), getattr(hp, 'upper', None)
+
+    def encode(self, values) -> np.ndarray:
+        if self.choices is not None:
+            return np.array([np.nan if v is None else self.choice_index[v] for v in values], dtype=np.float64)
+        if self.numeric:
+            vector = _as_float(values)
+            if self.log:
+                vector = np.log(vector)
+            vector = (vector - self._lower) / (self._upper - self._lower)
+            return np.clip(vector, 0.0, 1.0)
+        return np.array([np.nan if v is None else self.hp._inverse_transform(v) for v in values], dtype=np.float64)
+
+    def decode(self, vector: np.ndarray) -> list:
+        inactive = ~np.isfinite(vector)
+        if self.choices is not None:
+            return [None if i else self.choices[int(v)] for v, i in zip(vector, inactive)]
+        if self.numeric:
+            values = vector * (self._upper - self._lower) + self._lower
+            if self.log:
+                values = np.exp(values)
+            if self.integer:
+                values = np.rint(np.clip(values, self._lower, self._upper))
+                return [None if i else int(v) for v, i in zip(values, inactive)]
+            values = np.clip(values, self.lower, self.upper)
+            return [None if i else float(v) for v, i in zip(values, inactive)]
+        return [None if i else self.hp._transform(v) for v, i in zip(vector, inactive)]
+
+    def clip(self, values) -> list:
+        """Moves values into the range of the hyperparameter, like configs2space."""
+        if self.choices is not None:
+            return [v if v is None or v in self.choice_index else self.hp.default_value for v in values]
+        if self.lower is None:
+            return list(values)
+        return [None if v is None else min(max(v, self.lower), self.upper) for v in values]
+
+
+class SpaceCodec(object):
+    """Encodes and decodes whole columns of configurations of one ConfigurationSpace.
+
+    The vector representation is the one of Configuration.get_array(): one column
+    per hyperparameter, normalized to [0, 1] (choice index for categoricals) and
+    NaN for inactive hyperparameters.
+    """
+
+    def __init__(self, config_space: ConfigurationSpace):
+        self.config_space = config_space
+        self.names = config_space.get_hyperparameter_names()
+        self.index = {name: config_space.get_idx_by_hyperparameter_name(name) for name in self.names}
+        self.columns = {hp.name: _Column(hp) for hp in config_space.get_hyperparameters()}
+        self.defaults = np.full(len(self.names), np.nan)
+        for name, column in self.columns.items():
+            self.defaults[self.index[name]] = column.hp.normalized_default_value
+
+    def encode(self, columns: Mapping[str, Sequence], n: int = None, clip=False, impute=False) -> np.ndarray:
+        """Encodes {name: values} (e.g. a DataFrame) into an (n, D) array.
+
+        Hyperparameters without a column are inactive (NaN), or take their
+        default if impute is set. With clip, out-of-range values are moved into
+        the space first.
+        """
+        if n is None:
+            n = len(next(iter(columns.values()))) if len(columns) else 0
+        array = np.full((n, len(self.names)), np.nan)
+        for name, column in self.columns.items():
+            if name not in columns:
+                continue
+            values = list(columns[name])
+            if clip:
+                values = column.clip(values)
+            array[:, self.index[name]] = column.encode(values)
+        return self.impute(array) if impute else array
+
+    def encode_records(self, records: Sequence[Mapping], **kwargs) -> np.ndarray:
+        """Encodes a list of {name: value} dicts (e.g. Configuration objects)."""
+        records = [record.get_dictionary() if isinstance(record, Configuration) else record for record in records]
+        columns = dict()
+        for name in self.names:
+            if any(name in record for record in records):
+                columns[name] = [record.get(name) for record in records]
+        return self.encode(columns, n=len(records), **kwargs)
+
+    def decode(self, array: np.ndarray) -> Dict[str, list]:
+        """Decodes an (n, D) array into {name: values}; inactive values are None."""
+        array = np.atleast_2d(array)
+        return {name: column.decode(array[:, self.index[name]]) for name, column in self.columns.items()}
+
+    def impute(self, array: np.ndarray) -> np.ndarray:
+        """Imputes inactive (non-finite) values with the normalized defaults, in place."""
+        np.copyto(array, np.broadcast_to(self.defaults, array.shape), where=~np.isfinite(array))
+        return array
+
+
+def get_codec(config_space: ConfigurationSpace) -> SpaceCodec:
+    """Returns the codec of the space, built once and kept on the space."""
+    codec = getattr(config_space, '_codec', None)
+    if codec is None or codec.names != config_space.get_hyperparameter_names():
+        codec = SpaceCodec(config_space)
+        config_space._codec = codec
+    return codec
+
+
+class ConfigurationBatch(object):
+    """N configurations of one space held as a single (N, D) vector array.
+
+    AbstractAcquisitionFunction.__call__ accepts a batch and maps compact-space
+    candidates onto the full space on the array, without building one
+    Configuration per candidate. The maximizers and surrogates still exchange
+    lists of Configuration; a configuration is materialized on access (see __getitem__).
+    """
+
+    def __init__(self, config_space: ConfigurationSpace, array: np.ndarray, origin: str = None):
+        self.config_space = config_space
+        self.array = np.atleast_2d(np.asarray(array, dtype=np.float64))
+        self.origin = origin
+
+    @classmethod
+    def from_configurations(cls, configs: List[Configuration], config_space: ConfigurationSpace = None):
+        if config_space is None:
+            config_space = configs[0].configuration_space
+        array = np.array([config.get_array() for config in configs], dtype=np.float64)
+        return cls(config_space, array.reshape(len(configs), len(config_space.get_hyperparameters())))
+
+    @classmethod
+    def from_columns(cls, config_space: ConfigurationSpace, columns: Mapping[str, Sequence], **kwargs):
+        """Builds a batch from {name: values}, e.g. a DataFrame; see SpaceCodec.encode."""
+        return cls(config_space, get_codec(config_space).encode(columns, **kwargs))
+
+    @property
+    def codec(self) -> SpaceCodec:
+        return get_codec(self.config_space)
+
+    def __len__(self):
+        return self.array.shape[0]
+
+    def __getitem__(self, item):
+        if isinstance(item, (int, np.integer)):
+            config = Configuration(self.config_space, vector=self.array[item].copy())
+            if self.origin is not None:
+                config.origin = self.origin
+            return config
+        return ConfigurationBatch(self.config_space, self.array[item], self.origin)
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def to_configurations(self) -> List[Configuration]:
+        return list(self)
+
+    def to_array(self, impute=True) -> np.ndarray:
+        """The vector array, with inactive values imputed by their default (like convert_configurations_to_array)."""
+        array = self.array.copy()
+        return self.codec.impute(array) if impute else array
+
+    def to_columns(self) -> Dict[str, list]:
+        return self.codec.decode(self.array)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        return pd.DataFrame(self.to_columns(), columns=self.codec.names)
+
+    def to_space(self, config_space: ConfigurationSpace, fill: Mapping = None, clip=False):
+        """Re-encodes the batch in another space sharing hyperparameter names.
+
+        Hyperparameters missing from this batch take their value from fill
+        (e.g. the incumbent), or else their default. Columns whose hyperparameter is
+        identical in both spaces are copied without decoding.
+        """
+        codec, target = self.codec, get_codec(config_space)
+        fill_names = set() if fill is None else set(fill.keys())
+        columns, defaults = dict(), list()
+        decoded = None
+        array = np.full((len(self), len(target.names)), np.nan)
+        for name in target.names:
+            if name in codec.columns and codec.columns[name].hp == target.columns[name].hp:
+                array[:, target.index[name]] = self.array[:, codec.index[name]]
+            elif name in codec.columns:
+                if decoded is None:
+                    decoded = codec.decode(self.array)
+                columns[name] = decoded[name]
+            elif name in fill_names:
+                columns[name] = [fill[name]] * len(self)
+            else:
+                defaults.append(target.index[name])
+        encoded = target.encode(columns, n=len(self), clip=clip)
+        for name in columns:
+            array[:, target.index[name]] = encoded[:, target.index[name]]
+        array[:, defaults] = target.defaults[defaults]
+        return ConfigurationBatch(config_space, array, self.origin)
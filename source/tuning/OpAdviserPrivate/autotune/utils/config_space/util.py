@@ -7,6 +7,7 @@ import numpy as np
 import pandas as pd
 
 from autotune.utils.config_space import Configuration, ConfigurationSpace, UniformIntegerHyperparameter, CategoricalHyperparameter
+from autotune.utils.config_space.batch import ConfigurationBatch, get_codec
 
 
 def convert_configurations_to_array(configs: List[Configuration]) -> np.ndarray:
@@ -16,7 +17,7 @@ def convert_configurations_to_array(configs: List[Configuration]) -> np.ndarray:
 
     Parameters
     ----------
-    configs : List[Configuration]
+    configs : List[Configuration] or ConfigurationBatch
         List of configuration objects.
 
     Returns
@@ -25,6 +26,8 @@ def convert_configurations_to_array(configs: List[Configuration]) -> np.ndarray:
         Array with configuration hyperparameters. Inactive values are imputed
         with their default value.
     """
+    if isinstance(configs, ConfigurationBatch):
+        return configs.to_array()
     configs_array = np.array([config.get_array() for config in configs],
                              dtype=np.float64)
     configuration_space = configs[0].configuration_space
@@ -52,13 +55,7 @@ def impute_default_values(
         Array with configuration hyperparameters. Inactive values are imputed
         with their default value.
     """
-    for hp in configuration_space.get_hyperparameters():
-        default = hp.normalized_default_value
-        idx = configuration_space.get_idx_by_hyperparameter_name(hp.name)
-        nonfinite_mask = ~np.isfinite(configs_array[:, idx])
-        configs_array[nonfinite_mask, idx] = default
-
-    return configs_array
+    return get_codec(configuration_space).impute(configs_array)
 
 
 def impute_incumb_values(configurations, incumbent):
@@ -82,6 +79,8 @@ def impute_incumb_values(configurations, incumbent):
 
 
 def config2df(configs):
+    if isinstance(configs, ConfigurationBatch):
+        return configs.to_dataframe()
     config_dic = defaultdict(list)
     for config in configs:
         for k in config:
@@ -91,25 +90,26 @@ def config2df(configs):
 
 
 def configs2space(configs, space):
+    """Moves the configurations into space, clipping values out of its range.
+
+    Values are checked and encoded column by column, see SpaceCodec.
+    """
+    if len(configs) == 0:
+        return list()
+    codec = get_codec(space)
+    records = [config.get_dictionary() for config in configs]
+    array = codec.encode_records(records, clip=True)
+    missing = np.isnan(array).any(axis=1)
+
     configs_new = list()
-    for i, config in enumerate(configs):
-        config_new = {}
-        for name in config.keys():
-            if name in space.get_hyperparameter_names():
-                value = config[name]
-                if isinstance(space.get_hyperparameters_dict()[name],  CategoricalHyperparameter):
-                    if value not in space.get_hyperparameters_dict()[name].choices:
-                        value = space.get_hyperparameters_dict()[name].default_value
-                else:
-                    if value < space.get_hyperparameters_dict()[name].lower:
-                        value =  space.get_hyperparameters_dict()[name].lower
-                    if value > space.get_hyperparameters_dict()[name].upper:
-                        value =  space.get_hyperparameters_dict()[name].upper
-
-                config_new[name] = value
-
-        c_new = Configuration(space, config_new)
-        configs_new.append(c_new)
+    for i, record in enumerate(records):
+        if missing[i]:
+            # Inactive or missing values, leave the checks to ConfigSpace
+            config_new = {name: codec.columns[name].clip([value])[0]
+                          for name, value in record.items() if name in codec.columns}
+            configs_new.append(Configuration(space, config_new))
+        else:
+            configs_new.append(Configuration(space, vector=array[i]))
 
     return configs_new
 
@@ -4,6 +4,8 @@ import pdb
 import sys
 import time
 import json
+import hashlib
+import copy
 import collections
 from typing import List, Union
 import numpy as np
@@ -11,7 +13,7 @@ from ConfigSpace.hyperparameters import CategoricalHyperparameter, \
     UniformFloatHyperparameter, UniformIntegerHyperparameter, Constant, \
     OrdinalHyperparameter
 from autotune.utils.constants import MAXINT, SUCCESS
-from autotune.utils.config_space import Configuration, ConfigurationSpace
+from autotune.utils.config_space import Configuration, ConfigurationSpace, get_codec
 from autotune.utils.logging_utils import get_logger
 from autotune.utils.multi_objective import Hypervolume, get_pareto_front
 from autotune.utils.config_space.space_utils import get_config_from_dict
@@ -26,6 +28,33 @@ Observation = collections.namedtuple(
     'Observation', ['config', 'trial_state', 'constraints', 'objs', 'elapsed_time',  'iter_time','EM', 'IM', 'resource', 'info', 'context'])
 
 
+def read_history_file(fn):
+    """Read the info and observation records of a history file.
+
+    Supports the JSON dump (.json) and the append-only log (.jsonl) formats.
+    Returns the parsed dict of the file, with 'info' and 'data' keys.
+    """
+    if fn.endswith('.jsonl'):
+        return read_history_log(fn)
+    with open(fn) as fp:
+        return json.load(fp)
+
+
+def read_history_log(fn):
+    info, data = None, []
+    with open(fn, 'rb') as fp:
+        for line in fp:
+            if not line.endswith(b'\n'):
+                # torn write of the last record, e.g. the tuner crashed mid-append
+                break
+            record = json.loads(line)
+            if info is None:
+                info = record['info']
+            else:
+                data.append(record)
+    return {"info": info, "data": data}
+
+
 def detect_valid_history_file(dir):
     if not os.path.exists(dir):
         return []
@@ -33,8 +62,7 @@ def detect_valid_history_file(dir):
     valid_files = []
     for f in files:
         try:
-            with open(os.path.join(dir,f)) as fp:
-                all_data = json.load(fp)
+            all_data = read_history_file(os.path.join(dir, f))
         except Exception as e:
             continue
         data = all_data['data']
@@ -53,8 +81,7 @@ def load_history_from_filelist(task_id, fileL, config_space):
     data_mutipleL = list()
     for fn in fileL:
         try:
-            with open(fn) as fp:
-                all_data = json.load(fp)
+            all_data = read_history_file(fn)
         except Exception as e:
             print('Encountered exception %s while reading runhistory from %s. '
                   'Not adding any runs!', e, fn, )
@@ -62,15 +89,11 @@ def load_history_from_filelist(task_id, fileL, config_space):
 
         info = all_data["info"]
         data = all_data["data"]
-        data_mutipleL = data_mutipleL + data
-
-
-    file_out = 'history_{}.json'.format(task_id)
-    with open(file_out, "w") as fp:
-        json.dump({"info": info, "data": data_mutipleL}, fp, indent=2)
+        data_mutipleL.extend(data)
 
+    # merged in memory, there is no need to dump and re-parse a combined file
     history_container = HistoryContainer(task_id, config_space=config_space)
-    history_container.load_history_from_json(file_out)
+    history_container.load_history_from_records(info, data_mutipleL)
 
     return history_container
 
@@ -108,6 +131,16 @@ class HistoryContainer(object):
 
         self.update_times = list()  # record all update times
 
+        # append-only log: path, and number of observations (the first ones of
+        # self.perfs) already in it, whether loaded from it or appended
+        self.log_fn = None
+        self.log_num = 0
+        self.log_checked = False
+
+        # derived data used by space transfer, see get_artifacts()
+        self.artifact_fn = None
+        self._artifacts = None
+
         self.successful_perfs = list()  # perfs of successful trials
         self.failed_index = list()
         self.transform_perf_index = list()
@@ -126,6 +159,7 @@ class HistoryContainer(object):
             else:
                 values[key] = self.config_space_all._hyperparameters[key].default_value
 
+        # Built from values, so that out-of-range values are rejected rather than clipped
         c_new = Configuration(self.config_space_all, values)
 
         return c_new
@@ -208,6 +242,19 @@ class HistoryContainer(object):
     def get_contexts(self):
         return np.vstack(self.contexts)
 
+    def copy(self):
+        """A copy that can be updated without affecting this container, e.g. with pending observations.
+
+        Configurations and metrics are shared; the copy is never written to disk.
+        """
+        history_container = copy.copy(self)
+        for name, value in vars(self).items():
+            if isinstance(value, (list, dict)):
+                setattr(history_container, name, copy.copy(value))
+        history_container.log_fn = None
+        history_container.artifact_fn = None
+        return history_container
+
 
     def add(self, config: Configuration, perf):
         if config in self.data:
@@ -279,27 +326,57 @@ class HistoryContainer(object):
         return self.incumbents
 
     def save_json(self, fn: str = "history_container.json"):
-        data = []
-        for i in range(len(self.perfs)):
-            tmp = {
-                'configuration': self.configurations_all[i].get_dictionary(),
-                'external_metrics': self.external_metrics[i],
-                'internal_metrics': self.internal_metrics[i],
-                'resource': self.resource[i],
-                'context': self.contexts[i],
-                'trial_state': self.trial_states[i],
-                'elapsed_time': self.elapsed_times[i],
-                'iter_time': self.iter_times[i]
-            }
-            data.append(tmp)
+        data = [self._record(i) for i in range(len(self.perfs))]
 
         with open(fn, "w") as fp:
             json.dump({"info": self.info,  "data": data}, fp, indent=2)
 
+    def _record(self, i):
+        return {
+            'configuration': self.configurations_all[i].get_dictionary(),
+            'external_metrics': self.external_metrics[i],
+            'internal_metrics': self.internal_metrics[i],
+            'resource': self.resource[i],
+            'context': self.contexts[i],
+            'trial_state': self.trial_states[i],
+            'elapsed_time': self.elapsed_times[i],
+            'iter_time': self.iter_times[i]
+        }
+
+    def append_jsonl(self, fn: str = "history_container.jsonl"):
+        """Append the observations not yet in the log at fn, one JSON line each.
+
+        Unlike save_json, each call only writes the new observations. Every line
+        is flushed and fsynced, and a torn last line is ignored on load, so a crash
+        loses at most the observation being written.
+        """
+        if self.log_fn != fn:
+            # none of the observations in memory were loaded from this log
+            self.log_fn = fn
+            self.log_num = 0
+            self.log_checked = False
+        if self.log_num >= len(self.perfs):
+            return
+
+        if not self.log_checked and os.path.exists(fn):
+            with open(fn, 'rb+') as fp:
+                # drop a torn last line so that new records start on their own line
+                content = fp.read()
+                fp.truncate(content.rfind(b'\n') + 1)
+        self.log_checked = True
+
+        with open(fn, "a") as fp:
+            if fp.tell() == 0:
+                fp.write(json.dumps({"info": self.info}) + '\n')
+            for i in range(self.log_num, len(self.perfs)):
+                fp.write(json.dumps(self._record(i)) + '\n')
+            fp.flush()
+            os.fsync(fp.fileno())
+        self.log_num = len(self.perfs)
+
     def load_history_from_json(self, fn: str = "history_container.json", load_num=None):  # todo: all configs
         try:
-            with open(fn) as fp:
-                all_data = json.load(fp)
+            all_data = read_history_file(fn)
         except Exception as e:
             self.logger.warning(
                 'Encountered exception %s while reading runhistory from %s. '
@@ -307,9 +384,21 @@ class HistoryContainer(object):
             )
             return
 
-        info = all_data["info"]
-        data = all_data["data"]
+        self.artifact_fn = os.path.join(os.path.dirname(fn), '.artifacts', os.path.basename(fn) + '.json')
+
+        self.load_history_from_records(all_data["info"], all_data["data"], load_num=load_num)
+        if fn.endswith('.jsonl'):
+            # later observations are appended to the log they were loaded from; records
+            # skipped while loading (e.g. invalid configurations) stay in the log
+            self.log_fn = fn
+            self.log_num = len(self.perfs)
+            self.log_checked = False
+
+    def load_history_from_records(self, info, data, load_num=None):
+        """Load observations given as records of the history file formats.
 
+        Records whose configuration is not valid in the configuration space are skipped.
+        """
         y_variables = info['objs']
         c_variables = info['constraints']
         self.num_constraints = len(c_variables)
@@ -586,7 +675,76 @@ class HistoryContainer(object):
         importance_table = AsciiTable(table_data).table
         return importance_table
 
+    def get_artifacts(self):
+        """Return the data derived from the history that space transfer reuses.
+
+        Config arrays, transformed perfs and the default performance are computed
+        once per history content. SHAP importances and promising spaces are filled
+        in on first use. Importances are the expensive part (a LightGBM fit and a
+        TreeExplainer), so for histories loaded from a file they are also persisted
+        in a .artifacts directory next to it, keyed by the content hash.
+        """
+        if self._artifacts is not None and self._artifacts['num'] == len(self.perfs) \
+                and self._artifacts['config_space'] is self.config_space:
+            return self._artifacts
+
+        X = convert_configurations_to_array(self.configurations)
+        perfs = self.get_transformed_perfs()
+        content_hash = hashlib.sha1()
+        content_hash.update(str(self.config_space).encode())
+        content_hash.update(np.ascontiguousarray(X).tobytes())
+        content_hash.update(np.ascontiguousarray(perfs).tobytes())
+
+        default_array = self.config_space.get_default_configuration().get_array()
+        is_default = (np.array([config.get_array() for config in self.configurations]) == default_array).all(axis=1)
+        default_performance = perfs[is_default].mean() if is_default.any() else perfs[0]
+
+        self._artifacts = {
+            'num': len(self.perfs),
+            'config_space': self.config_space,
+            'hash': content_hash.hexdigest(),
+            'X': X,
+            'perfs': perfs,
+            'default_performance': default_performance,
+            'importances': None,
+            'promising_spaces': dict(),
+        }
+        if self.artifact_fn is not None and os.path.exists(self.artifact_fn):
+            try:
+                with open(self.artifact_fn) as fp:
+                    saved = json.load(fp)
+                if saved['hash'] == self._artifacts['hash']:
+                    self._artifacts['importances'] = saved['importances']
+            except (ValueError, KeyError, OSError) as e:
+                self.logger.warning('Ignoring artifacts in %s: %s', self.artifact_fn, e)
+        return self._artifacts
+
+    def _save_artifacts(self):
+        if self.artifact_fn is None:
+            return
+        artifacts = self.get_artifacts()
+        try:
+            os.makedirs(os.path.dirname(self.artifact_fn), exist_ok=True)
+            tmp_fn = self.artifact_fn + '.tmp'
+            with open(tmp_fn, 'w') as fp:
+                json.dump({'hash': artifacts['hash'], 'importances': artifacts['importances']}, fp)
+            os.replace(tmp_fn, self.artifact_fn)
+        except OSError as e:
+            self.logger.warning('Failed to save artifacts to %s: %s', self.artifact_fn, e)
+
     def get_shap_importance(self, config_space=None, return_dir=False, config_bench=None):
+        if config_space is None and return_dir:
+            # the importances of the history's own space only change with its content
+            artifacts = self.get_artifacts()
+            if artifacts['importances'] is None:
+                artifacts['importances'] = {
+                    key: float(value) for key, value in self._get_shap_importance(return_dir=True).items()
+                }
+                self._save_artifacts()
+            return dict(artifacts['importances'])
+        return self._get_shap_importance(config_space, return_dir, config_bench)
+
+    def _get_shap_importance(self, config_space=None, return_dir=False, config_bench=None):
         import shap
         from lightgbm import LGBMRegressor
         from terminaltables import AsciiTable
@@ -686,19 +844,18 @@ class HistoryContainer(object):
 
 
     def get_default_performance(self):
-        default_array = self.config_space.get_default_configuration().get_array()
-        default_list = list()
-        for i,config in enumerate(self.configurations):
-            if (config.get_array() == default_array).all():
-                default_list.append(self.get_transformed_perfs()[i])
-
-        if not len(default_list):
-            return self.get_transformed_perfs()[0]
-        else:
-            return  sum(default_list)/len(default_list)
+        return self.get_artifacts()['default_performance']
 
     def get_promising_space(self, quantile_threshold=0, respect=False):
-        y = - self.get_transformed_perfs()
+        promising_spaces = self.get_artifacts()['promising_spaces']
+        key = (quantile_threshold, respect)
+        if key not in promising_spaces:
+            promising_spaces[key] = self._get_promising_space(quantile_threshold, respect)
+        return promising_spaces[key].copy()
+
+    def _get_promising_space(self, quantile_threshold=0, respect=False):
+        artifacts = self.get_artifacts()
+        y = - artifacts['perfs']
         if quantile_threshold == 0:
             performance_threshold = - self.get_default_performance()
         else:
@@ -706,22 +863,18 @@ class HistoryContainer(object):
             if performance_threshold <  - self.get_default_performance() and not respect:
                 performance_threshold = - self.get_default_performance()
         performance_threshold=np.nextafter(performance_threshold, -np.inf)
-        X = convert_configurations_to_array(self.configurations)
+        X = artifacts['X']
 
         X_bad = X[y<performance_threshold]
         X_good = X[y>=performance_threshold]
         pruned_space = dict()
         importances = self.get_shap_importance(return_dir=True)
 
+        codec = get_codec(self.config_space)
         for j in range(X.shape[1]):
-            config = self.config_space.get_hyperparameter_names()[j]
-            if isinstance(self.config_space.get_hyperparameters()[j], CategoricalHyperparameter ):
-                good_values = np.unique(X_good[:, j])
-                true_values = list()
-                for t in range(good_values.shape[0]):
-                    value = good_values[t]
-                    true_value = Configuration(self.config_space, vector=X[X[:, j] == value][0])[config]
-                    true_values.append(true_value)
+            config = codec.names[j]
+            if isinstance(codec.columns[config].hp, CategoricalHyperparameter ):
+                true_values = codec.columns[config].decode(np.unique(X_good[:, j]))
 
                 pruned_space[config] = (true_values, None, importances[config] / abs(self.get_default_performance()))
                 continue
@@ -80,13 +80,34 @@ def parse_tpcc(file_path):
     return [tps, latency, tps]
 
 
+SYSBENCH_INTERVAL_PATTERN = re.compile(
+    "tps: (\d+.\d+) qps: (\d+.\d+) \(r/w/o: (\d+.\d+)/(\d+.\d+)/(\d+.\d+)\)"
+    " lat \(ms,95%\): (\d+.\d+) err/s: (\d+.\d+) reconn/s: (\d+.\d+)")
+
+
+def parse_sysbench_line(line):
+    """The tps, lat and qps of one interim report line of sysbench, or None."""
+    match = SYSBENCH_INTERVAL_PATTERN.search(line)
+    if match is None:
+        return None
+    return {'tps': float(match.group(1)), 'lat': float(match.group(6)), 'qps': float(match.group(2))}
+
+
+def parse_job_line(line):
+    """The latency (in seconds) of one query line written by run_job_*.sh, or None."""
+    fields = line.strip().split('\t')
+    if len(fields) < 2:
+        return None
+    try:
+        return {'lat': float(fields[-1]) / 1000}
+    except ValueError:
+        return None
+
+
 def parse_sysbench(file_path):
     with open(file_path) as f:
         lines = f.read()
-    temporal_pattern = re.compile(
-                "tps: (\d+.\d+) qps: (\d+.\d+) \(r/w/o: (\d+.\d+)/(\d+.\d+)/(\d+.\d+)\)"
-                " lat \(ms,95%\): (\d+.\d+) err/s: (\d+.\d+) reconn/s: (\d+.\d+)")
-    temporal = temporal_pattern.findall(lines)
+    temporal = SYSBENCH_INTERVAL_PATTERN.findall(lines)
     tps, latency, qps = 0, 0, 0
     tpsL, latL ,qpsL = [], [], []
     for i in temporal:
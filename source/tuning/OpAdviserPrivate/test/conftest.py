@@ -0,0 +1,5 @@
+import os
+import sys
+
+# autotune is imported as a top-level package, as when the tuner is run from this directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,117 @@
+from concurrent.futures import Future
+
+import numpy as np
+import pytest
+
+pytest.importorskip("ConfigSpace")
+pipleline = pytest.importorskip("autotune.pipleline.pipleline")
+
+from autotune.optimizer.ddpg_optimizer import DDPG_Optimizer
+from autotune.utils.config_space import ConfigurationSpace, UniformFloatHyperparameter
+from autotune.utils.constants import FAILED, SUCCESS
+from autotune.utils.history_container import HistoryContainer, Observation
+
+NUM_METRICS = 3
+INFO = {'objs': ['lat']}
+
+
+def make_space():
+    config_space = ConfigurationSpace(seed=0)
+    config_space.add_hyperparameters([UniformFloatHyperparameter('knob%d' % i, 0., 1., default_value=0.5)
+                                      for i in range(3)])
+    return config_space
+
+
+def internal_metrics(config):
+    vector = config.get_array()
+    return [float(vector.sum()), float(vector[0] ** 2), float(np.sin(vector[1]))]
+
+
+def make_source(task_id, config_space, rng):
+    history_container = HistoryContainer(task_id, config_space=config_space)
+    for config in config_space.sample_configuration(12):
+        history_container.update_observation(Observation(
+            config=config, objs=[float(rng.rand())], constraints=None, trial_state=SUCCESS,
+            elapsed_time=0, iter_time=0, EM={}, resource={}, IM=internal_metrics(config),
+            info=INFO, context=None))
+    return history_container
+
+
+def test_get_suggestions_with_workload_mapping(tmp_path, monkeypatch):
+    # The pipeline and the GPs of the mapping write their files in the working directory
+    monkeypatch.chdir(tmp_path)
+    rng = np.random.RandomState(0)
+    config_space = make_space()
+    sources = [make_source('source%d' % i, config_space, rng) for i in range(2)]
+    pipeline = pipleline.PipleLine(None, config_space, num_objs=1, surrogate_type='tlbo_mapping_prf',
+                                   acq_optimizer_type='local_random', history_bo_data=sources, initial_runs=3,
+                                   incremental='none', num_hps_init=-1, num_metrics=NUM_METRICS,
+                                   task_id='target', logging_dir=str(tmp_path / 'logs'))
+    for config in config_space.sample_configuration(5):
+        result = ([float(rng.rand())], None, {}, {}, internal_metrics(config), INFO, SUCCESS, [])
+        pipeline.update_observation(config, result, 0, 0)
+
+    configs = pipeline.get_suggestions(3)
+
+    assert len(configs) == 3
+    # The pending observations only live in the copies of the history
+    assert len(pipeline.history_container.configurations) == 5
+
+
+def test_pending_internal_metrics_are_the_median_of_successful_trials():
+    config_space = make_space()
+    history_container = HistoryContainer('target', config_space=config_space)
+    for im, trial_state in [([1., 4.], SUCCESS), ([3., 2.], SUCCESS), ([9., 9.], FAILED), ([], SUCCESS)]:
+        history_container.update_observation(Observation(
+            config=config_space.sample_configuration(), objs=[1.], constraints=None, trial_state=trial_state,
+            elapsed_time=0, iter_time=0, EM={}, resource={}, IM=im, info=INFO, context=None))
+    assert pipleline.PipleLine.get_pending_internal_metrics(history_container) == [2., 3.]
+
+
+class FakeEvaluator:
+    """Evaluates the configurations right away, as if on num_instances databases."""
+
+    num_instances = 4
+
+    def __init__(self, rng):
+        self.rng = rng
+
+    def submit(self, config):
+        future = Future()
+        future.set_result(([float(self.rng.rand())], None, {}, {}, internal_metrics(config), INFO, SUCCESS, []))
+        return future
+
+
+class FakeDDPG(DDPG_Optimizer):
+    def __init__(self, config_space):
+        self.config_space = config_space
+
+    def get_suggestion(self, history_container=None, compact_space=None):
+        return self.config_space.sample_configuration()
+
+
+@pytest.mark.parametrize('ddpg, batch_sizes', [(False, [3, 4, 3]), (True, [1] * 10)])
+def test_run_parallel_batch_sizes(tmp_path, monkeypatch, ddpg, batch_sizes):
+    monkeypatch.chdir(tmp_path)
+    rng = np.random.RandomState(0)
+    config_space = make_space()
+    pipeline = pipleline.PipleLine(None, config_space, num_objs=1, surrogate_type='prf',
+                                   acq_optimizer_type='local_random', initial_runs=3, incremental='none',
+                                   num_hps_init=-1, num_metrics=NUM_METRICS, task_id='target',
+                                   logging_dir=str(tmp_path / 'logs'), evaluator=FakeEvaluator(rng))
+    pipeline.max_iterations = 10
+    if ddpg:
+        pipeline.optimizer = FakeDDPG(config_space)
+    sizes = []
+    get_suggestions = pipeline.get_suggestions
+
+    def recording_get_suggestions(num, compact_space=None):
+        configs = get_suggestions(num, compact_space)
+        sizes.append(len(configs))
+        return configs
+
+    pipeline.get_suggestions = recording_get_suggestions
+    pipeline.run()
+
+    assert sizes == batch_sizes
+    assert len(pipeline.history_container.configurations) == 10
@@ -0,0 +1,36 @@
+import pytest
+
+dbenv = pytest.importorskip("autotune.dbenv")
+
+
+def make_env(workload, objective='tps', incumbent_perf=100.):
+    env = dbenv.DBEnv.__new__(dbenv.DBEnv)
+    env.workload = {'name': workload}
+    env.y_variable = [objective]
+    env.early_stop = True
+    env.early_stop_confidence = 0.99
+    env.early_stop_min_samples = 3
+    env.early_stop_margin = 0.
+    env.incumbent_perf = incumbent_perf
+    return env
+
+
+def test_stop_rule_for_sysbench():
+    env = make_env('sysbench')
+    _, parse_line = env.get_benchmark_stream('sysbench.log')
+    rule = env.get_stop_rule(parse_line)
+    assert rule is not None and rule.metric == 'tps' and rule.incumbent == 100.
+
+
+@pytest.mark.parametrize('workload', ['job', 'tpch', 'demo'])
+def test_no_stop_rule_for_query_latencies(workload):
+    # Per-query latencies in a fixed order are not exchangeable samples of the run
+    env = make_env(workload, objective='-lat')
+    _, parse_line = env.get_benchmark_stream('%s.log' % workload)
+    assert parse_line is not None
+    assert env.get_stop_rule(parse_line) is None
+
+
+def test_no_stop_rule_without_incumbent():
+    env = make_env('sysbench', incumbent_perf=None)
+    assert env.get_stop_rule(env.get_benchmark_stream('sysbench.log')[1]) is None
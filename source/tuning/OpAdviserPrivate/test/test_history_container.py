@@ -0,0 +1,100 @@
+import json
+
+import pytest
+
+history_container = pytest.importorskip("autotune.utils.history_container")
+from ConfigSpace import ConfigurationSpace, Configuration, UniformIntegerHyperparameter
+
+from autotune.utils.constants import SUCCESS
+from autotune.utils.history_container import HistoryContainer, Observation
+
+INFO = {'objs': ['tps'], 'constraints': []}
+
+
+@pytest.fixture
+def space():
+    cs = ConfigurationSpace()
+    cs.add_hyperparameter(UniformIntegerHyperparameter('knob', 0, 100, default_value=50))
+    return cs
+
+
+def observe(container, space, knob):
+    container.update_observation(Observation(
+        config=Configuration(space, {'knob': knob}), trial_state=SUCCESS, constraints=None,
+        objs=[-float(knob)], elapsed_time=1.0, iter_time=1.0, EM={'tps': float(knob)}, IM=[0.0],
+        resource={}, info=INFO, context=None))
+
+
+def load(fn, space):
+    container = HistoryContainer('task', config_space=space)
+    container.load_history_from_json(fn)
+    return container
+
+
+def knobs(container):
+    return [config['knob'] for config in container.configurations]
+
+
+def test_append_and_reload(tmp_path, space):
+    fn = str(tmp_path / 'history_task.jsonl')
+    container = HistoryContainer('task', config_space=space)
+    observe(container, space, 1)
+    container.append_jsonl(fn)
+    observe(container, space, 2)
+    container.append_jsonl(fn)
+    container.append_jsonl(fn)
+
+    container = load(fn, space)
+    assert knobs(container) == [1, 2]
+    observe(container, space, 3)
+    container.append_jsonl(fn)
+    assert knobs(load(fn, space)) == [1, 2, 3]
+    with open(fn) as fp:
+        assert len(fp.readlines()) == 4
+
+
+def test_append_after_skipped_records(tmp_path, space):
+    fn = str(tmp_path / 'history_task.jsonl')
+    container = HistoryContainer('task', config_space=space)
+    for knob in (1, 2):
+        observe(container, space, knob)
+    container.append_jsonl(fn)
+    # a record that is not valid in the space any more, e.g. after narrowing a knob range
+    record = json.loads(open(fn).readlines()[-1])
+    record['configuration']['knob'] = 1000
+    with open(fn, 'a') as fp:
+        fp.write(json.dumps(record) + '\n')
+
+    container = load(fn, space)
+    assert knobs(container) == [1, 2]
+    observe(container, space, 3)
+    container.append_jsonl(fn)
+    assert knobs(load(fn, space)) == [1, 2, 3]
+
+
+def test_torn_last_line_is_dropped(tmp_path, space):
+    fn = str(tmp_path / 'history_task.jsonl')
+    container = HistoryContainer('task', config_space=space)
+    observe(container, space, 1)
+    container.append_jsonl(fn)
+    with open(fn, 'a') as fp:
+        fp.write('{"configuration": {"kn')
+
+    container = load(fn, space)
+    assert knobs(container) == [1]
+    observe(container, space, 2)
+    container.append_jsonl(fn)
+    assert knobs(load(fn, space)) == [1, 2]
+
+
+def test_legacy_json_is_migrated(tmp_path, space):
+    container = HistoryContainer('task', config_space=space)
+    for knob in (1, 2):
+        observe(container, space, knob)
+    container.save_json(str(tmp_path / 'history_task.json'))
+
+    container = load(str(tmp_path / 'history_task.json'), space)
+    observe(container, space, 3)
+    fn = str(tmp_path / 'history_task.jsonl')
+    container.append_jsonl(fn)
+    assert knobs(load(fn, space)) == [1, 2, 3]
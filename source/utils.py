@@ -1,17 +1,23 @@
 import os
+import itertools
 import tqdm
 import sqlite3
+import threading
 from pathlib import Path
 from source.text2sql.ratsql.models.spider.spider_enc import (
     SpiderEncoderBertPreproc,
     Bertokens,
 )
+from source.text2sql.ratsql.models.spider.spider_match_utils import (
+    get_cell_value_index,
+)
 from source.text2sql.ratsql.datasets.spider import load_tables, SpiderItem
+from source.text2sql.ratsql.resources import lemmatizer
+from source.value_filling import ValueFiller, get_value_filler
 
 from typing import *
 
 import en_core_web_trf
-import psycopg2
 import spacy
 
 model = spacy.load("en_core_web_trf")
@@ -19,11 +25,22 @@ model = en_core_web_trf.load()
 
 
 class One_time_Preprocesser:
-    def __init__(self, db_path, table_path, preproc_args):
+    def __init__(self, db_path, table_path, preproc_args, preload_lemmas=False):
         self.enc_preproc = SpiderEncoderBertPreproc(**preproc_args)
         self.bert_version = preproc_args["bert_version"]
         self.schemas = load_tables([table_path], True)[0]
         self._conn(db_path)
+        if preload_lemmas:
+            self._preload_lemmas()
+
+    def _preload_lemmas(self):
+        # Lemmatize the vocabulary of all schemas in one CoreNLP request
+        lemmatizer.get_lemmatizer().preload(
+            word
+            for schema in self.schemas.values()
+            for item in itertools.chain(schema.tables, schema.columns)
+            for word in item.name
+        )
 
     def _conn(self, db_path):
         # Backup in-memory copies of all the DBs and create the live connections
@@ -38,6 +55,8 @@ class One_time_Preprocesser:
                     dest.row_factory = sqlite3.Row
                     source.backup(dest)
                 schema.connection = dest
+                # Build the cell value index once instead of scanning per question
+                get_cell_value_index(schema)
 
     def run(self, text, db_id):
         schema = self.schemas[db_id]
@@ -88,6 +107,69 @@ class One_time_Preprocesser:
         return spider_item, preproc_item
 
 
+class TurnContext:
+    """Preprocessing results shared by all modules handling one conversation turn.
+
+    Tokenization, schema linking and cell-value linking are computed at most once
+    per distinct input string and reused by text2sql, intent and confidence
+    analysis. Value filling only uses the text and history of the turn.
+    preprocess is thread-safe, so it can run in a worker while the turn is handled.
+    """
+
+    def __init__(
+        self,
+        preprocessor: One_time_Preprocesser,
+        text: str,
+        text_history: str,
+        db_id: str,
+    ):
+        """Initialize a turn context.
+
+        Args:
+            preprocessor: Shared preprocessor holding the schemas and DB connections
+            text: Current user query text
+            text_history: Conversation history before this turn
+            db_id: Database identifier for schema context
+        """
+        self.preprocessor = preprocessor
+        self.text = text
+        self.text_history = text_history
+        self.db_id = db_id
+        self._preprocessed: Dict[str, Tuple[Any, Any]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def input_text(self) -> str:
+        """Model input for this turn: current text followed by the history."""
+        return "<s> " + self.text + self.text_history
+
+    @property
+    def history(self) -> str:
+        """Conversation history including the current text."""
+        if self.text_history.endswith(self.text):
+            return self.text_history
+        return self.text_history + " <s> " + self.text
+
+    def preprocess(self, input_text: Optional[str] = None) -> Tuple[Any, Any]:
+        """Preprocess the input once and return the memoized result afterwards.
+
+        Args:
+            input_text: Text to preprocess (default: ``self.input_text``)
+
+        Returns:
+            Tuple of (orig_item, preproc_item) as returned by One_time_Preprocesser.run
+        """
+        if input_text is None:
+            input_text = self.input_text
+        # Callers wait for a preprocessing in progress instead of repeating it
+        with self._lock:
+            if input_text not in self._preprocessed:
+                self._preprocessed[input_text] = self.preprocessor.run(
+                    input_text, self.db_id
+                )
+            return self._preprocessed[input_text]
+
+
 def extract_nouns(
     sentence: str, enable_PROPN: bool = False, model: spacy.Language = model
 ) -> List[str]:
@@ -205,24 +287,26 @@ def token_score_to_word_score(
     return final_words, final_scores
 
 
-def all_values_from_db(db_name: str, table_name: str, column_name: str) -> List[str]:
-    # Connect to DB
-    pg_config = (
-        f"host=localhost port=5434 user=sqlbot password=sqlbot_pw dbname={db_name}"
-    )
-    # Find value from DB (For string values)
-    with psycopg2.connect(pg_config) as conn:
-        with conn.cursor() as cursor:
-            search_query = f"SELECT {column_name} FROM {table_name}"
-            cursor.execute(search_query)
-            results = cursor.fetchall()
-            if not results:
-                return []
-            return [str(result[0]) for result in results]
-
-
-def add_value_one_sql(question: str, db_name: str, sql: str, history: str) -> str:
+def all_values_from_db(
+    db_name: str,
+    table_name: str,
+    column_name: str,
+    filler: Optional[ValueFiller] = None,
+) -> List[str]:
+    # Distinct values, from the index of the value filler
+    filler = filler or get_value_filler()
+    return [str(value) for value in filler.column_values(db_name, table_name, column_name).values]
+
+
+def add_value_one_sql(
+    question: str,
+    db_name: str,
+    sql: str,
+    history: str,
+    filler: Optional[ValueFiller] = None,
+) -> str:
     """Assumption: There are no repeated values in the question."""
+    filler = filler or get_value_filler()
     # Parse history
     history_list = history.lower().split("<s>")
 
@@ -243,23 +327,22 @@ def add_value_one_sql(question: str, db_name: str, sql: str, history: str) -> st
         # Find table and column name
         tab_col = sql[:terminal_start_idx].strip().split(" ")[-2]
         table, column = tab_col.split(".")
-        # Find all possible values for the column
-        values = all_values_from_db(db_name, table, column)
-        # Check if any of the values are in the question
-        for value in values:
+        # Check if any of the values of the column are in the question
+        value = filler.find_value(db_name, table, column, target_text)
+        if value is not None:
+            value = str(value)
+            # Replace terminal with value
+            front_sub_sql = sql[:terminal_start_idx]
+            back_sub_sql = sql[terminal_end_idx:]
+            sql = front_sub_sql + f"'{value}'" + back_sub_sql
+
+            # Find the word position in the question and remove it (Remove only the first occurrence)
             if value.lower() in target_text:
-                # Replace terminal with value
-                front_sub_sql = sql[:terminal_start_idx]
-                back_sub_sql = sql[terminal_end_idx:]
-                sql = front_sub_sql + f"'{value}'" + back_sub_sql
-
-                # Find the word position in the question and remove it (Remove only the first occurrence)
                 start_idx = target_text.index(value.lower())
                 end_idx = start_idx + len(value)
                 target_text = target_text[:start_idx] + target_text[end_idx:]
                 target_text = target_text.replace("  ", " ")
-                found_flag = True
-                break
+            found_flag = True
 
         if not found_flag:
             flag = True
@@ -282,7 +365,9 @@ def infer_value_from_question(question, table, column, db, infer_value_cnt):
         words = sent.replace(".", "").replace("  ", " ").split(" ")
         return words
 
-    pg_config = "host=localhost port=5434 user=postgres password=postgres dbname=" + db
+    filler = get_value_filler(
+        "host=localhost port=5434 user=postgres password=postgres dbname={db}"
+    )
     # Try to find number values from string
     words = sent_to_words(question)
     values = [word for word in words if is_int(word)]
@@ -294,15 +379,11 @@ def infer_value_from_question(question, table, column, db, infer_value_cnt):
             increase_value_cnt()
             return values[tmp]
     # Find value from DB (For string values)
-    with psycopg2.connect(pg_config) as conn:
-        with conn.cursor() as cursor:
-            search_query = f"SELECT {column} FROM {table}"
-            cursor.execute(search_query)
-            results = cursor.fetchall()
-            if not results:
-                return "value_not_found"
-            for result in results:
-                if str(result[0]) in question:
-                    return result[0]
-
-            return result[0][0]
+    values = filler.column_values(db, table, column).values
+    if not values:
+        return "value_not_found"
+    for value in values:
+        if str(value) in question:
+            return value
+
+    return values[-1][0]
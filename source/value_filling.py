@@ -0,0 +1,250 @@
+import re
+import time
+import queue
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from typing import *
+
+logger = logging.getLogger(__name__)
+
+PG_DSN_TEMPLATE = "host=localhost port=5434 user=sqlbot password=sqlbot_pw dbname={db}"
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def normalize(text: str) -> str:
+    """Lower-cased words separated by single spaces, used to match values against question n-grams."""
+    return " ".join(WORD_PATTERN.findall(str(text).lower()))
+
+
+def postgres_connector(dsn_template: str = PG_DSN_TEMPLATE) -> Callable[[str], Any]:
+    """Returns a function opening a psycopg2 connection to a database by name."""
+    import psycopg2
+
+    def connect(db_name: str):
+        conn = psycopg2.connect(dsn_template.format(db=db_name))
+        # Value lookups only read, don't keep a transaction open between them
+        conn.autocommit = True
+        return conn
+
+    return connect
+
+
+def sqlite_connector(path_template: str) -> Callable[[str], Any]:
+    """Returns a function opening a read-only SQLite database by name."""
+
+    def connect(db_name: str):
+        uri = "file:{}?mode=ro".format(path_template.format(db=db_name))
+        return sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+    return connect
+
+
+class ConnectionPool:
+    """At most max_connections open connections per database, reused across requests."""
+
+    def __init__(self, connect: Callable[[str], Any], max_connections: int = 4):
+        self.connect = connect
+        self.max_connections = max_connections
+        self._idle: Dict[str, "queue.LifoQueue"] = {}
+        self._slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    def _queues(self, db_name: str):
+        with self._lock:
+            if db_name not in self._idle:
+                self._idle[db_name] = queue.LifoQueue()
+                self._slots[db_name] = threading.BoundedSemaphore(self.max_connections)
+            return self._idle[db_name], self._slots[db_name]
+
+    @contextmanager
+    def connection(self, db_name: str):
+        """Borrows a connection, waiting while max_connections are in use."""
+        idle, slots = self._queues(db_name)
+        slots.acquire()
+        try:
+            try:
+                conn = idle.get_nowait()
+            except queue.Empty:
+                conn = self.connect(db_name)
+            try:
+                yield conn
+            except Exception:
+                # The connection may be in a failed state, don't reuse it
+                conn.close()
+                raise
+            idle.put(conn)
+        finally:
+            slots.release()
+
+    def close(self) -> None:
+        with self._lock:
+            for idle in self._idle.values():
+                while not idle.empty():
+                    idle.get_nowait().close()
+
+
+class ColumnValues:
+    """Distinct values of one column, indexed by their normalized text."""
+
+    def __init__(self, values: List[Any], version: Any):
+        self.values = values
+        self.version = version
+        self.checked = time.monotonic()
+        self.by_text: Dict[str, Any] = {}
+        for value in values:
+            self.by_text.setdefault(normalize(value), value)
+        self.by_text.pop("", None)
+        self.max_words = max((key.count(" ") + 1 for key in self.by_text), default=0)
+
+    def match(self, text: str) -> Optional[Any]:
+        """The value matching the longest n-gram of the text, the earliest one on ties."""
+        words = WORD_PATTERN.findall(text.lower())
+        for n in range(min(self.max_words, len(words)), 0, -1):
+            for start in range(len(words) - n + 1):
+                value = self.by_text.get(" ".join(words[start : start + n]))
+                if value is not None:
+                    return value
+        return None
+
+
+class ValueFiller:
+    """Fills value placeholders of generated SQL from in-memory indexes of column values.
+
+    The distinct values of a (table, column) are read once, up to row_cap of
+    them, through a bounded connection pool. The index is rebuilt when the
+    version of the table (its schema or row counters) changes; the version is
+    checked at most every refresh_interval_sec seconds, always on the same
+    connection of the database since SQLite counters are per connection.
+    """
+
+    def __init__(
+        self,
+        connect: Optional[Callable[[str], Any]] = None,
+        max_connections: int = 4,
+        row_cap: int = 100000,
+        refresh_interval_sec: float = 30.0,
+    ):
+        """Initialize the value filler.
+
+        Args:
+            connect: Opens a connection to a database by name (default: the local Postgres server)
+            max_connections: Maximum number of pooled connections per database (plus one for version checks)
+            row_cap: Maximum number of distinct values indexed per column
+            refresh_interval_sec: Minimum time between two version checks of a column
+        """
+        self.pool = ConnectionPool(connect or postgres_connector(), max_connections)
+        self.row_cap = row_cap
+        self.refresh_interval_sec = refresh_interval_sec
+        self._columns: Dict[Tuple[str, str, str], ColumnValues] = {}
+        self._lock = threading.Lock()
+        self._version_conns: Dict[str, Any] = {}
+        self._version_lock = threading.Lock()
+
+    @staticmethod
+    def _is_sqlite(conn) -> bool:
+        return isinstance(conn, sqlite3.Connection)
+
+    def _table_version(self, conn, table: str) -> Any:
+        if self._is_sqlite(conn):
+            return tuple(
+                conn.execute(f"PRAGMA {pragma}").fetchone()[0]
+                for pragma in ("schema_version", "data_version")
+            ) + (conn.total_changes,)
+        with conn.cursor() as cursor:
+            # pg_class.xmin changes with ALTER TABLE, the counters with writes.
+            # to_regclass resolves the name like the value query does (search_path, case folding)
+            cursor.execute(
+                "SELECT c.xmin::text, COALESCE(s.n_tup_ins + s.n_tup_upd + s.n_tup_del, 0) "
+                "FROM pg_class c LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid "
+                "WHERE c.oid = to_regclass(%s)",
+                (table,),
+            )
+            return cursor.fetchone()
+
+    def _checked_version(self, db_name: str, table: str) -> Any:
+        """The version of the table, read on the version connection of the database."""
+        with self._version_lock:
+            conn = self._version_conns.get(db_name)
+            if conn is None:
+                conn = self._version_conns[db_name] = self.pool.connect(db_name)
+            try:
+                return self._table_version(conn, table)
+            except Exception:
+                # The connection may be in a failed state, don't reuse it
+                self._version_conns.pop(db_name).close()
+                raise
+
+    def _read_values(self, conn, table: str, column: str) -> List[Any]:
+        query = (
+            f"SELECT DISTINCT {column} FROM {table} "
+            f"WHERE {column} IS NOT NULL LIMIT {int(self.row_cap)}"
+        )
+        if self._is_sqlite(conn):
+            return [row[0] for row in conn.execute(query)]
+        with conn.cursor() as cursor:
+            cursor.execute(query)
+            return [row[0] for row in cursor.fetchall()]
+
+    def column_values(self, db_name: str, table: str, column: str) -> ColumnValues:
+        """The up-to-date value index of the column."""
+        key = (db_name, table.lower(), column.lower())
+        with self._lock:
+            entry = self._columns.get(key)
+        if entry is not None and time.monotonic() - entry.checked < self.refresh_interval_sec:
+            return entry
+        version = self._checked_version(db_name, table)
+        # A table whose version is unknown is read again at every check
+        if entry is not None and version is not None and entry.version == version:
+            entry.checked = time.monotonic()
+            return entry
+        with self.pool.connection(db_name) as conn:
+            start = time.monotonic()
+            entry = ColumnValues(self._read_values(conn, table, column), version)
+        logger.info(
+            f"Indexed {len(entry.values)} values of {db_name}.{table}.{column} "
+            f"in {time.monotonic() - start:.3f}s"
+        )
+        with self._lock:
+            self._columns[key] = entry
+        return entry
+
+    def find_value(self, db_name: str, table: str, column: str, text: str) -> Optional[Any]:
+        """The value of the column mentioned in the text, or None.
+
+        Values matching a whole n-gram of the text are preferred; otherwise a
+        value contained in the text (e.g. followed by a suffix) is taken.
+        """
+        entry = self.column_values(db_name, table, column)
+        value = entry.match(text)
+        if value is not None:
+            return value
+        text = text.lower()
+        for value in entry.values:
+            if str(value).lower() in text:
+                return value
+        return None
+
+    def close(self) -> None:
+        with self._version_lock:
+            for conn in self._version_conns.values():
+                conn.close()
+            self._version_conns.clear()
+        self.pool.close()
+
+
+_default_fillers: Dict[Tuple[str, Tuple], ValueFiller] = {}
+_default_lock = threading.Lock()
+
+
+def get_value_filler(dsn_template: str = PG_DSN_TEMPLATE, **kwargs) -> ValueFiller:
+    """The shared value filler of the Postgres server described by dsn_template.
+
+    Calls with the same dsn_template and keyword arguments share one instance.
+    """
+    key = (dsn_template, tuple(sorted(kwargs.items())))
+    with _default_lock:
+        if key not in _default_fillers:
+            _default_fillers[key] = ValueFiller(postgres_connector(dsn_template), **kwargs)
+        return _default_fillers[key]
@@ -0,0 +1,244 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+spider_beam_search = pytest.importorskip(
+    "source.text2sql.ratsql.models.spider.spider_beam_search"
+)
+
+from source.text2sql.ratsql.beam_search import Hypothesis
+from source.text2sql.ratsql.datasets.spider import SpiderItem, create_schema
+from source.text2sql.ratsql.models.enc_dec import EncDecModel
+from source.text2sql.ratsql.models.nl2code.decoder import (
+    NL2CodeDecoder,
+    NL2CodeDecoderPreprocItem,
+)
+from source.text2sql.ratsql.models.spider.spider_enc import SpiderEncoderState
+
+SCHEMA = {
+    "db_id": "concert_singer",
+    "table_names": ["singer", "concert"],
+    "table_names_original": ["singer", "concert"],
+    "column_names": [
+        [-1, "*"],
+        [0, "singer id"],
+        [0, "name"],
+        [0, "country"],
+        [0, "age"],
+        [1, "concert id"],
+        [1, "concert name"],
+        [1, "singer id"],
+    ],
+    "column_names_original": [
+        [-1, "*"],
+        [0, "singer_id"],
+        [0, "name"],
+        [0, "country"],
+        [0, "age"],
+        [1, "concert_id"],
+        [1, "concert_name"],
+        [1, "singer_id"],
+    ],
+    "column_types": ["text", "number", "text", "text", "number", "number", "text", "number"],
+    "foreign_keys": [[7, 1]],
+    "primary_keys": [1, 5],
+}
+GRAMMAR = {
+    "name": "spider",
+    "output_from": True,
+    "use_table_pointer": True,
+    "include_literals": False,
+    "end_with_from": True,
+    "infer_from_conditions": True,
+    "factorize_sketch": 2,
+}
+SIZE = 16
+
+
+def col(col_id, agg=0):
+    return (0, (agg, col_id, False), None)
+
+
+def sql(select, tables, where=(), group_by=(), order_by=(), limit=None):
+    """A query in the Spider json format."""
+    return {
+        "select": (False, [(0, val_unit) for val_unit in select]),
+        "from": {"table_units": [("table_unit", table) for table in tables], "conds": []},
+        "where": list(where),
+        "groupBy": [(0, col_id, False) for col_id in group_by],
+        "having": [],
+        "orderBy": list(order_by),
+        "limit": limit,
+        "intersect": None,
+        "union": None,
+        "except": None,
+    }
+
+
+QUERIES = [
+    sql([col(0, agg=3)], [0]),
+    sql([col(2), col(3)], [0], where=[(False, 3, col(4), 20.0, None)], order_by=("desc", [col(4)])),
+    sql([col(2)], [0, 1], group_by=[1]),
+    sql([col(3), col(4, agg=5)], [0], group_by=[3]),
+    sql([col(6)], [1], where=[(False, 2, col(7), 1.0, None)]),
+    sql([col(2)], [0], order_by=("asc", [col(4)]), limit=3),
+]
+
+
+class TinyEncoder(torch.nn.Module):
+    """Encodes question token ids, with one memory slot per column and table."""
+
+    batched = True
+
+    def __init__(self):
+        super().__init__()
+        self.question_embedding = torch.nn.Embedding(16, SIZE)
+        self.column_embedding = torch.nn.Embedding(len(SCHEMA["column_names"]), SIZE)
+        self.table_embedding = torch.nn.Embedding(len(SCHEMA["table_names"]), SIZE)
+
+    def forward(self, enc_inputs):
+        enc_states = []
+        for enc_input in enc_inputs:
+            question = self.question_embedding(torch.tensor(enc_input["question"]))
+            columns = self.column_embedding.weight + question.mean(0)
+            tables = self.table_embedding.weight + question.mean(0)
+            memory = torch.cat((question, columns, tables))
+            enc_states.append(
+                SpiderEncoderState(
+                    state=None,
+                    memory=memory.unsqueeze(0),
+                    question_memory=question.unsqueeze(0),
+                    schema_memory=torch.cat((columns, tables)).unsqueeze(0),
+                    words=enc_input["question"],
+                    pointer_memories={
+                        "column": columns.unsqueeze(0),
+                        "table": tables.unsqueeze(0),
+                    },
+                    pointer_maps={},
+                    m2c_align_mat=torch.softmax(memory @ columns.T, dim=1),
+                    m2t_align_mat=torch.softmax(memory @ tables.T, dim=1),
+                )
+            )
+        return enc_states
+
+
+def make_enc_input(i):
+    return {
+        "question": [i, i + 3, i + 7],
+        "columns": [[]] * len(SCHEMA["column_names"]),
+        "tables": [[]] * len(SCHEMA["table_names"]),
+    }
+
+
+@pytest.fixture(scope="module")
+def model(tmp_path_factory):
+    """A tiny EncDec model, fitted for a few epochs so that the beams finish."""
+    schema = create_schema(SCHEMA)
+    dec_preproc = NL2CodeDecoder.Preproc(
+        GRAMMAR, str(tmp_path_factory.mktemp("preproc")), min_freq=1
+    )
+    dec_items = []
+    for query in QUERIES:
+        item = SpiderItem(
+            text=[], code=query, schema=schema, orig={"query": ""}, orig_schema=SCHEMA
+        )
+        is_valid, tree = dec_preproc.validate_item(item, "train")
+        assert is_valid
+        dec_items.append(
+            NL2CodeDecoderPreprocItem(*dec_preproc.add_item(item, "train", tree))
+        )
+    dec_preproc.save()
+    dec_preproc.load()
+
+    torch.manual_seed(0)
+    model = EncDecModel.__new__(EncDecModel)
+    torch.nn.Module.__init__(model)
+    model.encoder = TinyEncoder()
+    model.decoder = NL2CodeDecoder(
+        "cpu",
+        dec_preproc,
+        rule_emb_size=SIZE,
+        node_embed_size=8,
+        enc_recurrent_size=SIZE,
+        recurrent_size=SIZE,
+        use_align_mat=True,
+    )
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.01)
+    for _ in range(10):
+        for i, dec_item in enumerate(dec_items):
+            enc_input = make_enc_input(i)
+            (desc_enc,) = model.encoder([enc_input])
+            loss = model.decoder.compute_loss(enc_input, dec_item, desc_enc, False)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+    model.eval()
+    model.orig_item = SpiderItem(
+        text=[], code=None, schema=schema, orig={}, orig_schema=SCHEMA
+    )
+    return model
+
+
+def test_batched_beam_search_matches_unbatched(model):
+    preproc_items = [(make_enc_input(i), None) for i in range(len(QUERIES))]
+    orig_items = [model.orig_item] * len(preproc_items)
+    with torch.no_grad():
+        begun = model.begin_inference_batch(orig_items, preproc_items)
+        for orig_item, preproc_item, item_begun in zip(orig_items, preproc_items, begun):
+            expected = spider_beam_search.beam_search_with_heuristics(
+                model, orig_item, preproc_item, beam_size=3, max_steps=150
+            )
+            beams = spider_beam_search.beam_search_with_heuristics(
+                model,
+                orig_item,
+                preproc_item,
+                beam_size=3,
+                max_steps=150,
+                batched=True,
+                begun=item_begun,
+            )
+            assert expected
+            assert [hyp.choice_history for hyp in beams] == [
+                hyp.choice_history for hyp in expected
+            ]
+            # The batched state update only differs by float32 rounding
+            assert [hyp.score for hyp in beams] == pytest.approx(
+                [hyp.score for hyp in expected], rel=1e-5
+            )
+
+
+def test_begin_inference_batch_matches_begin_inference(model):
+    preproc_items = [(make_enc_input(i), None) for i in range(3)]
+    with torch.no_grad():
+        begun = model.begin_inference_batch([model.orig_item] * 3, preproc_items)
+        for preproc_item, (_, next_choices) in zip(preproc_items, begun):
+            _, expected = model.begin_inference(model.orig_item, preproc_item)
+            assert [choice for choice, _ in next_choices] == [
+                choice for choice, _ in expected
+            ]
+            assert torch.equal(
+                torch.stack([score for _, score in next_choices]),
+                torch.stack([score for _, score in expected]),
+            )
+
+
+def test_top_candidates_breaks_ties_like_the_list_sort():
+    scores = [[0.0, -1.0, -1.0, -2.0], [-1.0, -1.0, 0.0], [-1.0]]
+    hyps = [
+        Hypothesis(
+            None,
+            [(f"{i}.{j}", torch.tensor(score)) for j, score in enumerate(hyp_scores)],
+            score=-float(i > 0),
+        )
+        for i, hyp_scores in enumerate(scores)
+    ]
+    expected = sorted(
+        [
+            (hyp, choice, choice_score.item(), hyp.score + choice_score.item())
+            for hyp in hyps
+            for choice, choice_score in hyp.next_choices
+        ],
+        key=lambda candidate: candidate[3],
+        reverse=True,
+    )
+    for k in range(len(expected) + 2):
+        assert spider_beam_search.top_candidates(hyps, k) == expected[:k]
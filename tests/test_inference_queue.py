@@ -0,0 +1,28 @@
+import pytest
+
+serving = pytest.importorskip("source.serving")
+
+
+@pytest.fixture
+def inference_queue():
+    # The wait is long enough for the three requests of a test to share one micro-batch
+    return serving.InferenceQueue(
+        {
+            "double": lambda payloads: [2 * payload for payload in payloads],
+            "short": lambda payloads: [2 * payload for payload in payloads[1:]],
+        },
+        max_batch_size=3,
+        max_wait_ms=1000,
+    )
+
+
+def test_results_in_order(inference_queue):
+    futures = [inference_queue.submit("double", payload) for payload in [1, 2, 3]]
+    assert [future.result(timeout=5) for future in futures] == [2, 4, 6]
+
+
+def test_missing_results_fail_every_request(inference_queue):
+    futures = [inference_queue.submit("short", payload) for payload in [1, 2, 3]]
+    for future in futures:
+        with pytest.raises(RuntimeError, match="2 results for 3 requests"):
+            future.result(timeout=5)
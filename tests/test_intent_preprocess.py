@@ -0,0 +1,49 @@
+import pytest
+
+intent_inferer = pytest.importorskip("source.text2intent.intent_inferer")
+
+from source.utils import TurnContext
+
+
+class FakePreprocessor:
+    """Tokenizes on spaces and links the tokens naming a column, like the schema linking."""
+
+    columns = {"singers", "s", "name"}
+
+    def __init__(self):
+        self.calls = []
+
+    def run(self, text, db_id):
+        self.calls.append(text)
+        question = text.split(" ")
+        sc_link = {
+            "q_col_match": {
+                f"{i},0": "CEM" for i, token in enumerate(question) if token in self.columns
+            }
+        }
+        return {"question": text}, {"raw_question": text, "question": question, "sc_link": sc_link}
+
+
+@pytest.fixture
+def inferer():
+    inferer = intent_inferer.IntentInferer.__new__(intent_inferer.IntentInferer)
+    inferer.preprocessor = FakePreprocessor()
+    return inferer
+
+
+@pytest.mark.parametrize(
+    "text, text_history, expected_text",
+    [
+        ("how many singers", "", "how many singers"),
+        ("list their name", " <s> how many singers", "list their name [CLS] how many singers"),
+    ],
+)
+def test_turn_item_matches_direct_preprocessing(inferer, text, text_history, expected_text):
+    turn = TurnContext(inferer.preprocessor, text, text_history, "concert_singer")
+    [item] = inferer.preprocess(turn.input_text, "concert_singer", turn=turn)
+    [direct_item] = inferer.preprocess(turn.input_text, "concert_singer")
+    _, expected = FakePreprocessor().run(expected_text, "concert_singer")
+    assert item == direct_item == expected
+    # The item is memoized in the turn
+    assert inferer.preprocess(turn.input_text, "concert_singer", turn=turn) == [item]
+    assert inferer.preprocessor.calls == [expected_text, expected_text]
@@ -0,0 +1,71 @@
+from types import SimpleNamespace
+
+import pytest
+
+corenlp = pytest.importorskip("source.text2sql.ratsql.resources.corenlp")
+lemmatizer = pytest.importorskip("source.text2sql.ratsql.resources.lemmatizer")
+
+
+def make_annotation(lines):
+    return SimpleNamespace(
+        sentence=[
+            SimpleNamespace(token=[SimpleNamespace(lemma=word.rstrip("s")) for word in line.split()])
+            for line in lines
+        ]
+    )
+
+
+class FakeCoreNLP:
+    """Lemmatizes by stripping a plural "s", one sentence per line."""
+
+    def __init__(self, merge_lines=False):
+        self.merge_lines = merge_lines
+        self.calls = []
+
+    def __call__(self, text, annotators=None, output_format=None, properties=None):
+        self.calls.append((text, properties))
+        lines = text.split("\n")
+        return make_annotation([" ".join(lines)] if self.merge_lines else lines)
+
+
+def test_lemmatize_sends_uncached_words_in_one_request(monkeypatch):
+    fake = FakeCoreNLP()
+    monkeypatch.setattr(corenlp, "annotate", fake)
+    lem = lemmatizer.Lemmatizer()
+
+    assert lem.lemmatize(["Singers", "ages", "Singers", " "]) == ["singer", "age", "singer", ""]
+    assert fake.calls == [("Singers\nages", lemmatizer.ONE_WORD_PER_SENTENCE)]
+
+    assert lem.lemmatize(["ages", "songs"]) == ["age", "song"]
+    assert fake.calls[1] == ("songs", lemmatizer.ONE_WORD_PER_SENTENCE)
+
+
+def test_lemmatize_falls_back_to_one_request_per_word(monkeypatch):
+    fake = FakeCoreNLP(merge_lines=True)
+    monkeypatch.setattr(corenlp, "annotate", fake)
+
+    assert lemmatizer.Lemmatizer().lemmatize(["cats", "dogs"]) == ["cat", "dog"]
+    assert [text for text, _ in fake.calls] == ["cats\ndogs", "cats", "dogs"]
+
+
+def test_lemmatizer_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(corenlp, "annotate", FakeCoreNLP())
+    lem = lemmatizer.Lemmatizer(max_size=2)
+    lem.preload(["a", "b", "c"])
+    assert list(lem.cache) == ["b", "c"]
+
+
+def test_corenlp_passes_properties_by_keyword():
+    class Client:
+        # Signature of stanfordnlp.server.CoreNLPClient.annotate
+        def annotate(self, text, annotators=None, output_format=None, properties_key=None, properties=None):
+            self.received = (properties_key, properties)
+            return make_annotation(text.split("\n"))
+
+        def stop(self):
+            pass
+
+    wrapper = corenlp.CoreNLP.__new__(corenlp.CoreNLP)
+    wrapper.client = Client()
+    wrapper.annotate("a\nb", annotators=lemmatizer.LEMMA_ANNOTATORS, properties=lemmatizer.ONE_WORD_PER_SENTENCE)
+    assert wrapper.client.received == (None, lemmatizer.ONE_WORD_PER_SENTENCE)
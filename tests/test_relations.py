@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+bench_relations = pytest.importorskip("source.text2sql.ratsql.commands.bench_relations")
+
+
+def make_schema(rng, db_id, num_tables, max_columns):
+    """A random Spider tables.json entry, with foreign keys between the tables."""
+    column_names = [[-1, "*"]]
+    primary_keys = []
+    for table in range(num_tables):
+        primary_keys.append(len(column_names))
+        for column in range(rng.randint(1, max_columns + 1)):
+            column_names.append([table, f"t{table} c{column}"])
+    foreign_keys = []
+    for src in range(1, len(column_names)):
+        if rng.rand() < 0.2:
+            foreign_keys.append([src, int(rng.choice(primary_keys))])
+    return {
+        "db_id": db_id,
+        "column_names": column_names,
+        "table_names": [f"table {table}" for table in range(num_tables)],
+        "foreign_keys": foreign_keys,
+        "primary_keys": primary_keys,
+    }
+
+
+@pytest.mark.parametrize("config_name", sorted(bench_relations.CONFIGS))
+@pytest.mark.parametrize("seed", range(5))
+def test_compute_relations_matches_loop(config_name, seed):
+    update = bench_relations.RelationalTransformerUpdate(
+        "cpu", num_layers=1, num_heads=1, hidden_size=8, **bench_relations.CONFIGS[config_name]
+    )
+    rng = np.random.RandomState(seed)
+    for i in range(3):
+        schema_dict = make_schema(rng, f"db{seed}_{i}", rng.randint(1, 6), 6)
+        desc, kwargs = bench_relations.make_inputs(
+            rng, schema_dict, q_length=rng.randint(1, 20), max_tokens=3, density=0.05
+        )
+        expected = update._compute_relations_loop(desc, **kwargs)
+        # The first call builds the schema relations, the second one reuses them
+        np.testing.assert_array_equal(update.compute_relations(desc, **kwargs), expected)
+        np.testing.assert_array_equal(update.compute_relations(desc, **kwargs), expected)
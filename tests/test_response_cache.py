@@ -0,0 +1,73 @@
+import pytest
+
+serving = pytest.importorskip("source.serving")
+
+RESPONSE = {"pred_sql": "SELECT count(*) FROM singer", "confidence": "93.10", "user_intent": ["select"]}
+
+
+class BrokenRedis:
+    def pipeline(self, transaction=True):
+        raise ConnectionError("redis is down")
+
+
+@pytest.fixture
+def redis_client():
+    fakeredis = pytest.importorskip("fakeredis")
+    return fakeredis.FakeRedis()
+
+
+def test_round_trip_local():
+    cache = serving.ResponseCache("text2sql")
+    assert cache.get("concert_singer:a") is None
+    cache.set("concert_singer:a", RESPONSE)
+    assert cache.get("concert_singer:a") == RESPONSE
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_non_string_keys_round_trip():
+    value = {"analyse_result": {0: "singer", 1: "concert"}}
+    assert serving.loads(serving.dumps(value)) == value
+
+
+def test_undecodable_entry_is_a_miss():
+    cache = serving.ResponseCache("text2sql")
+    cache.local.set("concert_singer:a", b"?garbage")
+    assert cache.get("concert_singer:a") is None
+    assert cache.stats()["hits"] == 0 and cache.stats()["misses"] == 1
+
+
+def test_local_lru_eviction():
+    cache = serving.ResponseCache("text2sql", max_entries=2)
+    for key in "abc":
+        cache.set(key, RESPONSE)
+    assert cache.get("a") is None
+    assert cache.get("c") == RESPONSE
+    assert cache.stats()["evictions"] == 1
+
+
+def test_round_trip_redis(redis_client):
+    cache = serving.ResponseCache("text2sql", client=redis_client, ttl_sec=60)
+    cache.set("concert_singer:a", RESPONSE)
+    assert cache.get("concert_singer:a") == RESPONSE
+    assert redis_client.ttl("concert_singer:a") > 0
+    assert cache.stats()["backend"] == "redis" and len(cache.local) == 0
+
+
+def test_redis_lru_eviction(redis_client):
+    cache = serving.ResponseCache("text2sql", client=redis_client, max_entries=2)
+    cache.set("a", RESPONSE)
+    cache.set("b", RESPONSE)
+    # Reading "a" makes "b" the least recently used entry
+    cache.get("a")
+    cache.set("c", RESPONSE)
+    assert cache.get("b") is None
+    assert cache.get("a") == RESPONSE and cache.get("c") == RESPONSE
+    assert cache.stats()["evictions"] == 1
+
+
+def test_falls_back_to_local_when_redis_fails():
+    cache = serving.ResponseCache("text2sql", client=BrokenRedis())
+    cache.set("concert_singer:a", RESPONSE)
+    assert cache.get("concert_singer:a") == RESPONSE
+    stats = cache.stats()
+    assert stats["backend"] == "local" and stats["errors"] == 1
@@ -0,0 +1,74 @@
+import sqlite3
+
+import pytest
+
+value_filling = pytest.importorskip("source.value_filling")
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "concert_singer.sqlite")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE singer (name TEXT, country TEXT)")
+    conn.executemany(
+        "INSERT INTO singer VALUES (?, ?)",
+        [("Joe Sharp", "Netherlands"), ("Rose White", "United States")],
+    )
+    conn.commit()
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def filler(db_path):
+    filler = value_filling.ValueFiller(
+        value_filling.sqlite_connector(db_path), refresh_interval_sec=0
+    )
+    reads = []
+    read_values = filler._read_values
+
+    def counting_read_values(conn, table, column):
+        reads.append((table, column))
+        return read_values(conn, table, column)
+
+    filler._read_values = counting_read_values
+    filler.reads = reads
+    yield filler
+    filler.close()
+
+
+def test_find_value(filler):
+    question = "how many singers are from the united states"
+    assert filler.find_value("concert_singer", "singer", "country", question) == "United States"
+    assert filler.find_value("concert_singer", "singer", "country", "singers of france") is None
+
+
+def test_unchanged_table_is_not_read_again(filler):
+    filler.column_values("concert_singer", "singer", "country")
+    # Hold a pooled connection, so that other connections are opened meanwhile
+    with filler.pool.connection("concert_singer"):
+        with filler.pool.connection("concert_singer"):
+            filler.column_values("concert_singer", "singer", "country")
+    filler.column_values("concert_singer", "singer", "country")
+    assert len(filler.reads) == 1
+
+
+def test_write_refreshes_index(filler, db_path):
+    assert filler.find_value("concert_singer", "singer", "country", "singers from france") is None
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO singer VALUES ('Anne Marie', 'France')")
+    conn.commit()
+    conn.close()
+    assert filler.find_value("concert_singer", "singer", "country", "singers from france") == "France"
+    # A connection opened after the write must not look like another change
+    with filler.pool.connection("concert_singer"):
+        filler.column_values("concert_singer", "singer", "country")
+    assert len(filler.reads) == 2
+
+
+def test_shared_fillers_are_keyed_by_arguments():
+    pytest.importorskip("psycopg2")
+    dsn = "host=localhost dbname={db}"
+    assert value_filling.get_value_filler(dsn) is value_filling.get_value_filler(dsn)
+    assert value_filling.get_value_filler(dsn, row_cap=10).row_cap == 10
+    assert value_filling.get_value_filler(dsn, row_cap=10) is not value_filling.get_value_filler(dsn)